@@ -8,8 +8,9 @@ Bid generator for bids to be part of input data
 import pandas as pd
 import numpy as np
 import collections
+import copy
 
-#Object containing bid information 
+#Object containing bid information. Volumes and prices are stored column-wise as (bid x period) arrays, and each Bid is a view of its row 
 class Bids:
     def __init__(self):
         self.fullDict = dict()
@@ -18,36 +19,181 @@ class Bids:
         self.nodeBids = collections.defaultdict(list)
         self.participantBids = collections.defaultdict(list)
         
+        self.volumeArray = None                         #Bid volumes, rows in the order of fullDict and columns in the order of periodIndex
+        self.priceArray = None                          #Bid prices
+        self.periodIndex = dict()                       #Column of each period
+        self.rowIndex = dict()                          #Row of each bid
+        self.pending = list()                           #Bids added since the arrays were last stacked
+        self.indexSets = None                           #Immutable tuples of bid IDs for each (direction, kind, node, participant), see getBids
+        
     def __getitem__(self, ID):
         return self.fullDict[ID]
-
+    
+    #Bid volumes as an array, stacking the bids added since the last call
+    @property
+    def Volume(self):
+        self.consolidate()
+        return self.volumeArray
+    
+    #Bid prices as an array
+    @property
+    def Price(self):
+        self.consolidate()
+        return self.priceArray
+    
+    #Function adding a bid to the collection
+    def add(self,bid):
+        self.fullDict[bid.ID] = bid
+        self.rowIndex[bid.ID] = len(self.rowIndex)
+        if bid.Direction == "Up":
+            self.upBids.append(bid.ID)
+        else:
+            self.downBids.append(bid.ID)
+        self.nodeBids[bid.Node].append(bid.ID)
+        self.participantBids[bid.Participant].append(bid.ID)
+        bid.store = self
+        bid.row = self.rowIndex[bid.ID]
+        self.pending.append(bid)
+        self.indexSets = None
+    
+    #Bids of a direction ("Up", "Down" or "All") as a tuple in the order they were added. Kind is "All", "Flex" or "Re-dispatch",
+    #and the bids can be limited to one node or one participant
+    def getBids(self,direction,kind="All",node=None,participant=None):
+        if self.indexSets is None:
+            self.indexSets = self.createIndexSets()
+        return self.indexSets.get((direction,kind,node,participant),())
+    
+    #Function grouping the bid IDs once, so the models do not have to filter the bids in every constraint
+    def createIndexSets(self):
+        index = collections.defaultdict(list)
+        for ID,bid in self.fullDict.items():
+            kind = "Re-dispatch" if bid.Participant == "Re-dispatch" else "Flex"
+            for direction in (bid.Direction,"All"):
+                for k in ("All",kind):
+                    index[(direction,k,None,None)].append(ID)
+                    index[(direction,k,bid.Node,None)].append(ID)
+                    index[(direction,k,None,bid.Participant)].append(ID)
+        return {key:tuple(IDs) for key,IDs in index.items()}
+    
+    #Function moving the values of newly added bids into the arrays of the collection
+    def consolidate(self):
+        if not self.pending:
+            return
+        if self.volumeArray is None:
+            self.periodIndex = dict(self.pending[0].periodIndex)
+            self.volumeArray = np.zeros((0,len(self.periodIndex)))
+            self.priceArray = np.zeros((0,len(self.periodIndex)))
+        for bid in self.pending:
+            if bid.periodIndex != self.periodIndex:
+                raise ValueError("Bid " + str(bid.ID) + " does not cover the same periods as the other bids")
+        self.volumeArray = np.vstack([self.volumeArray] + [bid.volumeArray for bid in self.pending])
+        self.priceArray = np.vstack([self.priceArray] + [bid.priceArray for bid in self.pending])
+        for bid in self.pending:
+            bid.volumeArray = None
+            bid.priceArray = None
+            bid.periodIndex = None
+        self.pending = list()
+        
+    #Rows of the given bids
+    def rows(self,IDs):
+        return np.array([self.rowIndex[b] for b in IDs],dtype=int)
+    
+    #Columns of the given periods
+    def columns(self,periods):
+        return np.array([self.periodIndex[t] for t in periods],dtype=int)
+    
+    #Array (bids x periods) of "Volume" or "Price" for the given bids and periods
+    def getArray(self,attribute,IDs,periods):
+        return getattr(self,attribute)[np.ix_(self.rows(IDs),self.columns(periods))]
+    
+    #"Volume" or "Price" for the given bids and periods as a dict with (bid, period) keys, e.g. for model rules 
+    def periodValues(self,attribute,IDs,periods):
+        periods = list(periods)
+        values = self.getArray(attribute,IDs,periods).tolist()
+        return {(b,t):v for b,row in zip(IDs,values) for t,v in zip(periods,row)}
         
     def to_dict(self):
         Dict = {}
+        periods = list(self.periodIndex)
+        volumes = self.Volume.tolist()
+        prices = self.Price.tolist()
         for ID,bid in self.fullDict.items():
-            Dict[ID] = bid.to_dict()
+            Dict[ID] = {"ID":bid.ID, "Direction":bid.Direction, "Participant":bid.Participant, "Node":bid.Node,
+                        "Volume":dict(zip(periods,volumes[bid.row])), "Price":dict(zip(periods,prices[bid.row]))}
         return Dict
     
     @classmethod
     def from_dict(cls,Dict):
         bidCollection = cls()      
         for ID,subDict in Dict.items():
-            bid = Bid.from_dict(subDict)
-            bidCollection.fullDict[ID] = bid
-            bidCollection.nodeBids[bid.Node].append(bid.ID)
-            bidCollection.participantBids[bid.Participant].append(bid.ID)
-            if bid.Direction == "Up":
-                bidCollection.upBids.append(bid.ID)
-            else:
-                bidCollection.downBids.append(bid.ID)
+            bidCollection.add(Bid.from_dict(subDict))
+        bidCollection.consolidate()
+        return bidCollection
+    
+    #Method putting the volumes and prices into arrays, returning the bid information as a dict
+    def to_arrays(self,arrays):
+        arrays["Bids_Volume"] = self.Volume if self.Volume is not None else np.zeros((0,0))
+        arrays["Bids_Price"] = self.Price if self.Price is not None else np.zeros((0,0))
+        bids = [{"ID":bid.ID, "Direction":bid.Direction, "Participant":bid.Participant, "Node":bid.Node} for bid in self.fullDict.values()]
+        return {"periods":list(self.periodIndex),"bids":bids}
+    
+    #Collection using the stored arrays directly, without building the values of each bid
+    @classmethod
+    def from_arrays(cls,Dict,arrays):
+        bidCollection = cls()
+        for bid in Dict["bids"]:
+            bidCollection.add(Bid(bid["ID"],bid["Direction"],bid["Participant"],bid["Node"],0,0,[]))
+        for bid in bidCollection.pending:
+            bid.volumeArray = None
+            bid.priceArray = None
+            bid.periodIndex = None
+        bidCollection.pending = list()
+        if Dict["bids"]:
+            bidCollection.periodIndex = {t:i for i,t in enumerate(Dict["periods"])}
+            bidCollection.volumeArray = arrays["Bids_Volume"]
+            bidCollection.priceArray = arrays["Bids_Price"]
         return bidCollection
+    
+    #Collection sharing the indices and arrays of this one, except the volume or price array if one is given. Used by ScenarioOverlay,
+    #so a scenario only copies the arrays it changes. The shared arrays are read-only in the new collection, and each bid is copied to point
+    #to the new collection, so the values of a bid are read from the collection it was taken from and the view never changes this collection
+    def view(self,volume=None,price=None):
+        self.consolidate()
+        bidCollection = copy.copy(self)
+        bidCollection.pending = list()
+        bidCollection.volumeArray = volume if volume is not None else readOnly(self.volumeArray)
+        bidCollection.priceArray = price if price is not None else readOnly(self.priceArray)
+        bidCollection.fullDict = {ID:copy.copy(bid) for ID,bid in self.fullDict.items()}
+        for bid in bidCollection.fullDict.values():
+            bid.store = bidCollection
+        return bidCollection
+    
+    #Function changing the cost/price of the given bids (all bids if IDs is None)
+    def changePrice(self,newPrice,IDs=None):
+        self.Price[self.selection(IDs)] = newPrice
+        
+    #Function scaling the cost/price of the given bids
+    def scalePrice(self,scaling,IDs=None):
+        self.Price[self.selection(IDs)] *= scaling
+        
+    #Function scaling the volume of the given bids
+    def scaleVolume(self,scaling,IDs=None):
+        self.Volume[self.selection(IDs)] *= scaling
+        
+    #Row selection used by the vectorised functions
+    def selection(self,IDs):
+        if IDs is None:
+            return slice(None)
+        return self.rows(IDs)
         
             
     #Function calculating bids based on bid behaviors, participant sizes and participant cost scaling
-    def createBids(self,periods):
+    #The participants are read from the regional grid workbook, unless a table with the same columns is given (e.g. a synthetic grid, see Flex_benchmark)
+    def createBids(self,periods,partDF=None):
         
         #Data import
-        partDF = pd.read_excel("Regional grid.xlsx",sheet_name="Participants")
+        if partDF is None:
+            partDF = pd.read_excel("Regional grid.xlsx",sheet_name="Participants")
         
         #Bid behaviors (up,down)
         nBids = {"Aggregator":(3,2), "Battery":(2,2),"Industry":(1,1),"Intermittent":(1,1)}           
@@ -64,10 +210,7 @@ class Bids:
                     ID = "p" + str(participant) + "b" + str(b+1) + "D"
                     Volume = round(bidSize[Type][1][b] * pRow["Size"])
                     Cost = round(avgCost[Type][1][b] * pRow["Cost scaling"])
-                    self.fullDict[ID] = Bid(ID,"Down",participant,pRow["Node"],Volume,Cost,periods)
-                    self.downBids.append(ID)
-                    self.nodeBids[pRow["Node"]].append(ID)
-                    self.participantBids[participant].append(ID)
+                    self.add(Bid(ID,"Down",participant,pRow["Node"],Volume,Cost,periods))
 
 
                 #Up bids 
@@ -75,12 +218,10 @@ class Bids:
                     ID = "p" + str(participant) + "b" + str(b+1) + "U"
                     Volume = round(bidSize[Type][0][b] * pRow["Size"])
                     Cost = round(avgCost[Type][0][b] * pRow["Cost scaling"])
-                    self.fullDict[ID] = Bid(ID,"Up",participant,pRow["Node"],Volume,Cost,periods)
-                    self.upBids.append(ID)
-                    self.nodeBids[pRow["Node"]].append(ID)
-                    self.participantBids[participant].append(ID)
+                    self.add(Bid(ID,"Up",participant,pRow["Node"],Volume,Cost,periods))
+        self.consolidate()
                 
-    #Copy the bids object and change the bids according to some stochastic rules         
+    #Change the bids according to some stochastic rules, drawing all periods of all flexibility bids at once         
     def createNoise(self,Participants):
 
         #Defining the stochastic behavior (down,up)
@@ -91,25 +232,64 @@ class Bids:
         volumeChange = 0.4          #Percentage increase or decrease of bid volume
         costDeviation = 0.25        #Used as parameter when using normal distribution to find new costs
         
-        for ID,bid in self.fullDict.items():
-            if bid.Participant != "Re-dispatch":
-                pType = Participants[bid.Participant].Type 
-                
-                if bid.Direction == "Down":
-                    bKey = 0
-                else:
-                    bKey = 1
-                
-                for t in bid.Volume:
-                    bid.Price[t] = round(np.random.normal(bid.Price[t],abs(bid.Price[t])*costDeviation),1)
-                    
-                    p = np.random.random()
-                    if p < p_remove[pType][bKey]:
-                        bid.Volume[t] = 0
-                    elif p < p_remove[pType][bKey] + p_increaseV[pType][bKey]:
-                            bid.Volume[t] = bid.Volume[t] * (1+volumeChange)
-                    elif p < p_remove[pType][bKey] + p_increaseV[pType][bKey] + p_decreaseV[pType][bKey]:
-                        bid.Volume[t] = bid.Volume[t] * (1-volumeChange)
+        IDs = self.getBids("All","Flex")
+        if not IDs:
+            return
+        rows = self.rows(IDs)
+        
+        #Cumulative probability limits per bid, column vectors to broadcast over the periods
+        keys = [(Participants[self[b].Participant].Type, 0 if self[b].Direction == "Down" else 1) for b in IDs]
+        remove = np.array([[p_remove[pType][bKey]] for pType,bKey in keys])
+        increase = remove + np.array([[p_increaseV[pType][bKey]] for pType,bKey in keys])
+        decrease = increase + np.array([[p_decreaseV[pType][bKey]] for pType,bKey in keys])
+        
+        price = self.Price[rows]
+        self.Price[rows] = np.round(np.random.normal(price,np.abs(price)*costDeviation),1)
+        
+        p = np.random.random(price.shape)
+        volume = self.Volume[rows]
+        self.Volume[rows] = np.select([p < remove, p < increase, p < decrease],[0, volume*(1+volumeChange), volume*(1-volumeChange)],volume)
+
+#Read-only view of an array shared with another collection, see Bids.view
+def readOnly(array):
+    if array is None:
+        return None
+    array = array.view()
+    array.flags.writeable = False
+    return array
+
+#Mapping from period to the value of a bid, backed by a row of the bid arrays 
+class PeriodView:
+    def __init__(self,array,periodIndex):
+        self.array = array
+        self.periodIndex = periodIndex
+        
+    def __getitem__(self,t):
+        return float(self.array[self.periodIndex[t]])
+    
+    def __setitem__(self,t,value):
+        self.array[self.periodIndex[t]] = value
+        
+    def __iter__(self):
+        return iter(self.periodIndex)
+    
+    def __len__(self):
+        return len(self.periodIndex)
+    
+    def __contains__(self,t):
+        return t in self.periodIndex
+    
+    def keys(self):
+        return self.periodIndex.keys()
+    
+    def values(self):
+        return self.array.tolist()
+    
+    def items(self):
+        return zip(self.periodIndex,self.array.tolist())
+    
+    def to_dict(self):
+        return dict(self.items())
     
 class Bid:
     def __init__(self,ID,Direction,Participant,Node,Volume,Price,Periods):
@@ -118,48 +298,56 @@ class Bid:
         self.Participant = Participant
         self.Node = Node
         
-        self.Volume = {t:Volume for t in Periods}
-        self.Price = {t:Price for t in Periods}
+        self.store = None               #Bids object holding the values once the bid is added to it
+        self.row = None
+        self.periodIndex = {t:i for i,t in enumerate(Periods)}
+        self.volumeArray = np.full(len(Periods),Volume,dtype=float)
+        self.priceArray = np.full(len(Periods),Price,dtype=float)
+        
+    @property
+    def Volume(self):
+        if self.volumeArray is None:
+            return PeriodView(self.store.volumeArray[self.row],self.store.periodIndex)
+        return PeriodView(self.volumeArray,self.periodIndex)
+    
+    @property
+    def Price(self):
+        if self.priceArray is None:
+            return PeriodView(self.store.priceArray[self.row],self.store.periodIndex)
+        return PeriodView(self.priceArray,self.periodIndex)
         
     def to_dict(self):
-        Dict = {}
-        for name,value in vars(self).items():
-            Dict[name] = value
-        return Dict
+        return {"ID":self.ID, "Direction":self.Direction, "Participant":self.Participant, "Node":self.Node,
+                "Volume":self.Volume.to_dict(), "Price":self.Price.to_dict()}
     
     @classmethod
     def from_dict(cls,Dict):
         volumeDict = {int(key):val for key,val in Dict["Volume"].items()}
         priceDict = {int(key):val for key,val in Dict["Price"].items()}
         
-        bid = cls(Dict["ID"],Dict["Direction"],Dict["Participant"],Dict["Node"],0,0,[1])
-        bid.Volume = volumeDict
-        bid.Price = priceDict
+        bid = cls(Dict["ID"],Dict["Direction"],Dict["Participant"],Dict["Node"],0,0,list(volumeDict))
+        bid.volumeArray[:] = list(volumeDict.values())
+        bid.priceArray[:] = [priceDict[t] for t in volumeDict]
         
         return bid
         
     #Function changing the cost/price of the bid
     def changePrice(self,newPrice,period="All"):
         if period == "All":
-            for t in self.Price:
-                self.Price[t] = newPrice
+            self.Price.array[:] = newPrice
         else:
             self.Price[period] = newPrice
     
     #Function changing the volume of the bid
     def changeVolume(self,newVol,period="All"):
         if period == "All":
-            for t in self.Volume:
-                self.Volume[t] = newVol
+            self.Volume.array[:] = newVol
         else:
             self.Volume[period] = newVol
             
     #Function scaling the cost/price of the bid
     def scalePrice(self,scaling):
-        for t in self.Price:
-            self.Price[t] = self.Price[t] * scaling
+        self.Price.array[:] *= scaling
     
     def scaleVolume(self,scaling):
-        for t in self.Volume:
-            self.Volume[t] = self.Volume[t] * scaling
-            
\ No newline at end of file
+        self.Volume.array[:] *= scaling
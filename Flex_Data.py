@@ -5,18 +5,22 @@ Anders Ryssdal and Victor Aasvær
 
 Importing and storing parameters and data for the models
 """
-from Flex_Zones import Zones,Heuristic
-from Flex_System import System,Line,Node
+from Flex_Zones import Zones,Heuristic,PartitionCache
+from Flex_System import System,Line,Node,DCPTDFs
 from Flex_Participants import Participants,Participant
 from Flex_Bids import Bids,Bid
-from Flex_calculatePTDFs import calc_ZPTDF
-from Flex_supportFunctions import DA_path,timeString,HiddenPrints
+from Flex_calculatePTDFs import calc_ZPTDFs
+from Flex_supportFunctions import DA_path,timeString,HiddenPrints,LoadFlow,metrics
+from Flex_Import import importTables
 
 import time
+import copy
 import pandas as pd
 import numpy as np
 from geopy import distance
 
+inputFile = 'Input data.xlsx'                #Workbook with the grid, the participants and the PTDFs
+
 class Data:
     def __init__(self,days):
         
@@ -28,13 +32,16 @@ class Data:
         self.Bids = Bids()                                                      #Object with bid data
         self.Zones = Zones()                                                    #Object with the zonal configurations for each period
         self.ZPTDFs = {}                                                        #Object storing zonal PTDFs for each hour
+        self.partitionCache = PartitionCache()                                  #Partitions found for earlier periods, reused by runZonePartitioning
     
+    #Tables in the format of importTables can be given instead of reading the input workbooks, e.g. a synthetic grid from Flex_benchmark.
+    #PTDFs="DC" calculates the PTDFs from the line reactances instead of reading the PTDF sheet, see importGrid
     @classmethod
-    def create(cls,days,nZones=5,minNodes=5):
+    def create(cls,days,nZones=5,minNodes=5,tables=None,PTDFs=None):
         timer = time.time()
         
         Data = cls(days)
-        Data.Import()   
+        Data.Import(tables,PTDFs)   
         with HiddenPrints():
             Data.runZonePartitioning(nZones,minNodes)
             Data.fill_ZPTDFs()
@@ -62,46 +69,79 @@ class Data:
         Data.System = System.from_dict(Dict["System"])
         Data.Bids = Bids.from_dict(Dict["Bids"])
         Data.Zones = Zones.from_dict(Dict["Zones"])
-        Data.fill_ZPTDFs()
+        if "ZPTDFs" in Dict:
+            Data.ZPTDFs = dict(Dict["ZPTDFs"])
+        else:
+            Data.fill_ZPTDFs()
         return Data        
+    
+    #Method putting the PTDFs, volumes and bid values into arrays, returning the rest of the object as a dict. Used by Save(binary=True)
+    def to_arrays(self,arrays):
+        Dict = {}
+        
+        Dict["days"] = self.days
+        Dict["Participants"] = self.Participants.to_dict()
+        Dict["System"] = self.System.to_arrays(arrays)
+        Dict["Bids"] = self.Bids.to_arrays(arrays)
+        Dict["Zones"] = self.Zones.to_dict()
+        
+        return Dict
+    
+    @classmethod
+    def from_arrays(cls,Dict,arrays):
+        Data = cls(Dict["days"])
+        
+        Data.Participants = Participants.from_dict(Dict["Participants"])
+        Data.System = System.from_arrays(Dict["System"],arrays)
+        Data.Bids = Bids.from_arrays(Dict["Bids"],arrays)
+        Data.Zones = Zones.from_dict(Dict["Zones"])
+        Data.fill_ZPTDFs()
+        return Data
+    
+    #Compact version of the object, without the partitioning graphs in Heuristics. Used to send the data to other processes, and turned back into an object with from_dict()
+    def snapshot(self):
+        Dict = self.to_dict()
+        Dict["ZPTDFs"] = self.ZPTDFs
+        return Dict
 
     #%%Function importing all data except Zones and NodesDistributed       
-    def Import(self):
+    def Import(self,tables=None,PTDFs=None):
         start_import = time.time()
         print("Importing data")
         
+        #Import data and store it as dataframes, read once from each workbook or from the cache. Given tables also give the participants of the bids
+        with metrics.span("Import",Days=self.days):
+            given = tables is not None
+            if not given:
+                tables = importTables(inputFile,DA_path(list(range(1,self.days+1))))
+            self.importGrid(tables,PTDFs)
+            self.importVolumes(tables["Production"],tables["Load"],self.Periods)
+            self.fillBids(tables["Participants"] if given else None)
+        
+        end_import = time.time()
+
+        print('Finished after {} s\n'.format(round(end_import - start_import)))        
+
+    #Nodes, lines, participants and PTDFs, which are the same for all periods. The PTDFs are read from the PTDF sheet, or calculated from the
+    #line reactances by a DC power flow when PTDFs="DC" or the tables have no PTDF sheet (see DCPTDFs in Flex_System)
+    def importGrid(self,tables,PTDFs=None):
         #variable needed but not specified in input data
         base_MVA = 100   
-        redispatch_cost = 50
         
-        #Names of the files to be imported
-        filename = 'Input data.xlsx'     
-        
-        #Import data and store it as dataframes
-        buses = pd.read_excel(filename, sheet_name="Nodes")
-        lines = pd.read_excel(filename, sheet_name="Lines")
-        geodata = pd.read_excel(filename, sheet_name="Node coordinates")
-        participantData = pd.read_excel(filename,sheet_name = "Participants")
-        generators = pd.read_excel(filename, sheet_name="Generators")
-        
-        #Fill Node data
-        for _, bus in buses.iterrows(): #Import node data
-            #Find geographical position 
-            lat = geodata[geodata.bus_name == bus.bus_id]['lat'].iloc[0]
-            long = geodata[geodata.bus_name == bus.bus_id]['lon'].iloc[0]
-            
-            if buses["bus_id"].str.contains("R_"+bus.bus_id+"_1").any():
-                HostNode = True
-            else:
-                HostNode = False
-            node = Node(bus.bus_id,bus.baseKV,bus.type,(long,lat), bus.zone,bus.Flex_grid,HostNode,bus.Load_share)             
+        buses = tables["Nodes"]
+        lines = tables["Lines"]
+        participantData = tables["Participants"]
+        
+        #Fill Node data, with coordinates and host nodes joined to the node table
+        for bus in buses.itertuples(index=False): #Import node data
+            node = Node(bus.bus_id,bus.baseKV,bus.type,(bus.lon,bus.lat), bus.zone,bus.Flex_grid,bus.isHost,bus.Load_share)             
             self.System.Nodes[bus.bus_id] = node
             
             
         
         #Create lines and add to System
         line_id = 0 #Create id to give lines name
-        for _, line in lines.iterrows(): #Import line data
+        for line in lines.itertuples(index=False): #Import line data
             
             #Calculate line length
             bus_from_coords = self.System.Nodes[line.bus_from].geoData
@@ -128,40 +168,41 @@ class Data:
  
 
         
-        #Fill DA_volumes
-        self.System.NetVolumes['DA'] = {}
-        DA_paths = DA_path(list(range(1,self.days+1)))
-        t = 1
-        for path in DA_paths:
-            for j in range(1,25):
-                sheet_name = 'period' + str(j)
-                volumes = pd.read_excel(path, sheet_name=sheet_name)
-                self.System.DA_volumes[t] = {}
-                self.System.NetVolumes['DA'][t] = {} 
-                for n in self.System.Nodes.values():
-                    if n.isHost:
-                        load = 0
-                        prod = volumes[volumes.bus_id == n.ID]['Production'].iloc[0]
-                    elif "R_" in n.ID:
-                        prod = 0
-                        load = volumes[volumes.bus_id == n.ID[2:n.ID.index("_",2)]]['Load'].iloc[0]*n.loadShare
-                    else:
-                        prod = volumes[volumes.bus_id == n.ID]['Production'].iloc[0]
-                        load = volumes[volumes.bus_id == n.ID]['Load'].iloc[0]
-                        
-                    self.System.DA_volumes[t][n.ID] = {"Production": prod,"Load": load,"Net": prod-load}
-                    self.System.NetVolumes['DA'][t][n.ID] = prod-load
-                t += 1
-        
         #Fill in Participants 
-        for index, row in participantData.iterrows():
-            part = Participant(row["Participant"],row["Type"],row["Node"],row["Size"],row["Cost scaling"])
+        for ID,Type,node,size,scaling in zip(participantData["Participant"],participantData["Type"],participantData["Node"],participantData["Size"],participantData["Cost scaling"]):
+            part = Participant(ID,Type,node,size,scaling)
             self.Participants.fullDict[part.ID] = part
             self.Participants.types[part.Type].append(part.ID)
             self.Participants.nodes[part.Node].append(part.ID)
             
+        if PTDFs == "DC" or "PTDF" not in tables:
+            self.System.PTDFs = DCPTDFs(self.System)
+            return
+        
+        #Read PTDF matrix
+        lines = [l.ID for l in self.System.Lines.values()]
+        nodes = [n.ID for n in self.System.Nodes.values()]
+        PTDF_df = tables["PTDF"].iloc[:,-len(nodes):].copy()
+        PTDF_df.columns = nodes
+        PTDF_df.index = lines
+        
+        #Create dictionary with lines as outer key and nodes as inner key for PTDFs
+        self.System.PTDFs = PTDF_df.to_dict('index')
+
+    #DA volumes from (periods x nodes) production and load arrays, with one row for each of the given periods
+    def importVolumes(self,production,load,periods):
+        self.System.NetVolumes['DA'] = {}
+        nodes = list(self.System.Nodes)
+        for t,prodRow,loadRow in zip(periods,production.tolist(),load.tolist()):
+            self.System.DA_volumes[t] = {n:{"Production": prod,"Load": load,"Net": prod-load} for n,prod,load in zip(nodes,prodRow,loadRow)}
+            self.System.NetVolumes['DA'][t] = {n:prod-load for n,prod,load in zip(nodes,prodRow,loadRow)}
+    
+    #Flexibility bids with noise, and re-dispatch bids given by the DA volumes, for self.Periods. See Bids.createBids for the participant table
+    def fillBids(self,participants=None):
+        redispatch_cost = 50
+        
         #Create bids
-        self.Bids.createBids(self.Periods)
+        self.Bids.createBids(self.Periods,participants)
         self.Bids.createNoise(self.Participants)
         
         #Create re-dispatch bids 
@@ -171,49 +212,58 @@ class Data:
            
             for t in self.Periods:
                 bid.changeVolume(self.System.DA_volumes[t][n.ID]["Production"],t)
-            self.Bids.fullDict[bidID] = bid
-            self.Bids.downBids.append(bidID)
-            self.Bids.nodeBids[n.ID].append(bidID)
-            self.Bids.participantBids["Re-dispatch"].append(bidID)
+            self.Bids.add(bid)
             
             bidID = "Redispatch Up, " + n.ID
             bid = Bid(bidID,"Up","Re-dispatch",n.ID,0,redispatch_cost,self.Periods)
             for t in self.Periods:
                 bid.changeVolume(self.System.DA_volumes[t][n.ID]["Load"],t)
-            self.Bids.fullDict[bidID] = bid
-            self.Bids.upBids.append(bidID)
-            self.Bids.nodeBids[n.ID].append(bidID)
-            self.Bids.participantBids["Re-dispatch"].append(bidID)
+            self.Bids.add(bid)
+        self.Bids.consolidate()
 
-        #Read PTDF matrix
-        lines = [l.ID for l in self.System.Lines.values()]
-        nodes = [n.ID for n in self.System.Nodes.values()]
-        PTDF_df = pd.read_excel(filename, sheet_name="PTDF",names=nodes, header=None)
-        PTDF_df.index = lines
+    #%%Streaming: the data of one day at a time
+    #The DA volumes, bids, zones and zonal PTDFs are replaced by those of the given day, so a long horizon can be run with bounded memory
+    def loadDay(self,day,production,load,nZones=5,minNodes=5):
+        self.Periods = list(range((day-1)*24+1,day*24+1))
+        self.System.DA_volumes = {}
+        self.importVolumes(production,load,self.Periods)
+        self.Bids = Bids()
+        self.fillBids()
         
-        #Create dictionary with lines as outer key and nodes as inner key for PTDFs
-        self.System.PTDFs = PTDF_df.to_dict('index')
-        
-        end_import = time.time()
-
-        print('Finished after {} s\n'.format(round(end_import - start_import)))        
-
-            
-   
+        self.Zones = Zones()
+        self.ZPTDFs = {}
+        with HiddenPrints():
+            self.runZonePartitioning(nZones,minNodes)
+            self.fill_ZPTDFs()
+    
     #%%Splitting into zones and storing information in Zones and NodesDistributed
-    def runZonePartitioning(self,nZones,minNodes): 
+    #Periods with the same congestion as an earlier period reuse its partition from the cache, so Heuristics only has the periods that were partitioned
+    def runZonePartitioning(self,nZones,minNodes,cache=None): 
+        if cache is None:
+            cache = self.partitionCache
         self.Heuristics={}
-        for t in self.Periods:
-            partition = Heuristic(self,nZones,minNodes,t)
-            self.Heuristics[t]=partition
-            self.Zones.extractZones(self, partition, t)
+        with metrics.span("Zone partitioning",nZones=nZones,minNodes=minNodes):
+            flows = LoadFlow(self,"DA",self.Periods)
+            for t in self.Periods:
+                with metrics.span("Partition",Period=t) as span:
+                    key = cache.getKey(self,flows[t],nZones,minNodes)
+                    cached = cache.get(key)
+                    span["Cached"] = cached is not None
+                    if cached is not None:
+                        self.Zones.nodes[t],self.Zones.cutLines[t] = cached
+                        continue
+                    partition = Heuristic(self,nZones,minNodes,t,flows[t])
+                    self.Heuristics[t]=partition
+                    self.Zones.extractZones(self, partition, t)
+                    cache.add(key,self.Zones.nodes[t],self.Zones.cutLines[t])
+        cache.report()
         
     #%%Fill in self.ZPTDFs
     def fill_ZPTDFs(self):
         print("Calculating ZPTDFs for all periods")
         start_ptdf = time.time()
-        for t in self.Periods:
-            self.ZPTDFs[t] = calc_ZPTDF(self, t)
+        with metrics.span("ZPTDFs",Periods=len(self.Periods)):
+            self.ZPTDFs.update(calc_ZPTDFs(self, self.Periods))
         print('Finished calculating zonal PTDFs after {:.2f} s\n'.format(time.time() - start_ptdf))
     
     def getZoneParticipants(self,z,t):
@@ -223,4 +273,60 @@ class Data:
             participants = participants.union(self.Participants.nodes[n])
         return participants
     
-    
\ No newline at end of file
+    
+
+
+#%%Scenario overlays
+#Changes of a sensitivity scenario, declared as deltas from a base data object. apply() returns a data object sharing everything with the base
+#except what the scenario changes: the bid arrays that are scaled or changed, the lines when capacities change, and the zones and zonal PTDFs
+#when the zones are partitioned again. The bids of the scenario are always a view (see Bids.view), where the arrays shared with the base are
+#read-only, so the base object is not changed and any number of scenarios can be made from the same base.
+#The partition cache of the base is shared, as it only stores partitions found for a given congestion
+class ScenarioOverlay:
+    def __init__(self,days=None,redispatchCost=None,flexPriceScaling=1,flexVolumeScaling=1,capacityScaling=1,uncapTS=False,nZones=None,minNodes=5):
+        self.days = days                                    #Number of days to run, all days of the base if None
+        self.redispatchCost = redispatchCost                #New price of all re-dispatch bids
+        self.flexPriceScaling = flexPriceScaling            #Scaling of the prices of the flexibility bids
+        self.flexVolumeScaling = flexVolumeScaling          #Scaling of the volumes of the flexibility bids
+        self.capacityScaling = capacityScaling              #Scaling of all line capacities
+        self.uncapTS = uncapTS                              #Remove the capacity of the lines in the transmission system
+        self.nZones = nZones                                #Partition the zones again with nZones zones
+        self.minNodes = minNodes
+        
+    def apply(self,base):
+        data = copy.copy(base)
+        if self.days is not None:
+            data.days = self.days
+        
+        #Bids, copying only the arrays that change
+        price = None
+        volume = None
+        if self.flexPriceScaling != 1 or self.redispatchCost is not None:
+            price = base.Bids.Price.copy()
+            if self.flexPriceScaling != 1:
+                price[base.Bids.rows(base.Bids.getBids("All","Flex"))] *= self.flexPriceScaling
+            if self.redispatchCost is not None:
+                price[base.Bids.rows(base.Bids.participantBids["Re-dispatch"])] = self.redispatchCost
+        if self.flexVolumeScaling != 1:
+            volume = base.Bids.Volume.copy()
+            volume[base.Bids.rows(base.Bids.getBids("All","Flex"))] *= self.flexVolumeScaling
+        data.Bids = base.Bids.view(volume,price)
+        
+        #Lines, where the nodes, PTDFs and volumes are still shared
+        if self.capacityScaling != 1 or self.uncapTS:
+            data.System = copy.copy(base.System)
+            data.System.Lines = {ID:copy.copy(line) for ID,line in base.System.Lines.items()}
+            for line in data.System.Lines.values():
+                line.Capacity = line.Capacity * self.capacityScaling
+                if self.uncapTS and "R_" not in line.To and "R_" not in line.From:
+                    line.Capacity = float('inf')
+            if isinstance(base.System.PTDFs,DCPTDFs):
+                data.System.PTDFs = base.System.PTDFs.bind(data.System)
+        
+        #New zones
+        if self.nZones is not None:
+            data.Zones = Zones()
+            data.ZPTDFs = {}
+            data.runZonePartitioning(self.nZones,self.minNodes)
+            data.fill_ZPTDFs()
+        return data
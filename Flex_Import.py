@@ -0,0 +1,115 @@
+"""
+Created on Wed Mar 15 2023
+
+Anders Ryssdal and Victor Aasvær
+
+Reading the input workbooks. Every workbook is read in one pass, the DA volumes are joined to the nodes with vectorised merges,
+and the parsed tables are stored in a binary cache keyed on the hashes of the source files and the parser version, so later imports skip Excel entirely
+"""
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+cacheFolder = "Cache"                   #Folder storing the parsed input, one file for each combination of source files
+parserVersion = 1                       #Version of the parsed tables. Raise it when readInput or readDA change, so tables cached by an earlier version are not used
+
+
+#%%Support functions
+
+#Hash of the content of a file
+def fileHash(path):
+    h = hashlib.sha256()
+    with open(path,"rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+#Key of the cached tables of the given source files, from the hashes of the files and the parser version
+def cacheKey(paths):
+    return hashlib.sha256(("v{}".format(parserVersion) + "".join(fileHash(path) for path in paths)).encode()).hexdigest()[:20]
+
+#Parent bus of a regional node, e.g. "Nordel: 9120" for "R_Nordel: 9120_1"
+def parentBus(nodeID):
+    return nodeID[2:nodeID.index("_",2)]
+
+
+#%%Reading the workbooks
+
+#Sheets of the input data workbook, read from one open file. Node coordinates and host nodes are joined to the node table
+def readInput(filename):
+    with pd.ExcelFile(filename) as xls:
+        tables = {sheet: xls.parse(sheet) for sheet in ("Nodes","Lines","Node coordinates","Participants","Generators")}
+        tables["PTDF"] = xls.parse("PTDF",header=None)
+
+    #One row for each node, in the order of first appearance but with the values of the last row, the same as when the nodes are put in a dict one by one
+    nodes = tables["Nodes"]
+    nodes = nodes.drop_duplicates("bus_id",keep="last").set_index("bus_id").loc[nodes["bus_id"].drop_duplicates()].reset_index()
+
+    #Coordinates, using the first row of each bus
+    coordinates = tables["Node coordinates"].drop_duplicates("bus_name").set_index("bus_name")[["lat","lon"]]
+    nodes = nodes.join(coordinates,on="bus_id")
+
+    #A node is a host node if the regional grid has a first node below it ("R_<bus>_1")
+    regional = [n for n in nodes["bus_id"] if n.startswith("R_") and "_" in n[2:]]
+    hosts = {parentBus(n) for n in regional if n[len(parentBus(n))+2:].startswith("_1")}
+    nodes["isHost"] = nodes["bus_id"].isin(hosts)
+    tables["Nodes"] = nodes
+    return tables
+
+#Production and load (periods x nodes) for the nodes in the node table, read from the NordPool workbooks with all 24 periods of a day file in one pass
+#Host nodes only produce, regional nodes only have their share of the load of the parent bus, and other nodes use their own bus
+def readDA(paths,nodes):
+    sheets = []
+    for path in paths:
+        workbook = pd.read_excel(path,sheet_name=None)
+        sheets += [workbook["period" + str(j)].drop_duplicates("bus_id").set_index("bus_id")[["Production","Load"]] for j in range(1,25)]
+    if not sheets:
+        return np.zeros((0,len(nodes))),np.zeros((0,len(nodes)))
+    volumes = pd.concat(sheets,keys=range(len(sheets)),names=["Period"])
+    production = volumes["Production"].unstack("bus_id")
+    load = volumes["Load"].unstack("bus_id")
+
+    isHost = nodes["isHost"].to_numpy()
+    isRegional = nodes["bus_id"].str.contains("R_",regex=False).to_numpy() & ~isHost
+    prodBus = nodes["bus_id"].where(~isRegional,None)
+    loadBus = pd.Series([parentBus(n) if r else n for n,r in zip(nodes["bus_id"],isRegional)]).where(~isHost,None)
+    loadShare = np.where(isRegional,nodes["Load_share"].to_numpy(dtype=float),1.0)
+
+    missing = (set(prodBus.dropna()) | set(loadBus.dropna())) - set(production.columns)
+    if missing:
+        raise KeyError("No DA volumes found for the buses {}".format(sorted(missing)))
+
+    production = np.where(prodBus.isna().to_numpy(),0.0,production.reindex(columns=prodBus).to_numpy())
+    load = np.where(loadBus.isna().to_numpy(),0.0,load.reindex(columns=loadBus).to_numpy() * loadShare)
+    return production,load
+
+
+#%%Main function
+
+#All tables needed by Data.Import, from the binary cache if the source files have not changed since they were last read
+def importTables(filename,DA_paths,cache=True):
+    cachePath = os.path.join(cacheFolder,"Input_{}.pkl".format(cacheKey([filename] + list(DA_paths))))
+    if cache and os.path.exists(cachePath):
+        return pd.read_pickle(cachePath)
+
+    tables = readInput(filename)
+    tables["Production"],tables["Load"] = readDA(DA_paths,tables["Nodes"])
+
+    if cache:
+        os.makedirs(cacheFolder,exist_ok=True)
+        pd.to_pickle(tables,cachePath)
+    return tables
+
+#Production and load (24 x nodes) of one DA workbook, used when a long horizon is read one day at a time. Only the arrays are cached,
+#keyed on the input workbook and the day workbook
+def importDay(filename,DA_path,nodes,cache=True):
+    cachePath = os.path.join(cacheFolder,"Day_{}.pkl".format(cacheKey([filename,DA_path])))
+    if cache and os.path.exists(cachePath):
+        return pd.read_pickle(cachePath)
+    
+    volumes = readDA([DA_path],nodes)
+    if cache:
+        os.makedirs(cacheFolder,exist_ok=True)
+        pd.to_pickle(volumes,cachePath)
+    return volumes
@@ -9,9 +9,11 @@ import pyomo.environ as pyo
 import pandas as pd
 import seaborn 
 import collections
+import collections.abc
 import math
+import numpy as np
 import matplotlib.pyplot as plt
-from Flex_supportFunctions import LoadFlow
+from Flex_supportFunctions import LoadFlow,FlowArray,storeTable,loadTable,plainTables,metrics
 from Flex_Bids import Bids
 from Flex_Zones import Zones
 
@@ -43,7 +45,7 @@ class Result:
             elif name == "bids" or name == "zones":    
                 Dict[name] = value.to_dict()
             else:
-                Dict[name] = value
+                Dict[name] = plainTables(value)
         return Dict
  
     @classmethod
@@ -73,238 +75,367 @@ class Result:
 
         return res
     
-    #%%Functions reading base data from the models
+    #Method putting the variables into arrays as (periods x keys) tables, returning the rest of the object as a dict. Used by Save(binary=True)
+    def to_arrays(self,arrays):
+        Dict = {"read":self.read,"cost":self.cost,"tables":{}}
+        for name,value in vars(self).items():
+            if name in ("DataFrames","read","cost"):
+                continue
+            Dict["tables"][name] = {m:storeTable(arrays,"{}_{}".format(name,m),table) for m,table in value.items() if table}
+        return Dict
+    
+    #Object with the tables memory-mapped from arrays, which are only read when they are used
+    @classmethod
+    def from_arrays(cls,Dict,arrays):
+        res = cls()
+        res.read = Dict["read"]
+        res.cost = Dict["cost"]
+        for name,tables in Dict["tables"].items():
+            for m,description in tables.items():
+                getattr(res,name)[m] = loadTable(arrays,description)
+        return res
+    
+    #Add the results stored in another Result object, e.g. from days that were run separately
+    def merge(self,other):
+        for name,value in vars(other).items():
+            if name == "DataFrames":
+                continue
+            elif name == "read":
+                for m in value:
+                    self.read[m] = self.read[m] or value[m]
+            elif name == "cost":
+                for m in value:
+                    self.cost[m] += value[m]
+            else:
+                for m in value:
+                    if isinstance(getattr(self,name)[m],FlowArray):
+                        getattr(self,name)[m] = getattr(self,name)[m].to_dict()
+                    getattr(self,name)[m].update(value[m])
+    
+    #%%Functions reading base data from the models. Each variable is read in bulk for all periods of the model, see variableArray
     def read_nodal(self,model,Data):
         self.cost["Nodal"] += pyo.value(model.obj)
+        periods = list(model.Periods)
+        lines = Data.System.getLineList("All")
+        nodes = Data.System.getNodeList("All")
         
-        #Get flow
-        flow = LoadFlow(Data)
-        for t in model.Periods:
-            self.clearedUp["Nodal"][t] = {}
-            self.clearedDown["Nodal"][t] = {}
-            self.flow["Nodal"][t] = {}
-            self.flow["Day ahead"][t] = {}
-            self.prod["Nodal"][t] = {}
-            self.charge["Nodal"][t] = {}
-            self.duals['Nodal'][t] = {}
-            
-            #upBids
-            for b in Data.Bids.upBids:
-                self.clearedUp["Nodal"][t][b] = pyo.value(model.clearedUp[b,t])
-            #downBids
-            for b in Data.Bids.downBids:
-                self.clearedDown["Nodal"][t][b] = pyo.value(model.clearedDown[b,t])
-            #Flow
-            for l in Data.System.getLineList("All"):
-                self.flow["Nodal"][t][l] = pyo.value(model.flow[l,t])
-                self.flow["Day ahead"][t][l] = flow[t][l]
-            #Prod
-            for n in Data.System.getNodeList("All"):
-                self.prod["Nodal"][t][n] = pyo.value(model.prod[n,t])
-                self.duals['Nodal'][t][n] = model.dual[model.netProduction_cons[n,t]]
-            #Charge
-            for i in Data.Participants.types["Battery"]:
-                self.charge["Nodal"][t][i] = pyo.value(model.charge[i,t])
+        self.clearedUp["Nodal"].update(periodRows(variableArray(model,"clearedUp",Data.Bids.upBids,periods),Data.Bids.upBids,periods))
+        self.clearedDown["Nodal"].update(periodRows(variableArray(model,"clearedDown",Data.Bids.downBids,periods),Data.Bids.downBids,periods))
+        self.flow["Nodal"].update(periodRows(variableArray(model,"flow",lines,periods),lines,periods))
+        self.flow["Day ahead"].update(periodRows(LoadFlow(Data,periods=periods).array,lines,periods))    #DA flow for the periods of the model only
+        self.prod["Nodal"].update(periodRows(variableArray(model,"prod",nodes,periods),nodes,periods))
+        self.duals["Nodal"].update(periodRows(dualArray(model,"netProduction_cons",nodes,periods),nodes,periods))
+        batteries = Data.Participants.types["Battery"]
+        self.charge["Nodal"].update(periodRows(variableArray(model,"charge",batteries,periods),batteries,periods))
         
         self.read["Nodal"] = True
                     
         
     def read_zonal(self,model,Data):
-        for t in model.Periods:
-            self.clearedUp["Pre zonal"][t] = {}
-            self.clearedUp["Zonal"][t] = {}
-            self.clearedDown["Pre zonal"][t] = {}
-            self.clearedDown["Zonal"][t] = {}
-            self.flow["Pre zonal"][t] = {}
-            self.prod["Pre zonal"][t] = {}
-            self.charge["Pre zonal"][t] = {}
-            self.duals["Pre zonal"][t] = {}
-    
-            #upBids
-            for b in Data.Bids.upBids:
-                if Data.Bids[b].Participant != "Re-dispatch":
-                    self.clearedUp["Pre zonal"][t][b] = pyo.value(model.clearedUp[b,t])
-                    self.cost["Pre zonal"] += self.clearedUp["Pre zonal"][t][b] * Data.Bids[b].Price[t]
-                    self.clearedUp["Zonal"][t][b] = pyo.value(model.clearedUp[b,t])
-                    self.cost["Zonal"] += self.clearedUp["Zonal"][t][b] * Data.Bids[b].Price[t]
-            #downBids
-            for b in Data.Bids.downBids:
-                if Data.Bids[b].Participant != "Re-dispatch":
-                    self.clearedDown["Pre zonal"][t][b] = pyo.value(model.clearedDown[b,t])           
-                    self.cost["Pre zonal"] += self.clearedDown["Pre zonal"][t][b] * Data.Bids[b].Price[t]
-                    self.clearedDown["Zonal"][t][b] = pyo.value(model.clearedDown[b,t])           
-                    self.cost["Zonal"] += self.clearedDown["Zonal"][t][b] * Data.Bids[b].Price[t]
-            #Flow
-            lines = Data.Zones.cutLines[t] 
-            for l in lines:
-                self.flow["Pre zonal"][t][l] = pyo.value(model.flow[l,t])
-            #Prod
-            for z in Data.Zones.nodes[t]:
-                self.prod["Pre zonal"][t][z] = pyo.value(model.prod[z,t])
-                self.duals["Pre zonal"][t][z] = model.dual[model.netProduction_cons[z, t]]
-            #Charge
-            for i in Data.Participants.types["Battery"]:
-                self.charge["Pre zonal"][t][i] = pyo.value(model.charge[i,t])
+        periods = list(model.Periods)
+        upBids = Data.Bids.getBids("Up","Flex")
+        downBids = Data.Bids.getBids("Down","Flex")
+        
+        #Cleared volumes, with the cost of the flexibility bids added to both the pre zonal and the zonal cost
+        clearedUp = variableArray(model,"clearedUp",upBids,periods)
+        clearedDown = variableArray(model,"clearedDown",downBids,periods)
+        cost = float((clearedUp * Data.Bids.getArray("Price",upBids,periods).T).sum() + (clearedDown * Data.Bids.getArray("Price",downBids,periods).T).sum())
+        self.cost["Pre zonal"] += cost
+        self.cost["Zonal"] += cost
+        for m in ("Pre zonal","Zonal"):
+            self.clearedUp[m].update(periodRows(clearedUp,upBids,periods))
+            self.clearedDown[m].update(periodRows(clearedDown,downBids,periods))
+        
+        #The lines between zones and the zones change between periods
+        lines = {t:Data.Zones.cutLines[t] for t in periods}
+        zones = {t:list(Data.Zones.nodes[t]) for t in periods}
+        self.flow["Pre zonal"].update(splitRows(variableValues(model,"flow",periodIndex(lines,periods)),lines,periods))
+        self.prod["Pre zonal"].update(splitRows(variableValues(model,"prod",periodIndex(zones,periods)),zones,periods))
+        self.duals["Pre zonal"].update(splitRows(dualValues(model,"netProduction_cons",periodIndex(zones,periods)),zones,periods))
+        batteries = Data.Participants.types["Battery"]
+        self.charge["Pre zonal"].update(periodRows(variableArray(model,"charge",batteries,periods),batteries,periods))
         
         self.read["Zonal"] = True
     
     
     def read_re(self,model,Data):
         self.cost["Re-dispatch"] += pyo.value(model.obj)
-        for t in model.Periods:
-            self.clearedUp["Re-dispatch"][t] = {}
-            self.clearedDown["Re-dispatch"][t] = {}
-            self.flow["Re-dispatch"][t] = {}
-            self.prod["Re-dispatch"][t] = {}
-            self.duals['Re-dispatch'][t] = {}
-            
-            #upBids
-            for b in Data.Bids.upBids:
-                if Data.Bids[b].Participant == "Re-dispatch":
-                    self.clearedUp["Re-dispatch"][t][b] = pyo.value(model.clearedUp[b,t])
-            #downBids
-            for b in Data.Bids.downBids:
-                if Data.Bids[b].Participant == "Re-dispatch":
-                    self.clearedDown["Re-dispatch"][t][b] = pyo.value(model.clearedDown[b,t])
-                
-            #Flow
-            for l in Data.System.getLineList("All"):
-                self.flow["Re-dispatch"][t][l] = pyo.value(model.flow[l,t])
-            #Prod
-            for n in Data.System.getNodeList("All"):
-                self.prod["Re-dispatch"][t][n] = pyo.value(model.prod[n,t])
-                self.duals['Re-dispatch'][t][n] = model.dual[model.netProduction_cons[n, t]]
+        periods = list(model.Periods)
+        upBids = Data.Bids.getBids("Up","Re-dispatch")
+        downBids = Data.Bids.getBids("Down","Re-dispatch")
+        lines = Data.System.getLineList("All")
+        nodes = Data.System.getNodeList("All")
+        
+        self.clearedUp["Re-dispatch"].update(periodRows(variableArray(model,"clearedUp",upBids,periods),upBids,periods))
+        self.clearedDown["Re-dispatch"].update(periodRows(variableArray(model,"clearedDown",downBids,periods),downBids,periods))
+        self.flow["Re-dispatch"].update(periodRows(variableArray(model,"flow",lines,periods),lines,periods))
+        self.prod["Re-dispatch"].update(periodRows(variableArray(model,"prod",nodes,periods),nodes,periods))
+        self.duals["Re-dispatch"].update(periodRows(dualArray(model,"netProduction_cons",nodes,periods),nodes,periods))
                       
         self.read["Re-dispatch"] = True
     
     def read_postZonal(self,model,Data):
         self.cost["Post zonal"] += pyo.value(model.obj)
         self.cost["Zonal"] += pyo.value(model.obj)
-        for t in model.Periods:
-            self.clearedUp["Post zonal"][t] = {}
-            self.clearedDown["Post zonal"][t] = {}
-            self.flow["Post zonal"][t] = {}
-            self.prod["Post zonal"][t] = {}
-            self.duals['Post zonal'][t] = {}
-            
-            
-            #upBids
-            for b in Data.Bids.upBids:
-                if Data.Bids[b].Participant == "Re-dispatch":
-                    self.clearedUp["Post zonal"][t][b] = pyo.value(model.clearedUp[b,t])
-                    self.clearedUp["Zonal"][t][b] = pyo.value(model.clearedUp[b,t])
-            #downBids
-            for b in Data.Bids.downBids:
-                if Data.Bids[b].Participant == "Re-dispatch":
-                    self.clearedDown["Post zonal"][t][b] = pyo.value(model.clearedDown[b,t])
-                    self.clearedDown["Zonal"][t][b] = pyo.value(model.clearedDown[b,t])
-            #Flow
-            for l in Data.System.getLineList("All"):
-                self.flow["Post zonal"][t][l] = pyo.value(model.flow[l,t])
-            #Prod
-            for n in Data.System.getNodeList("All"):
-                self.prod["Post zonal"][t][n] = pyo.value(model.prod[n,t])
-                self.duals['Post zonal'][t][n] = model.dual[model.netProduction_cons[n, t]]
+        periods = list(model.Periods)
+        upBids = Data.Bids.getBids("Up","Re-dispatch")
+        downBids = Data.Bids.getBids("Down","Re-dispatch")
+        lines = Data.System.getLineList("All")
+        nodes = Data.System.getNodeList("All")
+        
+        #The re-dispatch bids are also added to the zonal clearing, after the flexibility bids read by read_zonal
+        clearedUp = periodRows(variableArray(model,"clearedUp",upBids,periods),upBids,periods)
+        clearedDown = periodRows(variableArray(model,"clearedDown",downBids,periods),downBids,periods)
+        self.clearedUp["Post zonal"].update(clearedUp)
+        self.clearedDown["Post zonal"].update(clearedDown)
+        for t in periods:
+            self.clearedUp["Zonal"].setdefault(t,{}).update(clearedUp[t])
+            self.clearedDown["Zonal"].setdefault(t,{}).update(clearedDown[t])
+        self.flow["Post zonal"].update(periodRows(variableArray(model,"flow",lines,periods),lines,periods))
+        self.prod["Post zonal"].update(periodRows(variableArray(model,"prod",nodes,periods),nodes,periods))
+        self.duals["Post zonal"].update(periodRows(dualArray(model,"netProduction_cons",nodes,periods),nodes,periods))
         
         self.read["Post zonal"] = True
         
 
-#Function that runs all functions interpreting the results
-def interpretResult(Result,data):
+#%% Reading solutions in bulk
+#Values of a variable for a list of (key, period) indices. Models keeping their solution as arrays (MatrixModel, DayView) give the values directly,
+#and the values of a Pyomo variable are extracted with one call
+def variableValues(model,name,index):
+    if hasattr(model,"variableValues"):
+        return model.variableValues(name,index)
+    values = getattr(model,name).extract_values()
+    return np.array([values[i] for i in index],dtype=float)
+
+#Duals of a constraint for a list of (key, period) indices
+def dualValues(model,name,index):
+    if hasattr(model,"dualValues"):
+        return model.dualValues(name,index)
+    constraints = getattr(model,name)
+    return np.array([model.dual[constraints[i]] for i in index],dtype=float)
+
+#Values of a variable as a (periods x keys) array
+def variableArray(model,name,keys,periods):
+    return variableValues(model,name,[(k,t) for t in periods for k in keys]).reshape(len(periods),len(keys))
+
+#Duals of a constraint as a (periods x keys) array
+def dualArray(model,name,keys,periods):
+    return dualValues(model,name,[(k,t) for t in periods for k in keys]).reshape(len(periods),len(keys))
+
+#(key, period) indices when the keys change between periods, given as a dict with the keys of each period
+def periodIndex(keys,periods):
+    return [(k,t) for t in periods for k in keys[t]]
+
+#A (periods x keys) array as the {period: {key: value}} dicts stored in the Result object
+def periodRows(array,keys,periods):
+    return {t:dict(zip(keys,row)) for t,row in zip(periods,array.tolist())}
+
+#Values read with periodIndex as {period: {key: value}} dicts
+def splitRows(values,keys,periods):
+    rows = {}
+    start = 0
+    values = values.tolist()
+    for t in periods:
+        rows[t] = dict(zip(keys[t],values[start:start+len(keys[t])]))
+        start += len(keys[t])
+    return rows
+
+
+#Function that runs all functions interpreting the results. With lazy=True each dataframe is only made when it is first used, 
+#which should only be done when the data object is not changed afterwards, e.g. for results loaded from file.
+#With single=True each flow filter gives one table for all periods instead of a dict with one dataframe per period
+def interpretResult(Result,data,lazy=False,single=False):
+    if lazy:
+        Result.DataFrames = ResultFrames(Result,data,single)
+        return
     
-    FindFlows(Result,data,"Between zones")      #Flows between zones
-    FindFlows(Result,data,"Flexibility lines")  #Flows in all flex lines
-    FindFlows(Result,data,"All lines")          #Flows in all lines
-    FindCosts(Result,data)                      #Costs for each model
+    with metrics.span("Interpret"):
+        flows = resultTable(Result,"flow")                        #Long-format flow table shared by the three filters
+        FindFlows(Result,data,"Between zones",single,flows)      #Flows between zones
+        FindFlows(Result,data,"Flexibility lines",single,flows)  #Flows in all flex lines
+        FindFlows(Result,data,"All lines",single,flows)          #Flows in all lines
+        FindCosts(Result,data)                                   #Costs for each model
+
+#The dataframes of a result, made by FindFlows or FindCosts the first time they are used. 
+#Data can also be a function returning the data object, so it is not loaded before a dataframe is needed
+class ResultFrames(collections.abc.MutableMapping):
+    flowFilters = ["Between zones","Flexibility lines","All lines"]
+    costNames = ["Hourly cost (FA)","Hourly cost (TA)","Daily cost (FA)","Daily cost (TA)"]
+    
+    def __init__(self,result,data,single=False):
+        self.result = result
+        self.data = data
+        self.single = single
+        self.frames = {}
+    
+    def getData(self):
+        if callable(self.data):
+            self.data = self.data()
+        return self.data
+    
+    def __getitem__(self,name):
+        if name not in self.frames:
+            if name.startswith("Flow: ") and name[6:] in self.flowFilters:
+                FindFlows(self.result,self.getData(),name[6:],self.single)
+            elif name in self.costNames:
+                FindCosts(self.result,self.getData())
+        return self.frames[name]
+    
+    def __setitem__(self,name,value):
+        self.frames[name] = value
+    
+    def __delitem__(self,name):
+        del self.frames[name]
+    
+    def __iter__(self):
+        return iter(dict.fromkeys(["Flow: " + f for f in self.flowFilters] + self.costNames + list(self.frames)))
+    
+    def __len__(self):
+        return len(list(iter(self)))
+
+
+#%% Long-format tables used by the dataframes below
+#One row for each (model, period, key) of a variable, e.g. resultTable(Result,"flow") with the lines as keys
+def resultTable(Result,name):
+    models,periods,counts,keys,values = [],[],[],[],[]
+    for m,table in getattr(Result,name).items():
+        for t,row in table.items():
+            models.append(m)
+            periods.append(t)
+            counts.append(len(row))
+            keys.extend(row.keys())
+            values.extend(row.values())
+    names = list(dict.fromkeys(models))
+    codes = np.repeat(np.array([names.index(m) for m in models],dtype=int),counts)
+    return pd.DataFrame({"Model":pd.Categorical.from_codes(codes,categories=names),
+                         "Period":np.repeat(np.array(periods,dtype=int),counts),
+                         "Key":pd.Series(np.array(keys + [None],dtype=object)[:-1],dtype=object),
+                         "Value":np.array(values,dtype=float)})
+
+#Values of each model of a long-format table as a (periods x keys) array, NaN where the model has no value
+def modelMatrices(table,periods,keys):
+    periodIndex = pd.Index(periods)
+    keyIndex = pd.Index(keys,dtype=object)
+    matrices = {}
+    for m,values in table.groupby("Model",sort=False,observed=True):
+        matrix = np.full((len(periods),len(keys)),np.nan)
+        rows = periodIndex.get_indexer(values["Period"])
+        columns = keyIndex.get_indexer(values["Key"])
+        found = (rows >= 0) & (columns >= 0)
+        matrix[rows[found],columns[found]] = values["Value"].to_numpy()[found]
+        matrices[m] = matrix
+    return matrices
+
+#Line information used in the flow tables, indexed by line ID
+def lineTable(Data):
+    lines = list(Data.System.Lines.values())
+    return pd.DataFrame({"Line":["Line {}".format(line.ID) for line in lines],"From":[line.From for line in lines],"To":[line.To for line in lines],
+                         "Capacity":[line.Capacity for line in lines],"isFlex":[line.isFlex == 1 for line in lines]},index=[line.ID for line in lines])
 
 
 #%% Reading the line flows into dataframes 
-def FindFlows(Result,Data,Filter):
+#All periods in one table, with a "Period" column and one row for each line given by the filter. The long-format flow table can be given
+#when several filters are made from the same result
+def flowTable(Result,Data,Filter,flows=None):
+    if flows is None:
+        flows = resultTable(Result,"flow")
+    lines = lineTable(Data)
+    periods = list(Result.flow["Day ahead"])
+    matrices = modelMatrices(flows,periods,list(lines.index))
+    missing = np.full((len(periods),len(lines)),np.nan)
+    
+    #Period and line positions of the rows, in the order of the periods and then the order of the lines in System or between the zones
+    zoneColumns = [lines.index.get_indexer(list(Result.flow["Pre zonal"][t].keys())) for t in periods]
+    if Filter == "Between zones":
+        columns = np.concatenate([np.zeros(0,dtype=int)] + zoneColumns)
+        rows = np.repeat(np.arange(len(periods)),[len(c) for c in zoneColumns])
+    else:
+        selected = np.flatnonzero(lines["isFlex"].to_numpy()) if Filter == "Flexibility lines" else np.arange(len(lines))
+        columns = np.tile(selected,len(periods))
+        rows = np.repeat(np.arange(len(periods)),len(selected))
+    betweenZones = np.zeros((len(periods),len(lines)),dtype=np.int64)
+    for i,c in enumerate(zoneColumns):
+        betweenZones[i,c] = 1
+    
+    table = pd.DataFrame({"Period":np.array(periods,dtype=int)[rows],
+                          "Line":lines["Line"].to_numpy()[columns],
+                          "From":lines["From"].to_numpy()[columns],
+                          "To":lines["To"].to_numpy()[columns],
+                          "Capacity":lines["Capacity"].to_numpy()[columns],
+                          "Flexibility area":lines["isFlex"].to_numpy().astype(np.int64)[columns],
+                          "Between zones":betweenZones[rows,columns],
+                          "Day ahead":matrices.get("Day ahead",missing)[rows,columns],
+                          "Nodal flow":matrices.get("Nodal",missing)[rows,columns],
+                          "Zonal flow":matrices.get("Pre zonal",missing)[rows,columns],
+                          "Re-dispatch flow":matrices.get("Re-dispatch",missing)[rows,columns],
+                          "Post zonal flow":matrices.get("Post zonal",missing)[rows,columns]}).set_index("Line")
+    
+    if Filter == "Between zones":
+        table = table.drop(columns=["Between zones","Flexibility area"])
+    elif Filter == "Flexibility lines":
+        table = table.drop(columns=["Flexibility area"])
+    return table
 
-    dataframes = {t:0 for t in Result.flow["Day ahead"]} 
+#The flows as one dataframe per period, or with single=True as the table from flowTable
+def FindFlows(Result,Data,Filter,single=False,flows=None):
+    table = flowTable(Result,Data,Filter,flows)
+    if single:
+        Result.DataFrames["Flow: " + Filter] = table
+        return
+    
+    dataframes = {}
+    counts = table["Period"].value_counts(sort=False)
+    start = 0
     for t in Result.flow["Day ahead"]:
-        output = {"Line":[],"From":[],"To":[],"Capacity":[],"Flexibility area":[],"Between zones":[],"Day ahead":[],"Nodal flow":[],"Zonal flow":[],"Re-dispatch flow":[],"Post zonal flow":[]}
-        zoneLines = list(Result.flow["Pre zonal"][t].keys())
-
-        flexLines = Data.System.getLineList("Flex")
-        
-        if Filter == "Between zones":
-            lines = zoneLines
-            del output["Between zones"]
-            del output["Flexibility area"]
-        elif Filter == "Flexibility lines":
-            lines = flexLines
-            del output["Flexibility area"]         
-        elif Filter == "All lines":
-            lines = Data.System.getLineList("All")
-        
-        for l in lines:
-            line = Data.System.Lines[l]
-            
-            output["Line"].append("Line {}".format(line.ID))
-            output["From"].append(line.From)
-            output["To"].append(line.To)
-            output["Capacity"].append(line.Capacity)
-            output["Day ahead"].append(Result.flow["Day ahead"][t][l]) 
-            output["Nodal flow"].append(Result.flow["Nodal"][t][l])
-            output["Re-dispatch flow"].append(Result.flow["Re-dispatch"][t][l])
-            output["Post zonal flow"].append(Result.flow["Post zonal"][t][l])
-            
-            if Filter == "Between zones":
-                output["Zonal flow"].append(Result.flow["Pre zonal"][t][l])
-                
-            elif l in zoneLines:
-                output["Zonal flow"].append(Result.flow["Pre zonal"][t][l])
-                output["Between zones"].append(1)
-                if Filter =="All lines" and l in flexLines:
-                    output["Flexibility area"].append(1)
-                elif Filter =="All lines":
-                    output["Flexibility area"].append(0)
-            else:
-                output["Zonal flow"].append(None)
-                output["Between zones"].append(0)
-                if Filter =="All lines" and l in flexLines:
-                    output["Flexibility area"].append(1)
-                elif Filter =="All lines":
-                    output["Flexibility area"].append(0)
-        dataframes[t] = pd.DataFrame(output).set_index("Line")
+        stop = start + int(counts.get(t,0))
+        if stop == start:
+            dataframes[t] = pd.DataFrame({column:[] for column in ["Line"] + list(table.columns[1:])}).set_index("Line")
+            continue
+        dataframes[t] = table.iloc[start:stop,1:].copy()
+        #Lines without a zonal flow are given as None, so a period without any zonal flows keeps the column as objects
+        if dataframes[t]["Zonal flow"].isna().all():
+            dataframes[t]["Zonal flow"] = None
+        start = stop
     Result.DataFrames["Flow: " + Filter] = dataframes
 
-#%%Create dataframe showing costs for the various models, per period  
+#%%Create dataframe showing costs for the various models, per period. The cost of every cleared bid is found with one array operation
+#and summed per model and period with bincount, for all bids (TA) and the bids in the flexibility area (FA)
 def FindCosts(Result,data):
-    DFs = {"Hourly cost (FA)":pd.DataFrame(),"Hourly cost (TA)":pd.DataFrame(),"Daily cost (FA)":pd.DataFrame(),"Daily cost (TA)":pd.DataFrame()}
-
-    for s in Result.read:
-        costLists = {"Hourly cost (FA)":{},"Hourly cost (TA)":{},"Daily cost (FA)":collections.defaultdict(int),"Daily cost (TA)":collections.defaultdict(int)}
-        for t in Result.flow["Day ahead"]:
-            costs= {"Flex":0,"All":0}
-            for b in Result.clearedUp[s][t]:
-                costs["All"] += data.Bids[b].Price[t] * Result.clearedUp[s][t][b]
-                if data.System.Nodes[data.Bids[b].Node].isFlex:
-                    costs["Flex"] += data.Bids[b].Price[t] * Result.clearedUp[s][t][b]
-            for b in Result.clearedDown[s][t]:
-                costs["All"] += data.Bids[b].Price[t] * Result.clearedDown[s][t][b]
-                if data.System.Nodes[data.Bids[b].Node].isFlex:
-                     costs["Flex"] += data.Bids[b].Price[t] * Result.clearedDown[s][t][b]
-            costLists["Hourly cost (FA)"]["t={}".format(t)] = costs["Flex"]
-            costLists["Hourly cost (TA)"]["t={}".format(t)] = costs["All"]
-            
-            day = math.floor((t-1)/24)
-            costLists["Daily cost (FA)"]["d={}".format(day)] += costs["Flex"]
-            costLists["Daily cost (TA)"]["d={}".format(day)] += costs["All"]
-            
-        for c in costLists:
-            res = {"Model":s,"Total":sum(costLists[c].values())}
-            res.update({key:val for key,val in costLists[c].items()})
-            DFs[c]=pd.concat([DFs[c],pd.Series(res).to_frame().T,],ignore_index=True)
-      
-
-    for c in DFs:
-        DFs[c] = DFs[c].set_index("Model")  
+    periods = list(Result.flow["Day ahead"])
+    models = list(Result.read)
+    cleared = pd.concat([resultTable(Result,"clearedUp"),resultTable(Result,"clearedDown")],ignore_index=True)
+    modelPos = pd.Index(models).get_indexer(cleared["Model"].astype(object))
+    periodPos = pd.Index(periods).get_indexer(cleared["Period"])
+    keep = (modelPos >= 0) & (periodPos >= 0)
+    cleared = cleared[keep]
+    
+    bids = data.Bids
+    isFlex = np.array([bool(data.System.Nodes[bids[b].Node].isFlex) for b in bids.fullDict])
+    codes,IDs = pd.factorize(cleared["Key"])
+    rows = bids.rows(IDs)[codes]
+    cost = bids.Price[rows,bids.columns(periods)[periodPos[keep]]] * cleared["Value"].to_numpy()
+    
+    cell = modelPos[keep] * len(periods) + periodPos[keep]
+    size = len(models) * len(periods)
+    hourly = {"All":np.bincount(cell,weights=cost,minlength=size).reshape(len(models),len(periods)),
+              "Flex":np.bincount(cell,weights=np.where(isFlex[rows],cost,0.0),minlength=size).reshape(len(models),len(periods))}
+    days = [math.floor((t-1)/24) for t in periods]
+    
+    DFs = {}
+    for c,column in (("Hourly cost (FA)","Flex"),("Hourly cost (TA)","All"),("Daily cost (FA)","Flex"),("Daily cost (TA)","All")):
+        rows = []
+        for i,s in enumerate(models):
+            values = hourly[column][i].tolist()
+            if c.startswith("Hourly"):
+                costList = {"t={}".format(t):v for t,v in zip(periods,values)}
+            else:
+                costList = collections.defaultdict(int)
+                for d,v in zip(days,values):
+                    costList["d={}".format(d)] += v
+            res = {"Model":s,"Total":sum(costList.values())}
+            res.update(costList)
+            rows.append(res)
+        DFs[c] = pd.DataFrame(rows,dtype=object).set_index("Model")
         Result.DataFrames[c] = DFs[c]
     
     return DFs
-
-
-
-    
\ No newline at end of file
@@ -6,6 +6,14 @@ Anders Ryssdal and Victor Aasvær
 
 Classes storing the system parameters used in the project
 """
+import copy
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu
+from Flex_supportFunctions import ArrayTable,FlowRow,storeTable,loadTable,plainTables
+
+minReactance = 1e-4                     #Lowest reactance (p.u.) used for the DC PTDFs, so lines without reactance do not make the susceptance matrix singular
+minPTDF = 1e-9                          #PTDFs up to this size are set to zero. The solve leaves roundoff in their place, which the solvers would only warn about and drop
 
 #Object containing information about grid system
 class System:
@@ -16,6 +24,10 @@ class System:
         self.DA_volumes = {}                                #P^(DA)_tn
         self.NetVolumes = {"DA":False, "Nodal":False,"Re-dispatch":False,"Pre zonal":False,"Post Zonal":False,}       #P^(DA)_tn, adjusted for model results
         
+        #Arrays built from the dicts above the first time they are needed. Attributes starting with _ are not stored by to_dict()
+        self._PTDFmatrix = None                             #(PTDF dict it was built from, lines x nodes array)
+        self._netArrays = {}                                #Type as key, storing (NetVolumes dict it was built from, periods, periods x nodes array)
+        
     #Function returning list with line object
     def getLineList(self,category): 
         List = []
@@ -41,23 +53,94 @@ class System:
         return List
     
     
+    #Dense PTDF matrix with the lines as rows and nodes as columns, in the order of self.Lines and self.Nodes
+    def getPTDFMatrix(self):
+        if isinstance(self.PTDFs,DCPTDFs):
+            return self.PTDFs.full()
+        if self._PTDFmatrix is None or self._PTDFmatrix[0] is not self.PTDFs:
+            if isinstance(self.PTDFs,ArrayTable):
+                self._PTDFmatrix = (self.PTDFs,self.PTDFs.matrix(self.Lines,self.Nodes))
+                return self._PTDFmatrix[1]
+            matrix = np.array([[self.PTDFs[l][n] for n in self.Nodes] for l in self.Lines]).reshape(len(self.Lines),len(self.Nodes))
+            self._PTDFmatrix = (self.PTDFs,matrix)
+        return self._PTDFmatrix[1]
+    
+    #PTDF rows of the given lines. PTDFs calculated from the line reactances only calculate these rows, not the full matrix
+    def getPTDFRows(self,lines):
+        if isinstance(self.PTDFs,DCPTDFs):
+            return self.PTDFs.rows(lines)
+        position = {l:i for i,l in enumerate(self.Lines)}
+        return self.getPTDFMatrix()[[position[l] for l in lines]]
+    
+    #Line flows (periods x lines) of net volumes (periods x nodes, in the order of self.Nodes)
+    def getFlows(self,net):
+        if isinstance(self.PTDFs,DCPTDFs):
+            return self.PTDFs.flows(net)
+        return net @ self.getPTDFMatrix().T
+    
+    #Net volumes of a type as an array with the periods as rows and the nodes as columns, together with a dict giving the row of each period
+    def getNetArray(self,Type="DA"):
+        volumes = self.NetVolumes[Type]
+        if Type not in self._netArrays or self._netArrays[Type][0] is not volumes:
+            periods = list(volumes)
+            if isinstance(volumes,ArrayTable):
+                array = volumes.matrix(periods,self.Nodes)
+            else:
+                array = np.array([[volumes[t][n] for n in self.Nodes] for t in periods]).reshape(len(periods),len(self.Nodes))
+            self._netArrays[Type] = (volumes,{t:i for i,t in enumerate(periods)},array)
+        return self._netArrays[Type][2],self._netArrays[Type][1]
+    
     def to_dict(self):
         Dict = {}
         for name,value in vars(self).items():
-            if name=="Nodes" or name=="Lines":
+            if name.startswith("_"):
+                continue
+            elif name=="Nodes" or name=="Lines":
                 Dict[name] = {ID:obj.to_dict() for ID,obj in value.items()}
+            elif isinstance(value,DCPTDFs):
+                Dict[name] = value.settings()
             else:
-                Dict[name] = value
+                Dict[name] = plainTables(value)
+        return Dict
+    
+    #Method putting the PTDFs and volumes into arrays, returning the rest of the object as a dict
+    def to_arrays(self,arrays):
+        Dict = {}
+        for name,value in vars(self).items():
+            if name.startswith("_"):
+                continue
+            elif name=="Nodes" or name=="Lines":
+                Dict[name] = {ID:obj.to_dict() for ID,obj in value.items()}
+            elif name=="PTDFs":
+                Dict[name] = value.settings() if isinstance(value,DCPTDFs) else storeTable(arrays,"System_PTDFs",value)
+            elif name=="DA_volumes":
+                Dict[name] = storeTable(arrays,"System_DA_volumes",value,fields=["Production","Load","Net"])
+            elif name=="NetVolumes":
+                Dict[name] = {m:storeTable(arrays,"System_NetVolumes_" + m,volumes) if volumes else False for m,volumes in value.items()}
         return Dict
     
+    @classmethod
+    def from_arrays(cls,Dict,arrays):
+        sys = cls()
+        sys.Nodes = {ID:Node.from_dict(nodeDict) for ID,nodeDict in Dict["Nodes"].items()}
+        sys.Lines = {int(ID):Line.from_dict(lineDict) for ID,lineDict in Dict["Lines"].items()}
+        sys.PTDFs = DCPTDFs(sys,**Dict["PTDFs"]["DC"]) if "DC" in Dict["PTDFs"] else loadTable(arrays,Dict["PTDFs"])
+        sys.DA_volumes = loadTable(arrays,Dict["DA_volumes"])
+        sys.NetVolumes = {m:loadTable(arrays,description) if description else False for m,description in Dict["NetVolumes"].items()}
+        return sys
+    
     @classmethod
     def from_dict(cls,Dict):
         sys = cls()
         for name,value in vars(sys).items():
-            if name == "Nodes": 
+            if name.startswith("_"):
+                continue
+            elif name == "Nodes": 
                 setattr(sys,name, {ID:Node.from_dict(nodeDict) for ID,nodeDict in Dict[name].items()})
             elif name=="Lines":
                 setattr(sys,name,{int(ID):Line.from_dict(lineDict) for ID,lineDict in Dict[name].items()})
+            elif name=="PTDFs" and "DC" in Dict[name]:
+                sys.PTDFs = DCPTDFs(sys,**Dict[name]["DC"])
             elif name=="NetVolumes":
                 for m in Dict[name]:
                     if Dict[name][m]:
@@ -72,6 +155,124 @@ class System:
         return sys
     
     
+#%%PTDFs of a DC power flow, calculated from the reactances of System.Lines instead of read from the PTDF sheet of the input data.
+#Indexed like the PTDF dict, PTDFs[l][n]. The reduced susceptance matrix is factorised once for each topology, and a PTDF row is only calculated
+#when its line is used, so e.g. the zonal PTDFs only calculate the rows of the lines between zones. Only the settings are saved with the data object.
+#The slack node is the first node unless another is given
+class DCPTDFs:
+    def __init__(self,system,slack=None,baseMVA=100):
+        self.system = system
+        self.slack = slack
+        self.baseMVA = baseMVA
+        self.lines = None                   #Lines dict the factorisation was last checked against
+        self.topology = None                #Nodes and (line, from, to, reactance) of the factorisation
+        self.cache = {}                     #PTDF row of each calculated line, as a FlowRow indexed by node
+        self.fullMatrix = None
+    
+    def settings(self):
+        return {"DC":{"slack":self.slack,"baseMVA":self.baseMVA}}
+    
+    #The same PTDFs for another system object, e.g. one with other line capacities. The factorisation and rows are shared as long as the topology is the same
+    def bind(self,system):
+        ptdfs = copy.copy(self)
+        ptdfs.system = system
+        return ptdfs
+    
+    #Reactance of a line in p.u., with the lower voltage of its ends as base
+    def reactance(self,line):
+        V = min(self.system.Nodes[line.From].Voltage,self.system.Nodes[line.To].Voltage)
+        return max(line.x_per_km*line.Distance*self.baseMVA/V**2,minReactance)
+    
+    #Factorise the reduced susceptance matrix, again only if the nodes, line ends or reactances have changed (not for e.g. capacity changes)
+    def factorise(self):
+        if self.lines is self.system.Lines:
+            return
+        self.lines = self.system.Lines
+        topology = (tuple(self.system.Nodes),tuple((l,line.From,line.To,self.reactance(line)) for l,line in self.lines.items()))
+        if topology == self.topology:
+            return
+        self.topology = topology
+        self.nodes = {n:i for i,n in enumerate(self.system.Nodes)}
+        self.lineIndex = {l:i for i,l in enumerate(self.lines)}
+        ends = [(self.nodes[line.From],self.nodes[line.To]) for line in self.lines.values()]
+        self.grid = dcGrid(incidenceMatrix(ends,len(self.nodes)),[x for l,f,t,x in topology[1]],self.nodes[self.slack] if self.slack is not None else 0)
+        self.cache = {}
+        self.fullMatrix = None
+    
+    #PTDF rows (lines x nodes) of the given lines, calculating the rows that are not cached with one solve. The roundoff of the solve is set to zero
+    def rows(self,lines):
+        self.factorise()
+        lines = list(lines)
+        missing = [l for l in dict.fromkeys(lines) if l not in self.cache]
+        if missing:
+            weighted,keep,factor = self.grid
+            rows = np.zeros((len(missing),len(self.nodes)))
+            rows[:,keep] = factor.solve(weighted[[self.lineIndex[l] for l in missing]][:,keep].T.toarray()).T
+            rows[np.abs(rows) <= minPTDF] = 0
+            for l,row in zip(missing,rows):
+                self.cache[l] = FlowRow(row,self.nodes)
+        return np.array([self.cache[l].array for l in lines]).reshape(len(lines),len(self.nodes))
+    
+    #Full PTDF matrix in the order of System.Lines and System.Nodes, kept until the topology changes
+    def full(self):
+        self.factorise()
+        if self.fullMatrix is None:
+            self.fullMatrix = self.rows(self.lines)
+        return self.fullMatrix
+    
+    def matrix(self,lines,nodes):
+        return self.rows(lines)[:,[self.nodes[n] for n in nodes]]
+    
+    #Line flows (periods x lines) of net volumes (periods x nodes), solving for the voltage angles instead of using the PTDF matrix
+    def flows(self,net):
+        self.factorise()
+        return dcFlows(self.grid,net)
+    
+    def __getitem__(self,l):
+        if self.lines is not self.system.Lines:
+            self.factorise()
+        if l not in self.cache:
+            self.rows([l])
+        return self.cache[l]
+    
+    def __iter__(self):
+        return iter(self.system.Lines)
+    
+    def __len__(self):
+        return len(self.system.Lines)
+    
+    def __contains__(self,l):
+        return l in self.system.Lines
+    
+    def keys(self):
+        return self.system.Lines.keys()
+    
+    def items(self):
+        return ((l,self[l]) for l in self.system.Lines)
+    
+    def to_dict(self):
+        return {l:dict(row.items()) for l,row in self.items()}
+
+#Incidence matrix (lines x nodes) with 1 in the from node and -1 in the to node of each line, given as (from, to) node positions
+def incidenceMatrix(ends,nNodes):
+    ends = np.array(ends,dtype=int).reshape(-1,2)
+    return sp.csr_matrix((np.tile([1.0,-1.0],len(ends)),(np.repeat(np.arange(len(ends)),2),ends.ravel())),shape=(len(ends),nNodes))
+
+#Sparse DC power flow of a grid given by its incidence matrix and line reactances. Returns the incidence matrix weighted by the line susceptances,
+#the positions of the nodes other than the slack, and the factorisation of the reduced susceptance matrix
+def dcGrid(incidence,x,slack=0):
+    weighted = (sp.diags(1/np.asarray(x,dtype=float)) @ incidence).tocsr()
+    keep = np.delete(np.arange(incidence.shape[1]),slack)
+    factor = splu((incidence[:,keep].T @ weighted[:,keep]).tocsc())
+    return weighted,keep,factor
+
+#Line flows (periods x lines) of net volumes (periods x nodes) in a grid from dcGrid
+def dcFlows(grid,net):
+    weighted,keep,factor = grid
+    angles = np.zeros((weighted.shape[1],net.shape[0]))
+    angles[keep] = factor.solve(np.ascontiguousarray(np.asarray(net,dtype=float)[:,keep].T))
+    return (weighted @ angles).T
+
 #Line class used as a container in the System class
 class Line:        
     def __init__(self,ID,From,To,Type,Cap,Dist,b,x,r,c,isFlex, Cap_ka):
@@ -5,6 +5,7 @@ Created on Fri Oct 21 11:48:30 2022
 File containing both the zone partitioning heuristic (Heuristic) and the object where the result is stored (Zones)
 """
 import networkx as nx
+import json
 from Flex_supportFunctions import LoadFlow
 
 #%% Object storing the zones created fro the various time periods. The period is the outer key for each property
@@ -41,9 +42,79 @@ class Zones:
             obj.cutLines[int(t)] = [int(l) for l in Dict["cutLines"][t]]       
         return obj
     
+#%% Object storing the partitions found by the heuristic, so periods with the same congestion can reuse an earlier partition
+#The key is (congested flex lines, congestion magnitudes rounded to the tolerance, nZones, minNodes). A cache belongs to one grid, and is emptied if used with another
+class PartitionCache:
+    def __init__(self,tolerance=0.01):
+        
+        self.tolerance = tolerance          # Congestion magnitudes within the same multiple of the tolerance (MW) give the same key
+        self.grid = None                    # Flex lines as (ID, from, to), identifying the grid the partitions belong to
+        self.partitions = dict()            # Key as described above, storing (zone nodes, cut lines)
+        self.hits = 0
+        self.misses = 0
+        
+    def __contains__(self,key):
+        return key in self.partitions
+        
+    #Key for the congestion of one period, given the DA flow of the period
+    def getKey(self,Data,flow,nZones,minNodes):
+        grid = tuple((l,Data.System.Lines[l].From,Data.System.Lines[l].To) for l in Data.System.getLineList("Flex"))
+        if grid != self.grid:
+            self.grid = grid
+            self.partitions = dict()
+        congested = []
+        magnitudes = []
+        for l in Data.System.getLineList("Flex"):
+            line = Data.System.Lines[l]
+            if line.Capacity < abs(flow[line.ID]):
+                congested.append(l)
+                magnitudes.append(int(round((abs(flow[line.ID])-line.Capacity)/self.tolerance)))
+        return (tuple(congested),tuple(magnitudes),nZones,minNodes)
+    
+    #Returns copies of the zone nodes and cut lines stored for the key, counting hits and misses
+    def get(self,key):
+        if key in self.partitions:
+            self.hits += 1
+            nodes,cutLines = self.partitions[key]
+            return {z:list(n) for z,n in nodes.items()},list(cutLines)
+        self.misses += 1
+        return None
+    
+    def add(self,key,nodes,cutLines):
+        self.partitions[key] = ({z:list(n) for z,n in nodes.items()},list(cutLines))
+        
+    def hitRate(self):
+        if self.hits + self.misses == 0:
+            return 0
+        return self.hits/(self.hits + self.misses)
+    
+    def report(self):
+        print("Partition cache: {} hits and {} misses ({:.0%} hit rate), {} partitions stored".format(self.hits,self.misses,self.hitRate(),len(self.partitions)))
+    
+    def to_dict(self):
+        return {"tolerance":self.tolerance, "grid":self.grid, 
+                "partitions":[[list(key[0]),list(key[1]),key[2],key[3],nodes,cutLines] for key,(nodes,cutLines) in self.partitions.items()]}
+    
+    @classmethod
+    def from_dict(cls,Dict):
+        cache = cls(Dict["tolerance"])
+        cache.grid = tuple(tuple(line) for line in Dict["grid"]) if Dict["grid"] is not None else None
+        for congested,magnitudes,nZones,minNodes,nodes,cutLines in Dict["partitions"]:
+            cache.partitions[(tuple(congested),tuple(magnitudes),nZones,minNodes)] = ({int(z):n for z,n in nodes.items()},cutLines)
+        return cache
+    
+    def save(self,path):
+        with open(path,"w") as f:
+            json.dump(self.to_dict(),f)
+    
+    @classmethod
+    def load(cls,path):
+        with open(path,"r") as f:
+            return cls.from_dict(json.load(f))
+    
 #%% Object running and keeping track of the zonePartitioning heuristic for one specific hour, logging every iteration with its respective key in order to keep track of the algorithm
 class Heuristic:
-    def __init__(self, Data, nZones, minNodes, t):
+    def __init__(self, Data, nZones, minNodes, t, flow=None):
 
         # Information about the partition process:
         self.minNodes = minNodes
@@ -70,7 +141,8 @@ class Heuristic:
     
         #%%Finding congested lines and creating a Graph object
         
-        flow = LoadFlow(Data,"DA")[t]
+        if flow is None:
+            flow = LoadFlow(Data,"DA",[t])[t]
         lines = Data.System.getLineList("Flex")
         congestedLines = []
         for l in lines:
@@ -180,10 +252,11 @@ def targetedPartition(G, minNodes, congestedLines):
     bestCut = []
     bestValue = 0
     foundCut = False
+    graph = CutGraph(G)
     # Iterate over the congested lines within the zone G
     for l in congestedLines:
-        # The cutLine() function is recursive and only returns when it has completely split G in two
-        partition1, partition2, feasible, node = cutLine(G, l.From, l.To, minNodes)
+        # The cutLine() function only returns when it has completely split G in two
+        partition1, partition2, feasible, node = cutLine(graph, l.From, l.To, minNodes)
         # Check if cutLine returned a feasible solution and compares with the best solution found so far
         if feasible:
             foundCut = True
@@ -195,42 +268,153 @@ def targetedPartition(G, minNodes, congestedLines):
         return (nx.Graph(), nx.Graph(), 0, {})
     return (nx.subgraph(G, bestCut[0]), nx.subgraph(G, bestCut[1]), bestValue, G.edges-nx.subgraph(G, bestCut[0]).edges-nx.subgraph(G, bestCut[1]).edges)
 
-# %%The innermost layer of the heuristic. Made up of two functions
+# %%The innermost layer of the heuristic. Made up of a compact graph and two functions
 
 
-def cutLine(G, startNode, endNode, minNodes):
-    SP = nx.shortest_path(G, startNode, endNode)
-    G2 = G.copy()
-    #Prioritize congested lines, otherwize cut in the middle of shortest path
-    #for c in congestedLines:
-        #if (c[0] in SP and c[1] in )
-    G2.remove_edge(SP[round(len(SP)/2)-1], SP[round(len(SP)/2)])
-    if nx.is_connected(G2):
-        partition1, partition2, feasible, node = cutLine(G2, startNode, endNode, minNodes)
-    else:
-        partition1, partition2, feasible, node = findPartitions(G2, startNode, endNode, minNodes)
+#Compact version of a zone graph, where cuts are made by masking edges instead of copying the graph. Nodes are numbered in the order networkx iterates them,
+#and the neighbours are stored as (node, edge) pairs. Two neighbour orders are kept, so the cuts follow the same paths as when working on networkx graphs: 
+#the order of G itself, and the order networkx gives a copy of G (first the neighbours earlier in the node order, then the later ones in the order of G)
+class CutGraph:
+    def __init__(self, G):
+        self.names = list(G.nodes)
+        self.index = {n: i for i, n in enumerate(self.names)}
+        self.edges = {}
+        self.rawAdj = []
+        for u, n in enumerate(self.names):
+            row = []
+            for m in G.adj[n]:
+                v = self.index[m]
+                key = (min(u, v), max(u, v))
+                if key not in self.edges:
+                    self.edges[key] = len(self.edges)
+                row.append((v, self.edges[key]))
+            self.rawAdj.append(row)
+        self.adj = [sorted(p for p in row if p[0] < u) + [p for p in row if p[0] >= u] for u, row in enumerate(self.rawAdj)]
+        self.removed = bytearray(len(self.edges))
+        self.connected = len(self.names) > 0 and len(self.reach(0, None)) == len(self.names)
+
+    def remove(self, u, v):
+        e = self.edges[(min(u, v), max(u, v))]
+        self.removed[e] = 1
+        return e
+
+    def restore(self, e):
+        self.removed[e] = 0
+
+    def neighbors(self, name):
+        return [self.names[v] for v, e in self.adj[self.index[name]] if not self.removed[e]]
+
+    #Nodes reachable from u, stopping early if target is found
+    def reach(self, u, target):
+        seen = {u}
+        stack = [u]
+        while stack:
+            w = stack.pop()
+            for v, e in self.adj[w]:
+                if not self.removed[e] and v not in seen:
+                    if v == target:
+                        return seen | {v}
+                    seen.add(v)
+                    stack.append(v)
+        return seen
+
+    #Shortest path between two nodes, using the same bidirectional search as networkx' shortest_path
+    def shortestPath(self, source, target, raw=False):
+        adj = self.rawAdj if raw else self.adj
+        if source == target:
+            return [source]
+        pred = {source: None}
+        succ = {target: None}
+        forward_fringe = [source]
+        reverse_fringe = [target]
+        w = None
+        while forward_fringe and reverse_fringe and w is None:
+            if len(forward_fringe) <= len(reverse_fringe):
+                this_level = forward_fringe
+                forward_fringe = []
+                for v in this_level:
+                    for x, e in adj[v]:
+                        if self.removed[e]:
+                            continue
+                        if x not in pred:
+                            forward_fringe.append(x)
+                            pred[x] = v
+                        if x in succ:
+                            w = x
+                            break
+                    if w is not None:
+                        break
+            else:
+                this_level = reverse_fringe
+                reverse_fringe = []
+                for v in this_level:
+                    for x, e in adj[v]:
+                        if self.removed[e]:
+                            continue
+                        if x not in succ:
+                            succ[x] = v
+                            reverse_fringe.append(x)
+                        if x in pred:
+                            w = x
+                            break
+                    if w is not None:
+                        break
+        if w is None:
+            raise nx.NetworkXNoPath("No path between {} and {}.".format(self.names[source], self.names[target]))
+        path = []
+        while w is not None:
+            path.append(w)
+            w = pred[w]
+        path.reverse()
+        w = succ[path[-1]]
+        while w is not None:
+            path.append(w)
+            w = succ[w]
+        return path
+
 
-    if not feasible and node == startNode:
-        G2 = G.copy()
-        G2.remove_edge(node, SP[1])
-        if nx.is_connected(G2):
-            partition1, partition2, feasible, node = cutLine(G2, startNode, endNode, minNodes)
+#Cut the shortest path between startNode and endNode until the zone is split in two. The cuts are kept on an explicit stack, where each entry is one graph state: 
+#[shortest path, stage, masked edge, connected], with stage 0 before the middle edge is cut, 1 before the retry next to a too small partition and 2 when finished
+def cutLine(G, startNode, endNode, minNodes):
+    if not isinstance(G, CutGraph):
+        G = CutGraph(G)
+    s, t = G.index[startNode], G.index[endNode]
+    
+    stack = [[None, 0, None, G.connected]]
+    result = None
+    while stack:
+        frame = stack[-1]
+        SP, stage, edge, connected = frame
+        if stage == 0:
+            SP = [G.names[n] for n in G.shortestPath(s, t, raw=len(stack) == 1)]
+            frame[0] = SP
+            cut = (SP[round(len(SP)/2)-1], SP[round(len(SP)/2)])
         else:
-            partition1, partition2, feasible, node = findPartitions(G2, startNode, endNode, minNodes)
-    elif not feasible and node == endNode:
-        G2 = G.copy()
-        G2.remove_edge(node, SP[-2])
-        if nx.is_connected(G2):
-            partition1, partition2, feasible, node = cutLine(G2, startNode, endNode, minNodes)
+            G.restore(edge)
+            partition1, partition2, feasible, node = result
+            if stage == 1 and not feasible and node == startNode:
+                cut = (node, SP[1])
+            elif stage == 1 and not feasible and node == endNode:
+                cut = (node, SP[-2])
+            else:
+                stack.pop()
+                continue
+        
+        frame[1] = stage + 1
+        u, v = G.index[cut[0]], G.index[cut[1]]
+        frame[2] = G.remove(u, v)
+        #Removing one edge from a connected graph keeps it connected if its end nodes can still reach each other
+        if connected and v in G.reach(u, v):
+            stack.append([None, 0, None, True])
         else:
-            partition1, partition2, feasible, node = findPartitions(G2, startNode, endNode, minNodes)
-
-    return (partition1, partition2, feasible, node)
+            result = findPartitions(G, startNode, endNode, minNodes)
+    
+    return result
 
 
 def findPartitions(G, n1, n2, minNodes):
-    neighbors1 = set(nx.neighbors(G, n1))
-    neighbors2 = set(nx.neighbors(G, n2))
+    neighbors1 = set(G.neighbors(n1))
+    neighbors2 = set(G.neighbors(n2))
 
     checkedNodes = set()
     connectedNodes = set()
@@ -249,11 +433,11 @@ def findPartitions(G, n1, n2, minNodes):
         checkedNodes.add(node)
         connectedNodes.remove(node)
 
-        nodeNeighbors = set(nx.neighbors(G, node))
+        nodeNeighbors = set(G.neighbors(node))
         connectedNodes.update(nodeNeighbors - connectedNodes - checkedNodes)
 
     partition1 = checkedNodes
-    partition2 = G.nodes-partition1
+    partition2 = set(n for n in G.names if n not in partition1)
 
     if len(partition1) >= minNodes and len(partition2) >= minNodes:
         return (partition1, partition2, True, 0)
@@ -0,0 +1,183 @@
+"""
+Created on Fri Mar 17 2023
+
+Anders Ryssdal and Victor Aasvær
+
+Benchmarks on synthetic grids of a given size. syntheticTables makes the tables read by Data.Import (see importTables in Flex_Import) for a meshed
+transmission grid with regional flexibility grids below some of its nodes, with participants and DA volume profiles.
+benchmarkScaling runs the whole system on grids of increasing size, from the import and zone partitioning to the three clearing models and the
+interpretation of the result, and reports the time and memory of each stage from the run metrics. The tables have no PTDF sheet, so the PTDFs are
+calculated from the line reactances when they are used (see DCPTDFs in Flex_System)
+"""
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from Flex_Data import Data
+from Flex_System import incidenceMatrix,dcGrid,dcFlows
+from Flex_Result import Result,interpretResult
+from Flex_metaFunctions import runModels
+from Flex_solvers import SolverBackend,setSolver,getSolver
+from Flex_supportFunctions import HiddenPrints,Metrics,metrics,timeString
+
+#Size tiers used by benchmarkScaling. Each tier is given as the keyword arguments of syntheticTables
+gridTiers = {"Small":{"nNodes":50}, "Medium":{"nNodes":150}, "Large":{"nNodes":400}, "Very large":{"nNodes":1000}}
+
+#Stages reported by benchmarkScaling, as the names of the spans in the run metrics
+stages = ["Generate","Import","Partition","ZPTDFs","Build","Solve","Read","Interpret"]
+
+#Bid behaviours of the participant types, with the probability of each type
+participantTypes = {"Aggregator":0.3, "Battery":0.2, "Industry":0.2, "Intermittent":0.3}
+
+
+#%%Synthetic grid
+
+#Lines of a random tree over the nodes, connecting each node to one of the "reach" nodes before it
+def treeLines(nodes,rng,reach=3):
+    return [(nodes[rng.integers(max(0,i-reach),i)],nodes[i]) for i in range(1,len(nodes))]
+
+#Tables in the format of importTables for a grid with nNodes nodes and nLines lines, of which a share flexShare are in the regional grids.
+#The regional grids hang below nHosts of the transmission nodes and are connected to each other by a few lines, so the flexibility grid is one graph.
+#The line capacities are set from the peak DA flows, and a congestion above 1 gives more congested lines in the regional grids
+def syntheticTables(nNodes=50,nLines=None,days=1,nHosts=None,flexShare=0.8,participantShare=0.5,congestion=1.0,seed=0):
+    rng = np.random.default_rng(seed)
+    nTS = max(2,round(nNodes*(1-flexShare)))
+    nHosts = min(nTS,nHosts if nHosts else max(1,nTS//5))
+    nRegional = nNodes - nTS
+    if nLines is None:
+        nLines = round(nNodes*1.25)
+
+    #Nodes, with the regional nodes named as in the input data, "R_<host>_<number>"
+    TS = ["Bus {}".format(i) for i in range(1,nTS+1)]
+    hosts = TS[:nHosts]
+    hostOf = np.sort(np.arange(nRegional) % nHosts)
+    regional = {h:["R_{}_{}".format(host,k) for k in range(1,(hostOf == h).sum()+1)] for h,host in enumerate(hosts)}
+    coordinates = {n:(59+rng.uniform(0,3),8+rng.uniform(0,6)) for n in TS}
+    rows = [{"bus_id":n,"baseKV":300,"type":"b","lat":coordinates[n][0],"lon":coordinates[n][1],"zone":1,"Flex_grid":0,"isHost":n in hosts,"Load_share":1.0} for n in TS]
+    for h,nodes in regional.items():
+        lat,lon = coordinates[hosts[h]]
+        rows += [{"bus_id":n,"baseKV":22,"type":"b","lat":lat+rng.uniform(-0.1,0.1),"lon":lon+rng.uniform(-0.1,0.1),"zone":1,"Flex_grid":1,"isHost":False,"Load_share":1/len(nodes)} for n in nodes]
+    nodeTable = pd.DataFrame(rows)
+    names = list(nodeTable["bus_id"])
+    index = {n:i for i,n in enumerate(names)}
+
+    #Lines: a tree in the transmission grid and in each regional grid, lines between neighbouring regional grids, and random lines up to nLines
+    lines = [(a,b,0) for a,b in treeLines(TS,rng,nTS)]
+    for h,nodes in regional.items():
+        if nodes:
+            lines += [(hosts[h],nodes[0],1)] + [(a,b,1) for a,b in treeLines(nodes,rng)]
+    grids = [nodes for nodes in regional.values() if nodes]
+    lines += [(str(rng.choice(a)),str(rng.choice(b)),1) for a,b in zip(grids[:-1],grids[1:])]
+    pairs = {frozenset(line[:2]) for line in lines}
+    for attempt in range(20*nNodes):
+        if len(lines) >= nLines:
+            break
+        if rng.random() < 1-flexShare or not grids:
+            a,b,flex = *map(str,rng.choice(TS,2,replace=False)),0
+        else:
+            nodes = grids[rng.integers(len(grids))]
+            if len(nodes) < 3:
+                continue
+            i = rng.integers(len(nodes)-2)
+            a,b,flex = nodes[i],nodes[min(len(nodes)-1,i+rng.integers(2,6))],1
+        if frozenset((a,b)) not in pairs:
+            pairs.add(frozenset((a,b)))
+            lines.append((a,b,flex))
+    lineTable = pd.DataFrame(lines,columns=["bus_from","bus_to","Flex_grid"])
+    lineTable["type"] = "line"
+    lineTable["x"] = np.where(lineTable["Flex_grid"] == 1,rng.uniform(0.05,0.3,len(lines)),rng.uniform(0.01,0.1,len(lines)))
+    lineTable["r"] = lineTable["x"]*0.3
+    lineTable["b"] = 0.0
+
+    #Participants in the regional grids
+    nParticipants = max(1,round(participantShare*nRegional)) if nRegional else 0
+    participants = pd.DataFrame({"Participant":np.arange(1,nParticipants+1),
+                                 "Type":[str(t) for t in rng.choice(list(participantTypes),nParticipants,p=list(participantTypes.values()))],
+                                 "Node":[str(n) for n in rng.choice(names[nTS:],nParticipants)] if nParticipants else [],
+                                 "Size":rng.uniform(2,15,nParticipants).round(1),
+                                 "Cost scaling":rng.uniform(0.8,1.4,nParticipants).round(2)})
+
+    #DA volumes with a daily profile. The first node balances the system, the other hosts only produce, as in the NordPool data.
+    #The nodes of the participants produce and consume at least the size of the participants, so the re-dispatch bids can undo any flexibility activated
+    T = days*24
+    hours = np.arange(T) % 24
+    daily = np.repeat(rng.uniform(0.9,1.1,days),24)
+    profile = (1 + 0.3*np.sin(2*np.pi*(hours-8)/24))*daily
+    solar = np.maximum(0,np.sin(np.pi*(hours-6)/12))
+    isRegional = nodeTable["Flex_grid"].to_numpy() == 1
+    isHost = nodeTable["isHost"].to_numpy()
+    baseLoad = np.where(isRegional,rng.uniform(0.5,5,nNodes),np.where(isHost,0,rng.uniform(50,150,nNodes)))
+    load = np.outer(profile,baseLoad) * rng.normal(1,0.05,(T,nNodes))
+    production = np.outer(np.ones(T),np.where(isRegional,0,rng.uniform(50,150,nNodes))) * rng.normal(1,0.05,(T,nNodes))
+    producers = isRegional & (rng.random(nNodes) < 0.3)
+    production[:,producers] = np.outer(solar,rng.uniform(1,8,producers.sum()))
+    sizes = np.bincount([index[n] for n in participants["Node"]],participants["Size"],nNodes)
+    production += sizes
+    load += sizes
+    production[:,0] = 0
+    load[:,0] = 0
+    net = (production - load).sum(axis=1)
+    production[:,0] = np.maximum(-net,0)
+    load[:,0] = np.maximum(net,0)
+
+    #Capacities from the peak flows of the DA volumes, with the slack in the first node as in DCPTDFs
+    grid = dcGrid(incidenceMatrix([(index[a],index[b]) for a,b,f in lines],nNodes),lineTable["x"].to_numpy())
+    peak = np.abs(dcFlows(grid,production - load)).max(axis=0)
+    lineTable["rate_a"] = np.where(lineTable["Flex_grid"] == 1,np.maximum(1,peak*rng.uniform(0.7,1.5,len(lines))/congestion),np.maximum(100,peak*2))
+
+    return {"Nodes":nodeTable,"Lines":lineTable[["bus_from","bus_to","type","r","x","b","rate_a","Flex_grid"]],"Participants":participants,
+            "Production":production,"Load":load}
+
+#Data object for a synthetic grid, made in the same way as from the input workbooks. The bid noise is drawn with the seed
+def syntheticData(days=1,nZones=5,minNodes=5,seed=0,**size):
+    with metrics.span("Generate",**size):
+        tables = syntheticTables(days=days,seed=seed,**size)
+    np.random.seed(seed)
+    return Data.create(days,nZones,minNodes,tables)
+
+
+#%%Scaling benchmark
+
+#Run one tier and return its spans. Used in a separate process, so the memory high-water mark of a tier does not include the earlier tiers
+def runTier(name,size,days,builder,nZones,minNodes,seed,solver):
+    setSolver(SolverBackend(**solver))
+    metrics.reset()
+    with HiddenPrints(), metrics.span("Tier",Tier=name) as span:
+        data = syntheticData(days,nZones,minNodes,seed,**size)
+        span.update(Nodes=len(data.System.Nodes),Lines=len(data.System.Lines),Bids=len(data.Bids.getBids("All")))
+        res = Result()
+        runModels(res,data,builder=builder)
+        interpretResult(res,data)
+    return metrics.spans
+
+#Time and memory of each stage for each tier. Tiers are names in gridTiers or dicts with the arguments of syntheticTables.
+#The table has one row for each tier and stage, with the number of spans, the total time and the memory high-water mark in MB.
+#The spans of all tiers are saved to path if it is given, and can be loaded again with Metrics.load
+def benchmarkScaling(tiers=("Small","Medium"),days=1,builder="Pyomo",nZones=5,minNodes=5,seed=0,isolate=True,path=None):
+    print("Benchmarking {} grid sizes".format(len(tiers)))
+    spans = []
+    for tier in tiers:
+        name,size = (tier,gridTiers[tier]) if isinstance(tier,str) else (str(tier),tier)
+        args = (name,size,days,builder,nZones,minNodes,seed,getSolver().settings())
+        if isolate:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                tierSpans = executor.submit(runTier,*args).result()
+        else:
+            tierSpans = runTier(*args)
+        total = tierSpans[-1]
+        print("\t{} ({} nodes, {} lines, {} bids) finished after {}".format(name,total["Nodes"],total["Lines"],total["Bids"],timeString(total["Time"])))
+        spans += tierSpans
+    record = Metrics(spans)
+    if path:
+        record.save(path)
+
+    #The total of a tier is its "Tier" span
+    table = record.table()
+    rows = []
+    for tier,tierTable in table.groupby("Tier",sort=False):
+        total = tierTable[tierTable["Span"] == "Tier"].iloc[0]
+        for stage in stages + ["Total"]:
+            stageSpans = tierTable[tierTable["Span"] == (stage if stage != "Total" else "Tier")]
+            if len(stageSpans):
+                rows.append({"Tier":tier,"Stage":stage,"Nodes":int(total["Nodes"]),"Lines":int(total["Lines"]),"Bids":int(total["Bids"]),
+                             "Count":len(stageSpans),"Time":stageSpans["Time"].sum(),"Memory":stageSpans["Memory"].max()})
+    return pd.DataFrame(rows).set_index(["Tier","Stage"])
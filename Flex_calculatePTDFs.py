@@ -3,81 +3,85 @@
 Created on Wed Oct 19 09:39:58 2022
 
 Anders Ryssdal and Victor Aasvær
+
+Zonal PTDFs calculated with matrices: the zones are given as a node -> zone vector, the GSKs as a sparse (nodes x zones) matrix
+and the zonal PTDFs as the product of the nodal PTDF matrix and the GSK matrix
 """
 
-import copy
-
-
-
-
-
-def DA_at_node(Data, t, node):
-    return abs(Data.System.DA_volumes[t][node]['Net'])
-
-
-def DA_in_zone(Data, t, z, z_to_n):
-    num = 0
-    for n in z_to_n[z]:
-        num += DA_at_node(Data, t, n)
-    return num 
-
-def is_intra_zonal(Data, t, line,z_to_n):
-    from_node = Data.System.Nodes[Data.System.Lines[line].From].ID
-    to_node = Data.System.Nodes[Data.System.Lines[line].To].ID
-    for z in list(z_to_n.keys()):
-        if from_node in z_to_n[z]:
-            from_zone = z
-        if to_node in z_to_n[z]:
-            to_zone = z
-        
-    if to_zone == from_zone:
-        return True
-    else:
-        return False
-    
-
-def calc_GSK(Data, t,z_to_n):
-    GSK = {}
-    DA_at_Node = {}
-    for node in Data.System.getNodeList('All'):
-        DA_at_Node[node] = DA_at_node(Data, t, node)
-        
-    DA_in_Zone = {}
-    for zone in list(z_to_n.keys()):
-        DA_in_Zone[zone] = DA_in_zone(Data, t, zone,z_to_n)
-
-    for node in Data.System.getNodeList('All'):
-        GSK[node] = {}
-        for zone in list(z_to_n.keys()):
-            if node in z_to_n[zone]:
-                if DA_in_Zone[zone] == 0:
-                    GSK[node][zone] = 0
-                else:
-                    GSK[node][zone] = DA_at_Node[node]/DA_in_Zone[zone]
-            else:
-                GSK[node][zone] = 0
-    return GSK
-    
-    
+import numpy as np
+import scipy.sparse as sp
+
 
-def calc_ZPTDF(Data, t):
 
-    z_to_n = copy.deepcopy(Data.Zones.nodes[t])
-    #Adding the fake zones 
-    ind = len(z_to_n) + 1
+#Zone membership as (node, zone) position pairs, in the order of System.Nodes and the returned list of zones. 
+#Every node outside the flexibility area gets its own fake zone
+def zoneMembers(Data, t, nodes):
+    zones = list(Data.Zones.nodes[t].keys())
+    members = [(nodes[n],k) for k,z in enumerate(zones) for n in Data.Zones.nodes[t][z]]
+
+    #Adding the fake zones
+    ind = len(zones) + 1
     for node in Data.System.getNodeList("Not flex"):
-        z_to_n[ind] = [node]
+        members.append((nodes[node],len(zones)))
+        zones.append(ind)
         ind += 1
-            
-    ZPTDF = {}
-    GSK = calc_GSK(Data, t,z_to_n)
-    for line in Data.System.getLineList('All'):
-        if is_intra_zonal(Data, t, line,z_to_n):
-            continue
-        ZPTDF[line] = {}
-        for zone in list(z_to_n.keys()):
-            ZPTDF[line][zone] = sum([Data.System.PTDFs[line][n]*GSK[n][zone] for n in z_to_n[zone]])
-            
-    return ZPTDF
-    
-    
\ No newline at end of file
+    rows,cols = np.array(members,dtype=int).reshape(-1,2).T
+    return rows,cols,zones
+
+
+#Node -> zone vector. A node listed in several zones is given the last of them, and nodes without a zone get -1
+def zoneVector(nNodes, rows, cols):
+    zoneOf = np.full(nNodes,-1,dtype=int)
+    for n,k in zip(rows,cols):
+        zoneOf[n] = k
+    return zoneOf
+
+
+#Positions of the from and to nodes of each line, in the order of System.Lines
+def lineEnds(Data, nodes):
+    fromNode = np.array([nodes[Data.System.Nodes[line.From].ID] for line in Data.System.Lines.values()],dtype=int)
+    toNode = np.array([nodes[Data.System.Nodes[line.To].ID] for line in Data.System.Lines.values()],dtype=int)
+    return fromNode,toNode
+
+
+#Boolean vector, in the order of System.Lines, telling if both ends of a line are in the same zone
+def is_intra_zonal(zoneOf, fromNode, toNode):
+    return zoneOf[fromNode] == zoneOf[toNode]
+
+
+#GSK matrix (nodes x zones), where each node is weighted by its absolute DA net volume relative to the zone total
+def calc_GSK(weights, rows, cols, nZones):
+    zoneTotal = np.bincount(cols, weights=weights[rows], minlength=nZones)
+    total = zoneTotal[cols]
+    values = np.divide(weights[rows], total, out=np.zeros(len(rows)), where=total != 0)
+    return sp.csr_matrix((values,(rows,cols)),shape=(len(weights),nZones))
+
+
+#Zonal PTDFs for one period, with the lines between zones as outer key and the zones as inner key
+def calc_ZPTDF(Data, t):
+    return calc_ZPTDFs(Data, [t])[t]
+
+
+#Zonal PTDFs for several periods. Periods with the same zones and DA volumes as an earlier period share its result.
+#Only the PTDF rows of the lines between zones are used
+def calc_ZPTDFs(Data, periods):
+    netArray,netIndex = Data.System.getNetArray("DA")
+    lines = np.array(Data.System.getLineList("All"),dtype=object)
+    nodes = {n:i for i,n in enumerate(Data.System.Nodes)}
+    fromNode,toNode = lineEnds(Data, nodes)
+
+    ZPTDFs = {}
+    computed = {}
+    for t in periods:
+        rows,cols,zones = zoneMembers(Data, t, nodes)
+        weights = np.abs(netArray[netIndex[t]])
+        key = (tuple(zones), rows.tobytes(), cols.tobytes(), weights.tobytes())
+        if key not in computed:
+            GSK = calc_GSK(weights, rows, cols, len(zones))
+            interZonal = ~is_intra_zonal(zoneVector(len(nodes), rows, cols), fromNode, toNode)
+            ZPTDF = (GSK.T @ Data.System.getPTDFRows(lines[interZonal].tolist()).T).T
+            computed[key] = {line:dict(zip(zones,row)) for line,row in zip(lines[interZonal].tolist(),ZPTDF.tolist())}
+        ZPTDFs[t] = computed[key]
+    return ZPTDFs
+
+
@@ -0,0 +1,107 @@
+"""
+Created on Tue Mar 21 2023
+
+Anders Ryssdal and Victor Aasvær
+
+Compact formulation of the node clearing and re-dispatch models. The net production and the line flows are not variables, so the models have no
+net production and line flow constraints. The line limits are written directly on the cleared bids, as the PTDFs times the net volumes plus the bids
+cleared in each node, with the flows of the net volumes moved to the limits. The net production, the flows and the nodal prices are found from the
+solution afterwards, the nodal prices as the PTDFs times the duals of the line limits, which is what the duals of the net production constraints give
+"""
+import numpy as np
+import scipy.sparse as sp
+import pyomo.environ as pyo
+from pyomo.core.expr.numeric_expr import LinearExpression
+from Flex_supportFunctions import netArray
+from Flex_System import minPTDF
+
+
+#%% Compact model
+#Adds the line limits to a Pyomo model with the variables clearedUp and clearedDown over model.upBids and model.downBids.
+#After solving, variableValues/dualValues give the net production, the flows and the nodal prices with the names of the full model,
+#so that the read functions in the Result object work for both
+class CompactModel:
+    def __init__(self,model,Data,netVolumes=None):
+        self.model = model
+        self.Periods = list(model.Periods)
+        self.obj = model.obj
+        self.System = Data.System
+        self.periods = {t:i for i,t in enumerate(self.Periods)}
+        self.nodes = {n:i for i,n in enumerate(Data.System.Nodes)}
+        self.allLines = {l:i for i,l in enumerate(Data.System.Lines)}
+
+        #Lines with a finite capacity, and their PTDF rows (lines x nodes)
+        self.lines = [l for l in Data.System.Lines if np.isfinite(Data.System.Lines[l].Capacity)]
+        self.PTDFs = np.asarray(Data.System.getPTDFRows(self.lines))
+        self.net = netArray(Data,self.Periods,netVolumes)
+
+        #Node of each bid as (nodes x bids) incidence matrices
+        self.upBids = list(model.upBids)
+        self.downBids = list(model.downBids)
+        self.up = self.incidence(Data,self.upBids)
+        self.down = self.incidence(Data,self.downBids)
+
+        self.addLineLimits(Data)
+
+    def incidence(self,Data,bids):
+        pairs = [(self.nodes[Data.Bids[b].Node],j) for j,b in enumerate(bids) if Data.Bids[b].Node in self.nodes]
+        rows,cols = zip(*pairs) if pairs else ((),())
+        return sp.csr_matrix((np.ones(len(pairs)),(rows,cols)),shape=(len(self.nodes),len(bids)))
+
+    #e-f: Line capacity, with the flow of each line as the flow of the net volumes plus the PTDFs of the nodes of the cleared bids.
+    #Lines no bid can change are left out, unless the net volumes already overload them. PTDFs up to minPTDF (see Flex_System) are left out
+    def addLineLimits(self,Data):
+        flows = self.net @ self.PTDFs.T
+        upPTDFs = (self.up.T @ self.PTDFs.T).T
+        downPTDFs = (self.down.T @ self.PTDFs.T).T
+
+        #Bids and coefficients of each line, with the down bids entering with the negative PTDF
+        terms = {}
+        for i,l in enumerate(self.lines):
+            up = np.flatnonzero(np.abs(upPTDFs[i]) > minPTDF)
+            down = np.flatnonzero(np.abs(downPTDFs[i]) > minPTDF)
+            terms[l] = ([("clearedUp",self.upBids[j]) for j in up] + [("clearedDown",self.downBids[j]) for j in down],
+                        upPTDFs[i][up].tolist() + (-downPTDFs[i][down]).tolist(),i)
+
+        #The expressions are made as linear expressions directly, as the sums would be slow for the many bids of each line
+        def lineCap_rule(model,l,t):
+            bids,coefficients,i = terms[l]
+            capacity = Data.System.Lines[l].Capacity
+            flow = flows[self.periods[t],i]
+            if not bids:
+                return pyo.Constraint.Skip if abs(flow) <= capacity else pyo.Constraint.Infeasible
+            cleared = LinearExpression(constant=0,linear_coefs=coefficients,linear_vars=[getattr(model,name)[b,t] for name,b in bids])
+            return pyo.inequality(-capacity-flow,cleared,capacity-flow)
+        self.model.lineCap_cons = pyo.Constraint(self.lines,self.Periods,rule=lineCap_rule)
+
+    #%% Values found from the solution
+    def cleared(self,name,bids):
+        values = getattr(self.model,name).extract_values()
+        return np.array([[values[b,t] for b in bids] for t in self.Periods],dtype=float).reshape(len(self.Periods),len(bids))
+
+    #Net production (periods x nodes), the net volumes plus the bids cleared in each node
+    def production(self):
+        return self.net + (self.up @ self.cleared("clearedUp",self.upBids).T).T - (self.down @ self.cleared("clearedDown",self.downBids).T).T
+
+    #Nodal prices (periods x nodes) as the PTDFs times the duals of the line limits
+    def prices(self):
+        constraints = self.model.lineCap_cons
+        duals = np.array([[self.model.dual[constraints[l,t]] if (l,t) in constraints else 0 for l in self.lines] for t in self.Periods],dtype=float)
+        return (duals @ self.PTDFs).reshape(len(self.Periods),len(self.nodes))
+
+    def variableValues(self,name,index):
+        if name == "prod":
+            prod = self.production()
+            return np.array([prod[self.periods[t],self.nodes[n]] for n,t in index],dtype=float)
+        if name == "flow":
+            flows = self.System.getFlows(self.production())
+            return np.array([flows[self.periods[t],self.allLines[l]] for l,t in index],dtype=float)
+        values = getattr(self.model,name).extract_values()
+        return np.array([values[i] for i in index],dtype=float)
+
+    def dualValues(self,name,index):
+        if name == "netProduction_cons":
+            prices = self.prices()
+            return np.array([prices[self.periods[t],self.nodes[n]] for n,t in index],dtype=float)
+        constraints = getattr(self.model,name)
+        return np.array([self.model.dual[constraints[i]] for i in index],dtype=float)
@@ -0,0 +1,374 @@
+"""
+Created on Mon Mar 13 2023
+
+Anders Ryssdal and Victor Aasvær
+
+Matrix form of the node clearing, re-dispatch and zone clearing models.
+The constraint matrices are assembled directly from sparse arrays (PTDFs, bid-to-node incidence, bid volumes and prices) and handed to the solver in one call,
+instead of calling a Pyomo rule for every (line, period) and (node, period)
+"""
+import numpy as np
+import scipy.sparse as sp
+import time
+from Flex_supportFunctions import timeString,metrics,netArray
+from Flex_solvers import getSolver
+from Flex_redispatch import zonalNetVolumes
+
+#%% Object holding a linear model on the form min c*x, s.t. A*x (=,<=) b, lb <= x <= ub
+#After solving, the primal and dual vectors are kept as arrays, and variableValues/dualValues give the values of a block for (key, period) indices 
+#with the same names as in the Pyomo models, so that the read functions in the Result object work for both
+class MatrixModel:
+    def __init__(self,periods):
+        self.Periods = list(periods)
+
+        self.nVars = 0
+        self.varBlocks = {}                 #Variable name as key, storing (index,offset)
+        self.lb = []
+        self.ub = []
+        self.c = []
+
+        self.rowBlocks = {}                 #Constraint name as key, storing (index,offset)
+        self.positions = {}                 #Block name as key, storing the position of each index in the primal or dual vector
+        self.nRows = 0
+        self.A = []
+        self.sense = []
+        self.rhs = []
+
+    #Add a block of variables. The index is a list of tuples, while lb, ub and cost are scalars or arrays with one value per index
+    def addVar(self,name,index,lb=-np.inf,ub=np.inf,cost=0):
+        n = len(index)
+        self.varBlocks[name] = (index,self.nVars)
+        self.lb.append(np.broadcast_to(np.asarray(lb,dtype=float).ravel(),(n,)) if np.ndim(lb) else np.full(n,lb,dtype=float))
+        self.ub.append(np.broadcast_to(np.asarray(ub,dtype=float).ravel(),(n,)) if np.ndim(ub) else np.full(n,ub,dtype=float))
+        self.c.append(np.broadcast_to(np.asarray(cost,dtype=float).ravel(),(n,)) if np.ndim(cost) else np.full(n,cost,dtype=float))
+        self.nVars += n
+
+    #Add a block of constraints. The coefficients are given as sparse matrices for each variable block that is part of the constraints
+    def addRows(self,name,index,sense,rhs,**blocks):
+        n = len(index)
+        A = sp.hstack([blocks[var] if var in blocks else sp.csr_matrix((n,len(idx))) for var,(idx,offset) in self.varBlocks.items()],format="csr")
+        self.rowBlocks[name] = (index,self.nRows)
+        self.A.append(A)
+        self.sense.append(np.full(n,sense))
+        self.rhs.append(np.broadcast_to(np.asarray(rhs,dtype=float).ravel(),(n,)) if np.ndim(rhs) else np.full(n,rhs,dtype=float))
+        self.nRows += n
+
+    #Solved with the selected solver backend, see Flex_solvers
+    def solve(self,name="Matrix"):
+        A = sp.vstack(self.A,format="csr")
+        sense = np.concatenate(self.sense)
+        rhs = np.concatenate(self.rhs)
+
+        #Rows with an infinite right hand side can never be binding, and are left out
+        active = np.isfinite(rhs)
+
+        self.values,duals,self.obj = getSolver().solveMatrix(np.concatenate(self.c),A[active],sense[active],rhs[active],np.concatenate(self.lb),np.concatenate(self.ub),name)
+        self.duals = np.zeros(self.nRows)
+        self.duals[active] = duals
+
+    #Positions in the primal or dual vector of the given indices of a block
+    def blockPositions(self,blocks,name,index):
+        if name not in self.positions:
+            keys,offset = blocks[name]
+            self.positions[name] = {key:offset+i for i,key in enumerate(keys)}
+        positions = self.positions[name]
+        return np.array([positions[i] for i in index],dtype=int)
+
+    #Solution values of a variable block for a list of (key, period) indices
+    def variableValues(self,name,index):
+        return self.values[self.blockPositions(self.varBlocks,name,index)]
+
+    #Duals of a constraint block for a list of (key, period) indices
+    def dualValues(self,name,index):
+        return self.duals[self.blockPositions(self.rowBlocks,name,index)]
+
+#%% Support functions building the arrays used in the models
+
+#Index with (key, period) tuples, key-major. This is the ordering assumed by periodKron()
+def grid(keys,periods):
+    return [(k,t) for k in keys for t in periods]
+
+#Expand a (rows x keys) matrix to act on a variable block indexed by grid(keys,periods), giving one row per (row,period)
+def periodKron(M,T):
+    return sp.kron(sp.csr_matrix(M),sp.identity(T),format="csr")
+
+#Matrix with a one where the bid (column) belongs to the key (row), e.g. bid-to-node or bid-to-participant
+def incidence(keys,bids,keyOf):
+    pos = {k:i for i,k in enumerate(keys)}
+    rows,cols = [],[]
+    for j,b in enumerate(bids):
+        k = keyOf(b)
+        if k in pos:
+            rows.append(pos[k])
+            cols.append(j)
+    return sp.csr_matrix((np.ones(len(rows)),(rows,cols)),shape=(len(keys),len(bids)))
+
+#Array with the volume or price of each bid (rows) for each period (columns)
+def bidArray(Data,bids,periods,attribute):
+    return Data.Bids.getArray(attribute,bids,periods)
+
+#Battery constraints shared by the node and zone clearing models
+def addBatteryRows(model,Data,upBids,downBids,periods):
+    T = len(periods)
+    batteries = list(Data.Participants.types["Battery"])
+
+    #State of charge is updated in every period except the first period of a day
+    following = [j for j,t in enumerate(periods) if t%24 != 1]
+    S = sp.csr_matrix((np.ones(len(following)),(range(len(following)),following)),shape=(len(following),T))
+    Sprev = sp.csr_matrix((np.ones(len(following)),(range(len(following)),[j-1 for j in following])),shape=(len(following),T))
+
+    upInc = incidence(batteries,upBids,lambda b: Data.Bids[b].Participant)
+    downInc = incidence(batteries,downBids,lambda b: Data.Bids[b].Participant)
+    model.addRows("batteryCharge_cons",[(i,periods[j]) for i in batteries for j in following],"=",0,
+                  charge = sp.kron(sp.identity(len(batteries)),S-Sprev,format="csr"),
+                  clearedUp = sp.kron(upInc/Data.Participants.batteryEfficiency["Discharge"],S,format="csr"),
+                  clearedDown = -sp.kron(downInc*Data.Participants.batteryEfficiency["Charge"],S,format="csr"))
+
+#Aggregator constraints shared by the node and zone clearing models
+def addAggregatorRows(model,Data,upBids,downBids,periods):
+    T = len(periods)
+    aggregators = list(Data.Participants.types["Aggregator"])
+    sizes = np.array([Data.Participants[i].Size for i in aggregators])
+
+    upInc = incidence(aggregators,upBids,lambda b: Data.Bids[b].Participant)
+    downInc = incidence(aggregators,downBids,lambda b: Data.Bids[b].Participant)
+
+    #Six hour windows starting in the periods where the rule is active
+    starts = [j for j,t in enumerate(periods) if 1 <= t%24 <= 19]
+    W = sp.csr_matrix((np.ones(6*len(starts)),(np.repeat(range(len(starts)),6),[j+k for j in starts for k in range(6)])),shape=(len(starts),T))
+    model.addRows("Aggregator_cons1",[(i,periods[j]) for i in aggregators for j in starts],"<",np.repeat(sizes*6*0.2,len(starts)),
+                  clearedUp = sp.kron(upInc,W,format="csr"),
+                  clearedDown = -sp.kron(downInc,W,format="csr"))
+
+    ones = sp.csr_matrix(np.ones((1,T)))
+    model.addRows("Aggregator_cons2",aggregators,"<",sizes*T*0.1,
+                  clearedUp = -sp.kron(upInc,ones,format="csr"),
+                  clearedDown = sp.kron(downInc,ones,format="csr"))
+
+#%% Node clearing model
+def NodeClearing_matrix(Data,Result,day):
+    #Tracking running time
+    startTime = time.time()
+    span = metrics.start("Build",Model="Nodal",Day=day)
+    print("Initilalizing node clearing (matrix form)")
+
+    periods = list(range((day-1)*24+1,day*24+1))
+    T = len(periods)
+    nodes = Data.System.getNodeList("All")
+    lines = Data.System.getLineList("All")
+    batteries = list(Data.Participants.types["Battery"])
+    upBids = Data.Bids.upBids
+    downBids = Data.Bids.downBids
+
+    model = MatrixModel(periods)
+
+    #%%Model variables, bid sizes and line capacities are given as bounds
+    capacity = np.array([Data.System.Lines[l].Capacity for l in lines])
+    sizes = np.array([Data.Participants[i].Size for i in batteries])
+    chargeLB = np.array([[s/2 if t%24 == 1 else 0 for t in periods] for s in sizes]).reshape(len(batteries),T)
+    chargeUB = np.array([[s/2 if t%24 == 1 else s for t in periods] for s in sizes]).reshape(len(batteries),T)
+
+    model.addVar("clearedUp",grid(upBids,periods),0,bidArray(Data,upBids,periods,"Volume"),bidArray(Data,upBids,periods,"Price"))
+    model.addVar("clearedDown",grid(downBids,periods),0,bidArray(Data,downBids,periods,"Volume"),bidArray(Data,downBids,periods,"Price"))
+    model.addVar("flow",grid(lines,periods),np.repeat(-capacity,T),np.repeat(capacity,T))
+    model.addVar("prod",grid(nodes,periods))
+    model.addVar("charge",grid(batteries,periods),chargeLB,chargeUB)
+
+    #%% Model constraints
+    flexUp = np.array([[Data.Bids[b].Participant != "Re-dispatch" for b in upBids]],dtype=float)
+    flexDown = np.array([[Data.Bids[b].Participant != "Re-dispatch" for b in downBids]],dtype=float)
+
+    #b: The market must keep the energy balance
+    model.addRows("marketBalance_cons",periods,"=",0,
+                  clearedUp = periodKron(np.ones((1,len(upBids))),T),
+                  clearedDown = -periodKron(np.ones((1,len(downBids))),T))
+    model.addRows("marketBalance_flex__cons",periods,"=",0,
+                  clearedUp = periodKron(flexUp,T),
+                  clearedDown = -periodKron(flexDown,T))
+
+    #c: Find net production in each node
+    DA = netArray(Data,periods).T
+    model.addRows("netProduction_cons",grid(nodes,periods),"=",-DA,
+                  clearedUp = periodKron(incidence(nodes,upBids,lambda b: Data.Bids[b].Node),T),
+                  clearedDown = -periodKron(incidence(nodes,downBids,lambda b: Data.Bids[b].Node),T),
+                  prod = -sp.identity(len(nodes)*T,format="csr"))
+
+    #e: Find line flow
+    model.addRows("lineFlow_cons",grid(lines,periods),"=",0,
+                  flow = sp.identity(len(lines)*T,format="csr"),
+                  prod = -periodKron(Data.System.getPTDFMatrix(),T))
+
+    #g-j: Battery and aggregator constraints
+    addBatteryRows(model,Data,upBids,downBids,periods)
+    addAggregatorRows(model,Data,upBids,downBids,periods)
+
+    metrics.stop(span,Variables=model.nVars,Constraints=model.nRows)
+    print("Initilialize finished after {} \n".format(timeString(time.time()-startTime)))
+
+    #%% Solving the problem
+    startTime =time.time()
+    print("Running node clearing")
+    model.solve("Nodal")
+    print("Model run finished after {} \n".format(timeString(time.time()-startTime)))
+
+    with metrics.span("Read",Model="Nodal",Day=day):
+        Result.read_nodal(model,Data)
+
+#%% Re-dispatch model
+def Redispatch_matrix(Data,Result,day,Context="Ordinary",netVolumes=None):
+    #Tracking running time
+    startTime = time.time()
+    name = "Re-dispatch" if Context == "Ordinary" else "Post zonal"
+    span = metrics.start("Build",Model=name,Day=day)
+    print("Initilalizing Re-dispatch (matrix form)")
+
+    periods = list(range((day-1)*24+1,day*24+1))
+    T = len(periods)
+    nodes = Data.System.getNodeList("All")
+    lines = Data.System.getLineList("All")
+    upBids = list(Data.Bids.getBids("Up","Re-dispatch"))
+    downBids = list(Data.Bids.getBids("Down","Re-dispatch"))
+
+    model = MatrixModel(periods)
+
+    #%%Model variables
+    capacity = np.array([Data.System.Lines[l].Capacity for l in lines])
+    model.addVar("clearedUp",grid(upBids,periods),0,bidArray(Data,upBids,periods,"Volume"),bidArray(Data,upBids,periods,"Price"))
+    model.addVar("clearedDown",grid(downBids,periods),0,bidArray(Data,downBids,periods,"Volume"),bidArray(Data,downBids,periods,"Price"))
+    model.addVar("flow",grid(lines,periods),np.repeat(-capacity,T),np.repeat(capacity,T))
+    model.addVar("prod",grid(nodes,periods))
+
+    #%% Model constraints
+
+    #b: The market must keep the energy balance
+    model.addRows("marketBalance_cons",periods,"=",0,
+                  clearedUp = periodKron(np.ones((1,len(upBids))),T),
+                  clearedDown = -periodKron(np.ones((1,len(downBids))),T))
+
+    #c: Find net production in each node
+    net = netArray(Data,periods,netVolumes if Context == "Post zonal" else None).T
+    model.addRows("netProduction_cons",grid(nodes,periods),"=",-net,
+                  clearedUp = periodKron(incidence(nodes,upBids,lambda b: Data.Bids[b].Node),T),
+                  clearedDown = -periodKron(incidence(nodes,downBids,lambda b: Data.Bids[b].Node),T),
+                  prod = -sp.identity(len(nodes)*T,format="csr"))
+
+    #e: Find line flow
+    model.addRows("lineFlow_cons",grid(lines,periods),"=",0,
+                  flow = sp.identity(len(lines)*T,format="csr"),
+                  prod = -periodKron(Data.System.getPTDFMatrix(),T))
+
+    metrics.stop(span,Variables=model.nVars,Constraints=model.nRows)
+    print("Initilialize finished after {} \n".format(timeString(time.time()-startTime)))
+
+    #%% Solving the problem
+    startTime =time.time()
+    print("Running Re-dispatch")
+    model.solve(name)
+    print("Model run finished after {} \n".format(timeString(time.time()-startTime)))
+
+    with metrics.span("Read",Model=name,Day=day):
+        if Context == "Ordinary":
+            Result.read_re(model,Data)
+        elif Context == "Post zonal":
+            Result.read_postZonal(model,Data)
+
+#Adapting the net volumes to the zonal solution and doing redispatch, not accounting for redispatch bids accepted in zonal model
+def Redispatch_post_matrix(Data,Result,day):
+
+    Redispatch_matrix(Data,Result,day,"Post zonal",zonalNetVolumes(Data,Result,day))
+
+#%% Zone clearing model
+def ZoneClearing_matrix(Data,Result,day,penalty = 50):
+    #Tracking running time
+    startTime = time.time()
+    span = metrics.start("Build",Model="Zonal",Day=day)
+    print("Initilalizing zone clearing (matrix form)")
+
+    periods = list(range((day-1)*24+1,day*24+1))
+    T = len(periods)
+    nodes = Data.System.getNodeList("All")
+    batteries = list(Data.Participants.types["Battery"])
+    upBids = list(Data.Bids.getBids("Up","Flex"))
+    downBids = list(Data.Bids.getBids("Down","Flex"))
+
+    #The zones and the lines between them change from period to period
+    zoneIndex = [(z,t) for t in periods for z in Data.Zones.nodes[t]]
+    lineIndex = [(l,t) for t in periods for l in dict.fromkeys(Data.Zones.cutLines[t])]
+    zonePos = {key:i for i,key in enumerate(zoneIndex)}
+
+    model = MatrixModel(periods)
+
+    #%%Model variables
+    sizes = np.array([Data.Participants[i].Size for i in batteries])
+    chargeLB = np.array([[s/2 if t%24 == 1 else 0 for t in periods] for s in sizes]).reshape(len(batteries),T)
+    chargeUB = np.array([[s/2 if t%24 == 1 else s for t in periods] for s in sizes]).reshape(len(batteries),T)
+
+    model.addVar("clearedUp",grid(upBids,periods),0,bidArray(Data,upBids,periods,"Volume"),bidArray(Data,upBids,periods,"Price"))
+    model.addVar("clearedDown",grid(downBids,periods),0,bidArray(Data,downBids,periods,"Volume"),bidArray(Data,downBids,periods,"Price"))
+    model.addVar("flow",lineIndex)
+    model.addVar("congestion",lineIndex,0,np.inf,penalty)
+    model.addVar("prod",zoneIndex)
+    model.addVar("charge",grid(batteries,periods),chargeLB,chargeUB)
+
+    #%% Model constraints
+
+    #b: The market must keep the energy balance (note that we are excluding re-dispatch in this model)
+    model.addRows("marketBalance_cons",periods,"=",0,
+                  clearedUp = periodKron(np.ones((1,len(upBids))),T),
+                  clearedDown = -periodKron(np.ones((1,len(downBids))),T))
+
+    #c: Find net production in each zone. The zone membership matrix of each period maps the node incidence of the bids to the zones
+    upInc = incidence(nodes,upBids,lambda b: Data.Bids[b].Node)
+    downInc = incidence(nodes,downBids,lambda b: Data.Bids[b].Node)
+    DA = netArray(Data,periods).T
+    nodePos = {n:i for i,n in enumerate(nodes)}
+
+    upBlocks,downBlocks,rhs = [],[],[]
+    for j,t in enumerate(periods):
+        members = [(i,nodePos[n]) for i,z in enumerate(Data.Zones.nodes[t]) for n in Data.Zones.nodes[t][z]]
+        M = sp.csr_matrix((np.ones(len(members)),([i for i,k in members],[k for i,k in members])),shape=(len(Data.Zones.nodes[t]),len(nodes)))
+        E = sp.csr_matrix(([1.0],([0],[j])),shape=(1,T))
+        upBlocks.append(sp.kron(M@upInc,E,format="csr"))
+        downBlocks.append(sp.kron(M@downInc,E,format="csr"))
+        rhs.append(-(M@DA[:,j]))
+    model.addRows("netProduction_cons",zoneIndex,"=",np.concatenate(rhs),
+                  clearedUp = sp.vstack(upBlocks,format="csr"),
+                  clearedDown = -sp.vstack(downBlocks,format="csr"),
+                  prod = -sp.identity(len(zoneIndex),format="csr"))
+
+    #e: Find line flow
+    rows,cols,vals = [],[],[]
+    for i,(l,t) in enumerate(lineIndex):
+        for z in Data.Zones.nodes[t]:
+            rows.append(i)
+            cols.append(zonePos[z,t])
+            vals.append(-Data.ZPTDFs[t][l][z])
+    model.addRows("lineFlow_cons",lineIndex,"=",0,
+                  flow = sp.identity(len(lineIndex),format="csr"),
+                  prod = sp.csr_matrix((vals,(rows,cols)),shape=(len(lineIndex),len(zoneIndex))))
+
+    #f: Line capacity
+    capacity = np.array([Data.System.Lines[l].Capacity for l,t in lineIndex])
+    model.addRows("lineCap_cons_1",lineIndex,"<",capacity,
+                  flow = sp.identity(len(lineIndex),format="csr"),
+                  congestion = -sp.identity(len(lineIndex),format="csr"))
+    model.addRows("lineCap_cons_2",lineIndex,"<",capacity,
+                  flow = -sp.identity(len(lineIndex),format="csr"),
+                  congestion = -sp.identity(len(lineIndex),format="csr"))
+
+    #g-j: Battery and aggregator constraints
+    addBatteryRows(model,Data,upBids,downBids,periods)
+    addAggregatorRows(model,Data,upBids,downBids,periods)
+
+    metrics.stop(span,Variables=model.nVars,Constraints=model.nRows)
+    print("Initilialize finished after {} \n".format(timeString(time.time()-startTime)))
+
+    #%% Solving the problem
+    startTime =time.time()
+    print("Running zone clearing")
+    model.solve("Zonal")
+    print("Model run finished after {} \n".format(timeString(time.time()-startTime)))
+
+    with metrics.span("Read",Model="Zonal",Day=day):
+        Result.read_zonal(model,Data)
+    return model
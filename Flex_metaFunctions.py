@@ -5,65 +5,318 @@ Anders Ryssdal and Victor Aasvær
 
 Functions used to execute the total model system
 """
-from Flex_Data import Data
-from Flex_supportFunctions import Save,Load,HiddenPrints,timeString
+from Flex_Data import Data,ScenarioOverlay,inputFile
+from Flex_supportFunctions import Save,Load,HiddenPrints,timeString,DA_path,RunManifest,Metrics,metrics,fingerprint
+from Flex_Import import importTables,importDay
 from Flex_nodeClearing import NodeClearing
 from Flex_zoneClearing import ZoneClearing
 from Flex_redispatch import Redispatch,Redispatch_post
-from Flex_Result import Result,interpretResult
+from Flex_matrixModels import NodeClearing_matrix,Redispatch_matrix,ZoneClearing_matrix,Redispatch_post_matrix
+from Flex_persistentModels import PersistentModels
+from Flex_Result import Result,interpretResult,FindCosts
+from Flex_Zones import PartitionCache
+from Flex_solvers import SolverBackend,setSolver,getSolver
 
 import time
 import os
 import copy
+import inspect
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 
 #%%Support functions
 
-#Function loading result objects that have been stored in the correct way
-def loadResults(runID):
-    results = {}
-    data= Load(Data,"Data_{}".format(runID),folder=["Results"])
+checkpointFolder = "Checkpoints"         #Folder in the results folder storing the finished days of the scenarios of runAll
+
+#Results stored for a run, listed from the names in the results folder. A result is only loaded the first time it is used, and its dataframes
+#are only made when they are used. The data object of the run is loaded when it is first needed
+class ResultsCatalog:
+    def __init__(self,runID,folder="Results"):
+        self.runID = runID
+        self.folder = folder
+        self.suffix = "_{}".format(runID)
+        self.dataLoaded = None
+        self.entries = {}                   #Result key -> {scenario name -> file name}
+        self.loaded = {}                    #(result key, file name) -> Result
         
-    for root, dirs, files in os.walk(os.getcwd()+"\\Results",topdown=False):
-        folder = root.rsplit("\\",1)[-1]
-        if  folder != "Results" and "_{}".format(runID) not in folder:
-            results[folder] = {} 
-            for name in files:
-                if "_{}".format(runID) in name:
-                    results[folder][name] = Load(Result,name,folder=["Results",folder])
-                    interpretResult(results[folder][name],data)
-            for name in dirs:
-                if "_{}".format(runID) in name:
-                    results[folder][name] = Load(Result,name,folder=["Results",folder])
-                    interpretResult(results[folder][name],data)
-    return results,data
+        for key in sorted(os.listdir(folder)):
+            path = os.path.join(folder,key)
+            if not os.path.isdir(path) or key.endswith(self.suffix) or key == checkpointFolder or os.path.isfile(os.path.join(path,"meta.json")):
+                continue
+            names = sorted(name for name in os.listdir(path) if name.endswith(self.suffix))
+            if names:
+                self.entries[key] = {name:name for name in names}
+    
+    #IDs of all runs with results in the folder
+    @staticmethod
+    def runs(folder="Results"):
+        IDs = set()
+        for key in os.listdir(folder):
+            if os.path.isdir(os.path.join(folder,key)) and key != checkpointFolder and not os.path.isfile(os.path.join(folder,key,"meta.json")):
+                IDs.update(name.rsplit("_",1)[1] for name in os.listdir(os.path.join(folder,key)) if "_" in name)
+        return sorted(IDs)
+    
+    @property
+    def data(self):
+        if self.dataLoaded is None:
+            self.dataLoaded = Load(Data,"Data" + self.suffix,folder=[self.folder])
+        return self.dataLoaded
+    
+    #Run metrics saved by runAll, see Metrics in Flex_supportFunctions
+    @property
+    def metrics(self):
+        return Metrics.load(os.path.join(self.folder,"Metrics{}.json".format(self.suffix)))
+    
+    #Names of the scenarios stored under a result key, or all (result key, scenario) pairs
+    def scenarios(self,key=None):
+        if key is not None:
+            return list(self.entries[key])
+        return [(key,name) for key in self.entries for name in self.entries[key]]
+    
+    def load(self,key,name):
+        if (key,name) not in self.loaded:
+            res = Load(Result,self.entries[key][name],folder=[self.folder,key])
+            interpretResult(res,lambda: self.data,lazy=True)
+            self.loaded[(key,name)] = res
+        return self.loaded[(key,name)]
+    
+    def __getitem__(self,key):
+        return ResultGroup(self,key)
+    
+    def __iter__(self):
+        return iter(self.entries)
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def __contains__(self,key):
+        return key in self.entries
+    
+    def keys(self):
+        return self.entries.keys()
+    
+    def items(self):
+        return ((key,self[key]) for key in self.entries)
+
+#The results stored under one result key, indexed by file name as in the dict returned by the old loadResults
+class ResultGroup:
+    def __init__(self,catalog,key):
+        self.catalog = catalog
+        self.key = key
+    
+    def __getitem__(self,name):
+        return self.catalog.load(self.key,name)
+    
+    def __iter__(self):
+        return iter(self.catalog.entries[self.key])
+    
+    def __len__(self):
+        return len(self.catalog.entries[self.key])
+    
+    def __contains__(self,name):
+        return name in self.catalog.entries[self.key]
+    
+    def keys(self):
+        return self.catalog.entries[self.key].keys()
+    
+    def items(self):
+        return ((name,self[name]) for name in self)
 
-def runModels(res,data,penalty=50):
+#Results of runAll saved as soon as they are finished. Each day of a scenario is saved to "<folder>/Checkpoints/<runID>" when it is solved, and a finished
+#scenario is saved in the result folders read by openResults. The manifest records the finished days and scenarios, so runAll started again
+#with the same runID only solves what is missing
+class Checkpoint:
+    def __init__(self,runID,settings,folder="Results"):
+        self.runID = runID
+        self.folder = folder
+        self.dayFolder = [folder,checkpointFolder,runID]
+        self.manifest = RunManifest(os.path.join(*self.dayFolder,"Manifest.json"),settings)
+    
+    #Steps are named by the result key and scenario key, e.g. "Redispatch sensitivity/reCost=30/Day 2"
+    @staticmethod
+    def step(key,name,day=None):
+        step = "{}/{}".format(key,name if name else "")
+        return step if day is None else "{}/Day {}".format(step,day)
+    
+    def fileName(self,name):
+        return "{}_{}".format(name if name else "",self.runID)
+    
+    def isDone(self,key,name,day=None):
+        return self.manifest.isDone(self.step(key,name,day))
+    
+    def loadDay(self,key,name,day):
+        return Load(Result,"{}_Day{}".format(self.fileName(name),day),folder=self.dayFolder + [key])
+    
+    def saveDay(self,res,key,name,day):
+        Save(res,"{}_Day{}".format(self.fileName(name),day),folder=self.dayFolder + [key],binary=True)
+        self.manifest.complete(self.step(key,name,day),{"cost":res.cost})
+    
+    #A finished scenario, with its dataframes
+    def load(self,key,name,data):
+        res = Load(Result,self.fileName(name),folder=[self.folder,key])
+        interpretResult(res,data)
+        return res
+    
+    def save(self,res,key,name):
+        Save(res,self.fileName(name),folder=[self.folder,key],binary=True)
+        self.manifest.complete(self.step(key,name),{"cost":res.cost})
+
+#Open the results of a run without loading them
+def openResults(runID,folder="Results"):
+    return ResultsCatalog(runID,folder)
+
+#Function loading result objects that have been stored in the correct way. The results are loaded when they are used, see ResultsCatalog
+def loadResults(runID):
+    results = openResults(runID)
+    return results,results.data
+
+#Run the four models for every day. The builder decides if the models are built with Pyomo rules ("Pyomo"), directly from sparse matrices ("Matrix"),
+#or built once and only updated between days ("Persistent"). "Screening" builds the Pyomo models with only the line limits that are needed, see Flex_screening. "Compact" builds them without net production and flow variables, see Flex_compact. Persistent models can be passed in to reuse them across several runs
+#Scenario is the (result key, scenario key) of the run, used to tag the spans of the run metrics.
+#With a checkpoint, each day is saved when it is solved, and days saved by an earlier run are loaded instead
+def runModels(res,data,penalty=50,builder="Pyomo",models=None,checkpoint=None,scenario=None):
+    if builder == "Persistent" and models is None:
+        models = PersistentModels(data)
     for day in range(1,data.days+1):    
+        if checkpoint is not None and checkpoint.isDone(*scenario,day):
+            res.merge(checkpoint.loadDay(*scenario,day))
+            print("\t\tLoaded day {} from the checkpoint".format(day))
+            continue
         dayTime = time.time()
         print("\t\tRunning models for day {}".format(day))
-        with HiddenPrints():
-            NodeClearing(data,res,day)
-            Redispatch(data,res,day)
-            ZoneClearing(data,res,day,penalty)
-            Redispatch_post(data,res,day)
+        dayRes = res if checkpoint is None else Result()
+        with HiddenPrints(), metrics.span("Day",**scenarioTags(scenario),Day=day,Builder=builder):
+            runDay(dayRes,data,day,penalty,builder,models)
+        if checkpoint is not None:
+            checkpoint.saveDay(dayRes,*scenario,day)
+            res.merge(dayRes)
         print("\t\tFinished modelling day {} after {}".format(day,timeString(time.time()-dayTime)))
 
+#Tags of the spans of a scenario
+def scenarioTags(scenario):
+    if scenario is None:
+        return {}
+    return {"Sensitivity":scenario[0],"Scenario":scenario[1]} if scenario[1] is not None else {"Sensitivity":scenario[0]}
+
+#Run the four models for one day
+def runDay(res,data,day,penalty=50,builder="Pyomo",models=None):
+    if builder == "Persistent":
+        models.run(data,res,day,penalty)
+    elif builder == "Matrix":
+        NodeClearing_matrix(data,res,day)
+        Redispatch_matrix(data,res,day)
+        ZoneClearing_matrix(data,res,day,penalty)
+        Redispatch_post_matrix(data,res,day)
+    elif builder == "Screening":
+        NodeClearing(data,res,day,screening=True)
+        Redispatch(data,res,day,screening=True)
+        ZoneClearing(data,res,day,penalty)
+        Redispatch_post(data,res,day,screening=True)
+    elif builder == "Compact":
+        NodeClearing(data,res,day,compact=True)
+        Redispatch(data,res,day,compact=True)
+        ZoneClearing(data,res,day,penalty)
+        Redispatch_post(data,res,day,compact=True)
+    else:
+        NodeClearing(data,res,day)
+        Redispatch(data,res,day)
+        ZoneClearing(data,res,day,penalty)
+        Redispatch_post(data,res,day)
+
+#Parametric sweep over scenarios that only change bid prices, bid volumes, line capacities or the zonal penalty. The persistent models are built once,
+#and each day is solved for all scenarios in turn, so a solve only updates the changed parameters and starts from the optimal basis of the previous scenario.
+#Returns one Result for each overlay. With a checkpoint, scenarios gives the (result key, scenario key) of each overlay, see runModels
+def runSweep(Data,overlays,penalties=None,models=None,checkpoint=None,scenarios=None):
+    if any(overlay.nZones is not None for overlay in overlays):
+        raise ValueError("The scenarios of a sweep can not change the zones")
+    if penalties is None:
+        penalties = [50]*len(overlays)
+    if models is None:
+        models = PersistentModels(Data)
+    points = [overlay.apply(Data) for overlay in overlays]
+    results = [Result() for overlay in overlays]
+    
+    for day in range(1,max(data.days for data in points)+1):
+        dayTime = time.time()
+        for i,(data,res,penalty) in enumerate(zip(points,results,penalties)):
+            if day > data.days:
+                continue
+            if checkpoint is not None and checkpoint.isDone(*scenarios[i],day):
+                res.merge(checkpoint.loadDay(*scenarios[i],day))
+                continue
+            dayRes = res if checkpoint is None else Result()
+            with HiddenPrints(), metrics.span("Day",**scenarioTags(scenarios[i] if scenarios else None),Day=day,Builder="Persistent"):
+                models.run(data,dayRes,day,penalty)
+            if checkpoint is not None:
+                checkpoint.saveDay(dayRes,*scenarios[i],day)
+                res.merge(dayRes)
+        print("\t\tFinished day {} for {} scenarios after {}".format(day,len(points),timeString(time.time()-dayTime)))
+    return results
+
+#Sensitivity run as a sweep, with the scenario keys and overlays given as a dict. Finished scenarios are loaded from the checkpoint, and the rest are swept together
+def sweepSensitivity(Data,key,overlays,penalties=None,checkpoint=None):
+    mainTime = time.time()
+    names = list(overlays)
+    penalties = dict(zip(names,penalties if penalties is not None else [50]*len(names)))
+    results = {}
+    for name in names:
+        if checkpoint is not None and checkpoint.isDone(key,name):
+            results[name] = checkpoint.load(key,name,overlays[name].apply(Data))
+    missing = [name for name in names if name not in results]
+    
+    if missing:
+        print("\tSweeping {} scenarios".format(len(missing)))
+        finished = runSweep(Data,[overlays[name] for name in missing],[penalties[name] for name in missing],checkpoint=checkpoint,scenarios=[(key,name) for name in missing])
+        for name,res in zip(missing,finished):
+            if checkpoint is not None:
+                checkpoint.save(res,key,name)
+            interpretResult(res,overlays[name].apply(Data))
+            results[name] = res
+    
+    print("\tTotal time spent is {}".format(round(time.time()-mainTime)))
+    return {name:results[name] for name in names}
+
+#Parallel version of runModels. The days do not depend on each other, so each day is solved in a separate process with its own Result object
+#The day results are merged into res in the order of the days, giving the same result as runModels
+def runModelsParallel(res,data,penalty=50,builder="Pyomo",workers=None):
+    modelTime = time.time()
+    days = list(range(1,data.days+1))
+    with ProcessPoolExecutor(max_workers=workers,initializer=initDayWorker,initargs=(data.snapshot(),builder,penalty,getSolver().settings())) as executor:
+        for dayRes,spans in executor.map(runDayWorker,days):
+            res.merge(dayRes)
+            metrics.extend(spans)
+    print("\t\tFinished modelling {} days after {}".format(len(days),timeString(time.time()-modelTime)))
+
 #Function running the main analysis, in addition to all the sensitivities. Store the results with an ID
-def runAll(runID,data=False,days = 14):
-    if not data:
+#The data object and every day of every scenario are saved as soon as they are made, see Checkpoint. Calling runAll again with the same runID
+#uses the stored data object and only solves the days and scenarios that were not finished. The solver is a solver name or a SolverBackend, see Flex_solvers
+#The run metrics (see Metrics in Flex_supportFunctions) are saved as Metrics_<runID>.json in the results folder after each sensitivity
+def runAll(runID,data=False,days = 14,builder="Pyomo",folder="Results",solver=None):
+    if solver is not None:
+        setSolver(solver)
+    metricsPath = os.path.join(folder,"Metrics_{}.json".format(runID))
+    metrics.reset(Metrics.load(metricsPath).spans if os.path.isfile(metricsPath) else None)
+    dataName = "Data_{}".format(runID)
+    if not data and os.path.isdir(os.path.join(folder,dataName)):
+        print("Continuing run {}".format(runID))
+        data = Load(Data,dataName,folder=[folder])
+    elif not data:
         data = Data.create(days)
-    
+    if not os.path.isdir(os.path.join(folder,dataName)):
+        Save(data,dataName,folder=[folder],binary=True)
      
     results = dict()
     
     #Run the base cases and sensitivities
-    results["Ordinary results"] = ordinaryRun(data,runID)
-    results["Redispatch sensitivity"] = RedispatchSensitivity(data,runID)
-    results["nZones sensitivity"] = nZonesSensitivity(data,runID)
-    results["Flexibility cost sensitivity"] = flexCostSensitivity(data,runID)
-    results["Flexibility volume sensitivity"] = flexVolSensitivity(data,runID)
-    results["Line capacity sensitivity"] = lineCapSensitivity(data,runID)
-    results["No TS cap"] = noTScapRun(data,runID)
+    runs = [("Ordinary results",ordinaryRun),("Redispatch sensitivity",RedispatchSensitivity),("nZones sensitivity",nZonesSensitivity),
+            ("Flexibility cost sensitivity",flexCostSensitivity),("Flexibility volume sensitivity",flexVolSensitivity),
+            ("Line capacity sensitivity",lineCapSensitivity),("No TS cap",noTScapRun)]
+    checkpoint = Checkpoint(runID,runSettings(data,builder,runs),folder)
+    for key,run in runs:
+        with metrics.span("Sensitivity",Run=runID,Sensitivity=key):
+            results[key] = run(data,runID,builder=builder,checkpoint=checkpoint)
+        metrics.save(metricsPath)
 
     
     return results,data
@@ -72,80 +325,296 @@ def runAll(runID,data=False,days = 14):
 
 
         
+#Settings a run is resumed with. Besides the days and the builder, the data is given by its fingerprint, the solver by its settings and the
+#scenarios by the default arguments of the run functions (e.g. the zonal penalty and the re-dispatch costs), so a run is not continued with other data, solver or scenarios
+def runSettings(data,builder,runs):
+    scenarios = {key:runDefaults(run) for key,run in runs}
+    return {"days":data.days,"builder":builder,"data":fingerprint(data),"solver":getSolver().settings(),"scenarios":scenarios}
+
+#The default arguments of a run function giving its scenarios, e.g. the re-dispatch costs, the days and the zonal penalty
+def runDefaults(run):
+    parameters = inspect.signature(run).parameters.items()
+    return {name:p.default for name,p in parameters if p.default is not inspect.Parameter.empty and name not in ("builder","checkpoint","saving","cacheFile","models","scenario")}
+
+#%% Parallel version of runAll. Every scenario is run in its own process, using up to "workers" processes at the same time
+#The data object is sent once to each process as a snapshot, and the results are returned under the same keys as in runAll
+#On platforms that start processes with "spawn" (Windows), this must be called from a script protected by if __name__ == "__main__"
+def runAllParallel(runID,data=False,days=14,workers=None,builder="Pyomo",solver=None):
+    if solver is not None:
+        setSolver(solver)
+    if not data:
+        data = Data.create(days)
+    
+    mainTime = time.time()
+    scenarios = sensitivityScenarios(data.days)
+    print("Running {} scenarios in parallel".format(len(scenarios)))
+    
+    metrics.reset()
+    with ProcessPoolExecutor(max_workers=workers,initializer=initWorker,initargs=(data.snapshot(),builder,getSolver().settings())) as executor:
+        finished = list(executor.map(runScenario,scenarios))
+    
+    #Merge the results in the same order as runAll
+    results = dict()
+    for (key,name,change,value,scenarioDays,penalty),(res,spans) in zip(scenarios,finished):
+        metrics.extend(spans)
+        if name is None:
+            results[key] = res
+        else:
+            results.setdefault(key,{})[name] = res
+    
+    print("\tTotal time spent is {}".format(timeString(time.time()-mainTime)))
+    return results,data
+
+#The scenarios run by runAll, as (result key, scenario key, change, value, days, penalty). Scenarios without a scenario key are stored directly under the result key
+#The ordinary scenario uses all the days of the data, as ordinaryRun. The values, days and penalties of the sensitivities are the default arguments of the run functions
+def sensitivityScenarios(days):
+    penalty = runDefaults(runModels)["penalty"]
+    scenarios = [("Ordinary results",None,None,None,days,runDefaults(ordinaryRun)["penalty"])]
+    run = runDefaults(RedispatchSensitivity)
+    scenarios += [("Redispatch sensitivity","reCost={}".format(c),"Re-dispatch cost",c,run["days"],c) for c in run["costs"]]
+    run = runDefaults(nZonesSensitivity)
+    scenarios += [("nZones sensitivity","nZones={}".format(n),"nZones",n,run["days"],penalty) for n in run["nZonesList"]]
+    run = runDefaults(flexCostSensitivity)
+    scenarios += [("Flexibility cost sensitivity","Cost scaling={}".format(c),"Flexibility cost",c,run["days"],penalty) for c in run["costs"]]
+    run = runDefaults(flexVolSensitivity)
+    scenarios += [("Flexibility volume sensitivity","Volume scaling={}".format(v),"Flexibility volume",v,run["days"],penalty) for v in run["volumes"]]
+    run = runDefaults(lineCapSensitivity)
+    scenarios += [("Line capacity sensitivity","Capacity scaling={}".format(s),"Line capacity",s,run["days"],penalty) for s in run["scaling"]]
+    scenarios += [("No TS cap",None,"No TS capacity",None,runDefaults(noTScapRun)["days"],penalty)]
+    return scenarios
+
+#Overlay with the change of a scenario
+def scenarioOverlay(change,value,days):
+    if change == "Re-dispatch cost":
+        return ScenarioOverlay(days,redispatchCost=value)
+    elif change == "nZones":
+        return ScenarioOverlay(days,nZones=value)
+    elif change == "Flexibility cost":
+        return ScenarioOverlay(days,flexPriceScaling=value)
+    elif change == "Flexibility volume":
+        return ScenarioOverlay(days,flexVolumeScaling=value)
+    elif change == "Line capacity":
+        return ScenarioOverlay(days,capacityScaling=value)
+    elif change == "No TS capacity":
+        return ScenarioOverlay(days,uncapTS=True)
+    return ScenarioOverlay(days)
+
+#State kept in each worker process
+workerState = {}
+
+#The base data object is built once in each worker process, and each scenario is an overlay on it
+def initWorker(snapshot,builder,solver):
+    workerState["data"] = Data.from_dict(snapshot)
+    workerState["builder"] = builder
+    setSolver(SolverBackend(**solver))
+
+#The data object is built once in each worker process, as the models for a day do not change it
+def initDayWorker(snapshot,builder,penalty,solver):
+    setSolver(SolverBackend(**solver))
+    workerState["data"] = Data.from_dict(snapshot)
+    workerState["builder"] = builder
+    workerState["penalty"] = penalty
+    workerState["models"] = PersistentModels(workerState["data"]) if builder == "Persistent" else None
+
+#Run the models for one day in a worker process. The spans of the day are returned with the result, and added to the metrics of the main process
+def runDayWorker(day):
+    res = Result()
+    metrics.reset()
+    with HiddenPrints(), metrics.span("Day",Day=day,Builder=workerState["builder"]):
+        runDay(res,workerState["data"],day,workerState["penalty"],workerState["builder"],workerState["models"])
+    return res,metrics.spans
+
+#Run one scenario in a worker process
+def runScenario(scenario):
+    key,name,change,value,days,penalty = scenario
+    scenarioTime = time.time()
+    metrics.reset()
+    with HiddenPrints(), metrics.span("Scenario",**scenarioTags((key,name))):
+        data = scenarioOverlay(change,value,days).apply(workerState["data"])
+        
+        res = Result()
+        runModels(res,data,penalty,workerState["builder"],scenario=(key,name))
+        interpretResult(res,data)
+    print("\tFinished {} {} after {}".format(key,name if name else "",timeString(time.time()-scenarioTime)))
+    return res,metrics.spans
+
+#%% Streaming run over a long horizon, e.g. a year of NordPool files. The days are run one at a time: the DA volumes of the day are read,
+#the zones are partitioned, the four models are solved and the result of the day is saved before the next day is read, so memory does not grow with the horizon.
+#The finished days are recorded in a manifest, and a run started again with the same runID and settings continues after the last finished day.
+#With a seed, the bid noise of each day only depends on the seed and the day, so a resumed run gives the same bids as an uninterrupted one
+def runStreaming(runID,firstDay=1,lastDay=None,builder="Pyomo",penalty=50,nZones=5,minNodes=5,seed=None,folder="Results",solver=None):
+    mainTime = time.time()
+    if solver is not None:
+        setSolver(solver)
+    paths = DA_path(range(1,(lastDay if lastDay else 10**9)+1))
+    if lastDay is None:
+        lastDay = len(paths)
+    elif lastDay > len(paths):
+        raise ValueError("Only {} DA files were found, but the run ends at day {}".format(len(paths),lastDay))
+    
+    resultFolder = [folder,"Streaming results"]
+    settings = {"builder":builder,"penalty":penalty,"nZones":nZones,"minNodes":minNodes,"seed":seed,"solver":getSolver().settings()}
+    manifest = RunManifest(os.path.join(*resultFolder,"Manifest_{}.json".format(runID)),settings)
+    metricsPath = os.path.join(*resultFolder,"Metrics_{}.json".format(runID))
+    metrics.reset(Metrics.load(metricsPath).spans if os.path.isfile(metricsPath) else None)
+    days = [day for day in range(firstDay,lastDay+1) if not manifest.isDone(day)]
+    print("Streaming {} days, {} already finished".format(len(days),lastDay-firstDay+1-len(days)))
+    if not days:
+        return manifest
+    
+    #The grid and participants are the same for all days
+    data = Data(1)
+    tables = importTables(inputFile,[])
+    data.importGrid(tables)
+    models = None
+    
+    for day in days:
+        dayTime = time.time()
+        if seed is not None:
+            np.random.seed([seed,day])
+        with metrics.span("Day",Run=runID,Day=day,Builder=builder):
+            with metrics.span("Import"):
+                production,load = importDay(inputFile,paths[day-1],tables["Nodes"])
+            data.loadDay(day,production,load,nZones,minNodes)
+            if builder == "Persistent" and models is None:
+                models = PersistentModels(data)
+            
+            res = Result()
+            with HiddenPrints():
+                runDay(res,data,day,penalty,builder,models)
+            costs = FindCosts(res,data)
+            
+            name = "Day{:04d}_{}".format(day,runID)
+            Save(res,name,folder=resultFolder,binary=True)
+        manifest.complete(day,{"result":name,"cost":res.cost,"Daily cost (FA)":costs["Daily cost (FA)"]["Total"].to_dict(),"Daily cost (TA)":costs["Daily cost (TA)"]["Total"].to_dict()})
+        metrics.save(metricsPath)
+        print("\tFinished day {} after {}".format(day,timeString(time.time()-dayTime)))
+    
+    print("\tTotal time spent is {}".format(timeString(time.time()-mainTime)))
+    return manifest
+
+#%% Benchmark of solver backends on the ordinary run. Each solver is a solver name or a SolverBackend, and runs the same data object.
+#The table has one row for each solver, with the total time, the time spent in the solver, the number of solves that were not optimal
+#and the cost of each model. The largest cost difference from the first solver shows whether the solvers found the same optimum
+def benchmarkSolvers(data,solvers=("gurobi","highs"),days=14,builder="Pyomo"):
+    print("Benchmarking {} solvers".format(len(solvers)))
+    previous = getSolver()
+    run = ScenarioOverlay(min(days,data.days)).apply(data)
+    rows = {}
+    for solver in solvers:
+        backend = setSolver(solver)
+        res = Result()
+        startTime = time.time()
+        try:
+            with HiddenPrints():
+                runModels(res,run,builder=builder)
+        except Exception as error:
+            print("\t{} failed: {}".format(backend,error))
+            rows[repr(backend)] = {"Error":str(error)}
+            continue
+        report = backend.report()
+        rows[repr(backend)] = {"Total time":time.time()-startTime, "Solver time":report["Time"].sum(), "Solves":len(report), "Not optimal":int((report["Status"] != "optimal").sum())}
+        rows[repr(backend)].update({"{} cost".format(m):cost for m,cost in res.cost.items()})
+        print("\t{} finished after {}".format(backend,timeString(time.time()-startTime)))
+    setSolver(previous)
+    
+    table = pd.DataFrame.from_dict(rows,orient="index")
+    costs = [column for column in table.columns if column.endswith(" cost")]
+    if costs:
+        table["Max cost difference"] = (table[costs] - table[costs].iloc[0]).abs().max(axis=1)
+    return table
+
 #%% Run all 14 days
-def ordinaryRun(data,runID):
+def ordinaryRun(data,runID,builder="Pyomo",checkpoint=None,penalty=50):
     print("Ordinary run")
+    key = "Ordinary results"
+    if checkpoint is not None and checkpoint.isDone(key,None):
+        print("\tLoaded from the checkpoint\n")
+        return checkpoint.load(key,None,data)
     res = Result()
      
     modelTime = time.time()      
     
-    runModels(res,data, penalty=50)        
+    runModels(res,data, penalty=penalty,builder=builder,checkpoint=checkpoint,scenario=(key,None))        
     print("\tFinished running models after {}\n".format(timeString(time.time()-modelTime)))
                              
-    
+    if checkpoint is not None:
+        checkpoint.save(res,key,None)
     interpretResult(res,data)
     
     return res
         
 
 #%%   Change both redispatch costs and the penalty in the zonal model
-def RedispatchSensitivity(Data,runID,costs=[30,40,60,70],days=5):
+def RedispatchSensitivity(Data,runID,costs=[30,40,60,70],days=5,builder="Pyomo",checkpoint=None):
     print("Running re-dispatch sensitvity")
+    if builder == "Persistent":
+        return sweepSensitivity(Data,"Redispatch sensitivity",{"reCost={}".format(c):ScenarioOverlay(days,redispatchCost=c) for c in costs},costs,checkpoint)
     mainTime=time.time()
-    data = copy.deepcopy(Data)
-    data.days = days
     results = {}
     #Iterate over each cost scenario
     for c in costs:
         print(f"\tRe-dispatch cost of {c}:")
-        for b in data.Bids.participantBids["Re-dispatch"]:
-            data.Bids[b].changePrice(c)
+        name = "reCost={}".format(c)
+        data = ScenarioOverlay(days,redispatchCost=c).apply(Data)
+        if checkpoint is not None and checkpoint.isDone("Redispatch sensitivity",name):
+            results[name] = checkpoint.load("Redispatch sensitivity",name,data)
+            continue
         
         res = Result()
         modelTime = time.time()
         with HiddenPrints(): 
-            runModels(res,data,c)                          
+            runModels(res,data,c,builder,checkpoint=checkpoint,scenario=("Redispatch sensitivity",name))                          
         print("\tFinished running models after {}\n".format(timeString(time.time()-modelTime)))
         
-       
+        if checkpoint is not None:
+            checkpoint.save(res,"Redispatch sensitivity",name)
         interpretResult(res,data)
-        results["reCost={}".format(c)] = res
+        results[name] = res
                 
     print("\tTotal time spent is {}".format(round(time.time()-mainTime)))
     
     return results
     
-#%% 
-def nZonesSensitivity(Data,runID,saving,nZonesList=[3,7,10,15,30],days=5):
+#%% If cacheFile is given, the partitions are loaded from and saved to this file, so a rerun does not have to partition again
+def nZonesSensitivity(Data,runID,saving=False,nZonesList=[3,7,10,15,30],days=5,builder="Pyomo",cacheFile=None,checkpoint=None):
     print("Running nZones sensitivity")
     mainTime=time.time()
     
 
-    data = copy.deepcopy(Data)
-    data.days = days
+    base = Data
+    if cacheFile is not None and os.path.exists(cacheFile):
+        base = copy.copy(Data)
+        base.partitionCache = PartitionCache.load(cacheFile)
     results = {}
+    models = PersistentModels(base) if builder == "Persistent" else None       #Persistent models are reused for all scenarios
     #Iterate over each scenario of nZones
     for nZones in nZonesList:
+        name = "nZones={}".format(nZones)
         partitioningTime = time.time()
         
         #New zone partitioning
         with HiddenPrints():
-            data.runZonePartitioning(nZones,5)
-            data.fill_ZPTDFs()
+            data = ScenarioOverlay(days,nZones=nZones).apply(base)
         
-        print("\tFinished altering zone data after {}".format(timeString(time.time()-partitioningTime)))
+        print("\tFinished altering zone data after {}, partition cache hit rate is {:.0%}".format(timeString(time.time()-partitioningTime),data.partitionCache.hitRate()))
+        if checkpoint is not None and checkpoint.isDone("nZones sensitivity",name):
+            results[name] = checkpoint.load("nZones sensitivity",name,data)
+            continue
 
         res = Result()
         
         modelTime = time.time()
-        runModels(res,data)       
+        runModels(res,data,builder=builder,models=models,checkpoint=checkpoint,scenario=("nZones sensitivity",name))       
         print("\tFinished running models after {}".format(timeString(time.time()-modelTime)))   
         
-
+        if checkpoint is not None:
+            checkpoint.save(res,"nZones sensitivity",name)
         interpretResult(res,data)
-        results["nZones={}".format(nZones)] = res
+        results[name] = res
             
-    
+    if cacheFile is not None:
+        base.partitionCache.save(cacheFile)
 
     print("\tTotal time spent is {}".format(round(time.time()-mainTime)))
         
@@ -153,35 +622,36 @@ def nZonesSensitivity(Data,runID,saving,nZonesList=[3,7,10,15,30],days=5):
     
 
 #%% 
-def flexCostSensitivity(Data,runID,saving,costs=[0.5,0.75,1.25,1.5],days=5):
+def flexCostSensitivity(Data,runID,saving=False,costs=[0.5,0.75,1.25,1.5],days=5,builder="Pyomo",checkpoint=None):
     print("Running flexibility cost sensitivity")
+    if builder == "Persistent":
+        return sweepSensitivity(Data,"Flexibility cost sensitivity",{"Cost scaling={}".format(c):ScenarioOverlay(days,flexPriceScaling=c) for c in costs},checkpoint=checkpoint)
     mainTime=time.time()
 
-    #Create and initialize data object
-    data = copy.deepcopy(Data)
-    data.days = days
     results = {}
     
     #Iterate over each cost scenario
     for c in costs:
         print("\tFlexibility cost scaling of {}%".format(c*100))
-        data.Bids = copy.deepcopy(Data.Bids)
-        #Change bid costs
-        for ID,bid in data.Bids.fullDict.items():
-            if bid.Participant != "Re-dispatch":
-                bid.scalePrice(c) 
+        name = "Cost scaling={}".format(c)
+        data = ScenarioOverlay(days,flexPriceScaling=c).apply(Data)
+        if checkpoint is not None and checkpoint.isDone("Flexibility cost sensitivity",name):
+            results[name] = checkpoint.load("Flexibility cost sensitivity",name,data)
+            continue
         
         
         # Result object
         res = Result()
         
         modelTime=time.time()
-        runModels(res,data)       
+        runModels(res,data,builder=builder,checkpoint=checkpoint,scenario=("Flexibility cost sensitivity",name))       
         
         print("\tFinished running models after {}".format(timeString(time.time()-modelTime)))
         
+        if checkpoint is not None:
+            checkpoint.save(res,"Flexibility cost sensitivity",name)
         interpretResult(res,data)
-        results["Cost scaling={}".format(c)]= res                    
+        results[name]= res                    
 
         
     print("\tTotal time spent is {}".format(round(time.time()-mainTime)))
@@ -190,35 +660,35 @@ def flexCostSensitivity(Data,runID,saving,costs=[0.5,0.75,1.25,1.5],days=5):
     return results
 
 #%%   
-def flexVolSensitivity(Data,runID,saving,volumes=[0.5,2,4,10,15],days=5):
+def flexVolSensitivity(Data,runID,saving=False,volumes=[0.5,2,4,10,15],days=5,builder="Pyomo",checkpoint=None):
     print("Running flexibility volume sensitivity" )
+    if builder == "Persistent":
+        return sweepSensitivity(Data,"Flexibility volume sensitivity",{"Volume scaling={}".format(v):ScenarioOverlay(days,flexVolumeScaling=v) for v in volumes},checkpoint=checkpoint)
     mainTime=time.time()
 
-    #Create and initialize data object
-    data = copy.deepcopy(Data)
-    data.days = days
-    
     results = {}
 
 
     #Iterate over each cost scenario
     for v in volumes: 
         print("\tVolume scaled by {}".format(v))
-        data.Bids = copy.deepcopy(Data.Bids)
-        #Change bid volumes
-        for ID,bid in data.Bids.fullDict.items():
-            if bid.Participant != "Re-dispatch": 
-                bid.scaleVolume(v)
+        name = "Volume scaling={}".format(v)
+        data = ScenarioOverlay(days,flexVolumeScaling=v).apply(Data)
+        if checkpoint is not None and checkpoint.isDone("Flexibility volume sensitivity",name):
+            results[name] = checkpoint.load("Flexibility volume sensitivity",name,data)
+            continue
 
         res = Result()
         
         modelTime=time.time()
-        runModels(res,data)       
+        runModels(res,data,builder=builder,checkpoint=checkpoint,scenario=("Flexibility volume sensitivity",name))       
         
         print("\tFinished running models after {}".format(timeString(time.time()-modelTime)))
         
+        if checkpoint is not None:
+            checkpoint.save(res,"Flexibility volume sensitivity",name)
         interpretResult(res,data)
-        results["Volume scaling={}".format(v)] = res                    
+        results[name] = res                    
  
        
     print("\tTotal time spent is {}".format(round(time.time()-mainTime)))
@@ -227,33 +697,36 @@ def flexVolSensitivity(Data,runID,saving,volumes=[0.5,2,4,10,15],days=5):
     return results
 
 #%%   
-def lineCapSensitivity(Data,runID,saving,scaling=[1.15,1.3,1.5],days=5):
+def lineCapSensitivity(Data,runID,saving=False,scaling=[1.15,1.3,1.5],days=5,builder="Pyomo",checkpoint=None):
     print("Running line capacity sensitivity")
+    if builder == "Persistent":
+        return sweepSensitivity(Data,"Line capacity sensitivity",{"Capacity scaling={}".format(s):ScenarioOverlay(days,capacityScaling=s) for s in scaling},checkpoint=checkpoint)
     mainTime=time.time()
 
-    #Create and initialize data object
-    data = copy.deepcopy(Data)
-    data.days = days
     results = {}
 
     
     #Iterate over each cost scenario
     for s in scaling:   
         print("\tCapacity scaled by {}".format(s))
-        data.System = copy.deepcopy(Data.System)
-        for line in data.System.Lines:
-            data.System.Lines[line].Capacity = data.System.Lines[line].Capacity * s
+        name = "Capacity scaling={}".format(s)
+        data = ScenarioOverlay(days,capacityScaling=s).apply(Data)
+        if checkpoint is not None and checkpoint.isDone("Line capacity sensitivity",name):
+            results[name] = checkpoint.load("Line capacity sensitivity",name,data)
+            continue
 
         # Result object
         res = Result()
         
         modelTime=time.time()
-        runModels(res,data)       
+        runModels(res,data,builder=builder,checkpoint=checkpoint,scenario=("Line capacity sensitivity",name))       
         
         print("\tFinished running models after {}".format(timeString(time.time()-modelTime)))
         
+        if checkpoint is not None:
+            checkpoint.save(res,"Line capacity sensitivity",name)
         interpretResult(res,data)
-        results["Capacity scaling={}".format(s)]= res                    
+        results[name]= res                    
  
 
     print("\tTotal time spent is {}".format(round(time.time()-mainTime)))
@@ -261,22 +734,22 @@ def lineCapSensitivity(Data,runID,saving,scaling=[1.15,1.3,1.5],days=5):
 
     return results
 #%% 
-def noTScapRun(Data,runID,saving,days=5):
+def noTScapRun(Data,runID,saving=False,days=5,builder="Pyomo",checkpoint=None):
     print("Running sensitivity where TS line capacities are removed ")
-    data=copy.deepcopy(Data)
-    data.days = days
-    for ID,line in data.System.Lines.items():
-        if "R_" not in line.To and "R_" not in line.From:
-            line.Capacity = float('inf')
+    data = ScenarioOverlay(days,uncapTS=True).apply(Data)
+    if checkpoint is not None and checkpoint.isDone("No TS cap",None):
+        return checkpoint.load("No TS cap",None,data)
     # Result object
     res = Result()
     
     modelTime=time.time()
     
-    runModels(res,data)        
+    runModels(res,data,builder=builder,checkpoint=checkpoint,scenario=("No TS cap",None))        
     
     print("\tFinished running models after {}\n".format(timeString(time.time()-modelTime)))
                       
+    if checkpoint is not None:
+        checkpoint.save(res,"No TS cap",None)
     interpretResult(res,data)
      
     return res
@@ -7,11 +7,17 @@ Node clearing model
 """
 import pyomo.environ as pyo
 import time
-from Flex_supportFunctions import timeString
+from Flex_supportFunctions import timeString,metrics
+from Flex_solvers import getSolver
+from Flex_screening import monitorLines,congestedLines,solveScreened
+from Flex_compact import CompactModel
 
-def NodeClearing(Data,Result,day):
+def NodeClearing(Data,Result,day,screening=False,compact=False):
+    if screening and compact:
+        raise ValueError("Screening is not available for the compact formulation")
     #Tracking running time
     startTime = time.time()
+    span = metrics.start("Build",Model="Nodal",Day=day)
     print("Initilalizing node clearing")
     
     
@@ -28,15 +34,21 @@ def NodeClearing(Data,Result,day):
     model.downBids = pyo.Set(initialize = Data.Bids.downBids)
                                                
 
+    #Bid prices and volumes of the day, read from the bid arrays at once
+    price = Data.Bids.periodValues("Price",list(model.upBids)+list(model.downBids),model.Periods)
+    volume = Data.Bids.periodValues("Volume",list(model.upBids)+list(model.downBids),model.Periods)
+
     #%%Model variables
     model.clearedUp = pyo.Var(model.upBids,model.Periods,within=pyo.NonNegativeReals)                                         
     model.clearedDown = pyo.Var(model.downBids,model.Periods,within=pyo.NonNegativeReals)                                         
-    model.flow = pyo.Var(model.Lines,model.Periods)
-    model.prod = pyo.Var(model.Nodes,model.Periods)
+    if not screening and not compact:
+        model.flow = pyo.Var(model.Lines,model.Periods)
+    if not compact:
+        model.prod = pyo.Var(model.Nodes,model.Periods)
     model.charge = pyo.Var(model.Participants_Battery,model.Periods,within=pyo.NonNegativeReals)
     #%%Objective function
     def ObjFunc(model):
-        return sum(model.clearedUp[b,t]*Data.Bids[b].Price[t] for b in Data.Bids.upBids for t in model.Periods ) + sum(model.clearedDown[b,t]*Data.Bids[b].Price[t]  for b in Data.Bids.downBids for t in model.Periods )
+        return sum(model.clearedUp[b,t]*price[b,t] for b in model.upBids for t in model.Periods ) + sum(model.clearedDown[b,t]*price[b,t]  for b in model.downBids for t in model.Periods )
     model.obj = pyo.Objective(rule=ObjFunc,sense=pyo.minimize)
     
     
@@ -48,36 +60,43 @@ def NodeClearing(Data,Result,day):
     model.marketBalance_cons = pyo.Constraint(model.Periods,rule=marketBalance_rule)
     
     def marketBalance_flex_rule(model,t):
-        return sum(model.clearedUp[b,t] for b in Data.Bids.upBids if Data.Bids[b].Participant != "Re-dispatch") - sum(model.clearedDown[b,t] for b in Data.Bids.downBids if Data.Bids[b].Participant !="Re-dispatch") == 0
+        return sum(model.clearedUp[b,t] for b in Data.Bids.getBids("Up","Flex")) - sum(model.clearedDown[b,t] for b in Data.Bids.getBids("Down","Flex")) == 0
     model.marketBalance_flex__cons = pyo.Constraint(model.Periods,rule=marketBalance_flex_rule)
     
-    #c: Find net production in each node
+    #c: Find net production in each node. The compact formulation has no net production variables, see Flex_compact
     def netProduction_rule(model,n,t):
-        return  Data.System.DA_volumes[t][n]["Net"] + sum(model.clearedUp[b,t] for b in Data.Bids.nodeBids[n] if Data.Bids[b].Direction == "Up") - sum(model.clearedDown[b,t] for b in Data.Bids.nodeBids[n] if Data.Bids[b].Direction == "Down") == model.prod[n,t]
-    model.netProduction_cons = pyo.Constraint(model.Nodes,model.Periods,rule=netProduction_rule)
+        return  Data.System.DA_volumes[t][n]["Net"] + sum(model.clearedUp[b,t] for b in Data.Bids.getBids("Up",node=n)) - sum(model.clearedDown[b,t] for b in Data.Bids.getBids("Down",node=n)) == model.prod[n,t]
+    if not compact:
+        model.netProduction_cons = pyo.Constraint(model.Nodes,model.Periods,rule=netProduction_rule)
     
     #d: Bid sizes restrict the clearing
     def bidSizes_rule1(model,b,t):
-        return model.clearedUp[b,t] <= Data.Bids[b].Volume[t]
+        return model.clearedUp[b,t] <= volume[b,t]
     model.bidSizes_cons1 = pyo.Constraint(model.upBids,model.Periods,rule=bidSizes_rule1)
     
     def bidSizes_rule2(model,b,t):
-        return model.clearedDown[b,t] <= Data.Bids[b].Volume[t]
+        return model.clearedDown[b,t] <= volume[b,t]
     model.bidSizes_cons2 = pyo.Constraint(model.downBids,model.Periods,rule=bidSizes_rule2)
 
-    #e: Find line flow
-    def lineFlow_rule(model,l, t):
-        return model.flow[l,t] == sum(Data.System.PTDFs[l][n]*model.prod[n,t] for n in model.Nodes)
-    model.lineFlow_cons = pyo.Constraint(model.Lines, model.Periods, rule=lineFlow_rule) 
-    
-    #f: Line capacity
-    def lineCap_rule_1(model,l,t):
-        return model.flow[l,t] <= Data.System.Lines[l].Capacity 
-    model.lineCap_cons_1 = pyo.Constraint(model.Lines,model.Periods,rule=lineCap_rule_1)
-    
-    def lineCap_rule_2(model,l,t):
-        return -model.flow[l,t] <= Data.System.Lines[l].Capacity 
-    model.lineCap_cons_2 = pyo.Constraint(model.Lines,model.Periods,rule=lineCap_rule_2)
+    #e-f: In the compact formulation the line limits are written on the cleared bids (see Flex_compact). With screening, the line flows and capacities are only added for the monitored lines, starting with the lines congested in the DA flow (see Flex_screening)
+    if compact:
+        compactModel = CompactModel(model,Data)
+    elif screening:
+        monitorLines(model,Data,congestedLines(Data,model.Periods))
+    else:
+        #e: Find line flow
+        def lineFlow_rule(model,l, t):
+            return model.flow[l,t] == sum(Data.System.PTDFs[l][n]*model.prod[n,t] for n in model.Nodes)
+        model.lineFlow_cons = pyo.Constraint(model.Lines, model.Periods, rule=lineFlow_rule) 
+    
+        #f: Line capacity
+        def lineCap_rule_1(model,l,t):
+            return model.flow[l,t] <= Data.System.Lines[l].Capacity 
+        model.lineCap_cons_1 = pyo.Constraint(model.Lines,model.Periods,rule=lineCap_rule_1)
+    
+        def lineCap_rule_2(model,l,t):
+            return -model.flow[l,t] <= Data.System.Lines[l].Capacity 
+        model.lineCap_cons_2 = pyo.Constraint(model.Lines,model.Periods,rule=lineCap_rule_2)
     
     #g: Battery storage constraints
     def batteryStorage_rule(model,i,t):
@@ -92,20 +111,21 @@ def NodeClearing(Data,Result,day):
         if t%24 == 1:
             return pyo.Constraint.Skip
         else:
-            return model.charge[i,t] == model.charge[i,t-1] - sum( model.clearedUp[b,t]/Data.Participants.batteryEfficiency["Discharge"] for b in Data.Bids.participantBids[i] if Data.Bids[b].Direction == "Up") + sum(model.clearedDown[b,t] * Data.Participants.batteryEfficiency["Charge"] for b in Data.Bids.participantBids[i] if Data.Bids[b].Direction == "Down") 
+            return model.charge[i,t] == model.charge[i,t-1] - sum( model.clearedUp[b,t]/Data.Participants.batteryEfficiency["Discharge"] for b in Data.Bids.getBids("Up",participant=i)) + sum(model.clearedDown[b,t] * Data.Participants.batteryEfficiency["Charge"] for b in Data.Bids.getBids("Down",participant=i)) 
     model.batteryCharge_cons = pyo.Constraint(model.Participants_Battery,model.Periods,rule = batteryCharge_rule)
     
     #j: Aggregators must adjust up again after adjusting down. 
     def Aggregator_rule1(model,i,t):
         if t%24 > 19 or t%24 < 1:
             return pyo.Constraint.Skip
-        return sum( sum(model.clearedUp[b,t+j] for b in Data.Bids.participantBids[i] if Data.Bids[b].Direction == "Up") - sum(model.clearedDown[b,t+j] for b in Data.Bids.participantBids[i] if Data.Bids[b].Direction == "Down") for j in range(6)) <= Data.Participants[i].Size*6*0.2 
+        return sum( sum(model.clearedUp[b,t+j] for b in Data.Bids.getBids("Up",participant=i)) - sum(model.clearedDown[b,t+j] for b in Data.Bids.getBids("Down",participant=i)) for j in range(6)) <= Data.Participants[i].Size*6*0.2 
     model.Aggregator_cons1 = pyo.Constraint(model.Participants_Aggregator,model.Periods, rule = Aggregator_rule1)
     
     def Aggregator_rule2(model,i):
-        return sum(sum(model.clearedDown[b,t] for b in Data.Bids.participantBids[i] if Data.Bids[b].Direction == "Down") - sum(model.clearedUp[b,t] for b in Data.Bids.participantBids[i] if Data.Bids[b].Direction == "Up") for t in model.Periods) <= Data.Participants[i].Size * len(model.Periods) * 0.1
+        return sum(sum(model.clearedDown[b,t] for b in Data.Bids.getBids("Down",participant=i)) - sum(model.clearedUp[b,t] for b in Data.Bids.getBids("Up",participant=i)) for t in model.Periods) <= Data.Participants[i].Size * len(model.Periods) * 0.1
     model.Aggregator_cons2 = pyo.Constraint(model.Participants_Aggregator, rule = Aggregator_rule2)
     
+    metrics.stop(span,Variables=model.nvariables(),Constraints=model.nconstraints())
 
     print("Initilialize finished after {} \n".format(timeString(time.time()-startTime)))
 
@@ -115,13 +135,18 @@ def NodeClearing(Data,Result,day):
     
     #Solving
     model.dual = pyo.Suffix(direction = pyo.Suffix.IMPORT_EXPORT)
-    opt = pyo.SolverFactory("gurobi")
-    result=opt.solve(model,tee=False)
+    if screening:
+        model = solveScreened(model,Data,"Nodal")
+    else:
+        result = getSolver().solve(model,"Nodal")
+    if compact:
+        model = compactModel
 
 
 
     print("Model run finished after {} \n".format(timeString(time.time()-startTime)))
 
     
-    Result.read_nodal(model,Data)
+    with metrics.span("Read",Model="Nodal",Day=day):
+        Result.read_nodal(model,Data)
     
\ No newline at end of file
@@ -0,0 +1,294 @@
+"""
+Created on Tue Mar 14 2023
+
+Anders Ryssdal and Victor Aasvær
+
+Persistent versions of the node clearing, re-dispatch and zone clearing models.
+Each model is built once over the hours of a day (1-24), with the bid volumes, bid prices, net volumes and line capacities as mutable parameters.
+For each day only the parameters are updated before the model is solved again with a persistent solver, which reuses the basis from the previous solve.
+"""
+import pyomo.environ as pyo
+import numpy as np
+import time
+from Flex_supportFunctions import timeString,metrics
+from Flex_solvers import getSolver,SolverBackend
+from Flex_redispatch import zonalNetVolumes
+
+#%% Support object letting the Result object read a model built over hours as if it was built over the periods of the day.
+#The values of a variable are extracted in one call and looked up with the periods shifted to hours
+class DayView:
+    def __init__(self,model,day):
+        self.model = model
+        self.offset = (day-1)*24
+        self.Periods = [h+self.offset for h in model.Hours]
+        self.obj = model.obj
+
+    def hours(self,index):
+        return [i[:-1]+(i[-1]-self.offset,) for i in index]
+
+    def variableValues(self,name,index):
+        values = getattr(self.model,name).extract_values()
+        return np.array([values[i] for i in self.hours(index)],dtype=float)
+
+    def dualValues(self,name,index):
+        constraints = getattr(self.model,name)
+        return np.array([self.model.dual[constraints[i]] for i in self.hours(index)],dtype=float)
+
+#%% Object keeping the three models and their persistent solvers alive between days
+class PersistentModels:
+    #The solver is a SolverBackend or a solver name, using the backend selected with setSolver() if it is not given
+    def __init__(self,Data,solver=None):
+        startTime = time.time()
+        print("Initilalizing persistent models")
+
+        self.backend = getSolver() if solver is None else solver if isinstance(solver,SolverBackend) else SolverBackend(solver)
+        for attribute,name,build in (("nodal","Nodal",buildNodal),("re","Re-dispatch",buildRedispatch),("zonal","Zonal",buildZonal)):
+            with metrics.span("Build",Model=name) as span:
+                model = build(Data)
+                setattr(self,attribute,model)
+                span.update(Variables=model.nvariables(),Constraints=model.nconstraints())
+
+        #One persistent solver instance per model, so each keeps its own basis
+        self.opt = {name:self.backend.persistent() for name in ("Nodal","Re-dispatch","Zonal")}
+
+        print("Initilialize finished after {} \n".format(timeString(time.time()-startTime)))
+
+    #Run the four models for one day, updating only the parameters that change between days
+    def run(self,Data,Result,day,penalty=50):
+        periods = list(range((day-1)*24+1,day*24+1))
+
+        #Node clearing
+        with metrics.span("Update",Model="Nodal",Day=day):
+            updateBids(self.nodal,Data,periods)
+            updateNet(self.nodal,Data.System.NetVolumes["DA"],periods)
+            updateCapacity(self.nodal,Data)
+        self.backend.solvePersistent(self.opt["Nodal"],self.nodal,"Nodal")
+        with metrics.span("Read",Model="Nodal",Day=day):
+            Result.read_nodal(DayView(self.nodal,day),Data)
+
+        #Re-dispatch
+        with metrics.span("Update",Model="Re-dispatch",Day=day):
+            updateBids(self.re,Data,periods)
+            updateNet(self.re,Data.System.NetVolumes["DA"],periods)
+            updateCapacity(self.re,Data)
+        self.backend.solvePersistent(self.opt["Re-dispatch"],self.re,"Re-dispatch")
+        with metrics.span("Read",Model="Re-dispatch",Day=day):
+            Result.read_re(DayView(self.re,day),Data)
+
+        #Zone clearing. The zones change between periods, so the zonal part of the model is rebuilt when the zones are not the ones of the last solve
+        with metrics.span("Update",Model="Zonal",Day=day):
+            updateBids(self.zonal,Data,periods)
+            updateNet(self.zonal,Data.System.NetVolumes["DA"],periods)
+            updateCapacity(self.zonal,Data)
+            self.zonal.penalty.set_value(penalty)
+            setZones(self.zonal,Data,periods)
+        self.backend.solvePersistent(self.opt["Zonal"],self.zonal,"Zonal")
+        with metrics.span("Read",Model="Zonal",Day=day):
+            Result.read_zonal(DayView(self.zonal,day),Data)
+
+        #Re-dispatch after the zonal clearing, reusing the re-dispatch model with the adjusted net volumes
+        with metrics.span("Update",Model="Post zonal",Day=day):
+            updateNet(self.re,zonalNetVolumes(Data,Result,day),periods)
+        self.backend.solvePersistent(self.opt["Re-dispatch"],self.re,"Post zonal")
+        with metrics.span("Read",Model="Post zonal",Day=day):
+            Result.read_postZonal(DayView(self.re,day),Data)
+
+#%% Functions updating the mutable parameters for a day
+def updateBids(model,Data,periods):
+    hours = {t:h for h,t in enumerate(periods,1)}
+    model.volume.store_values({(b,hours[t]):v for (b,t),v in Data.Bids.periodValues("Volume",list(model.Bids),periods).items()})
+    model.price.store_values({(b,hours[t]):v for (b,t),v in Data.Bids.periodValues("Price",list(model.Bids),periods).items()})
+
+def updateNet(model,netVolumes,periods):
+    model.net.store_values({(n,h):netVolumes[t][n] for n in model.Nodes for h,t in enumerate(periods,1)})
+
+def updateCapacity(model,Data):
+    model.capacity.store_values({l:Data.System.Lines[l].Capacity for l in model.Lines})
+
+#%% Shared parts of the models
+def addBids(model,upBids,downBids):
+    model.Hours = pyo.Set(initialize = list(range(1,25)))
+    model.upBids = pyo.Set(initialize = upBids)
+    model.downBids = pyo.Set(initialize = downBids)
+    model.Bids = pyo.Set(initialize = upBids+downBids)
+
+    model.volume = pyo.Param(model.Bids,model.Hours,mutable=True,initialize=0)
+    model.price = pyo.Param(model.Bids,model.Hours,mutable=True,initialize=0)
+
+    model.clearedUp = pyo.Var(model.upBids,model.Hours,within=pyo.NonNegativeReals)
+    model.clearedDown = pyo.Var(model.downBids,model.Hours,within=pyo.NonNegativeReals)
+
+    #b: The market must keep the energy balance
+    def marketBalance_rule(model,h):
+        return sum(model.clearedUp[b,h] for b in model.upBids) - sum(model.clearedDown[b,h] for b in model.downBids) == 0
+    model.marketBalance_cons = pyo.Constraint(model.Hours,rule=marketBalance_rule)
+
+    #d: Bid sizes restrict the clearing
+    def bidSizes_rule1(model,b,h):
+        return model.clearedUp[b,h] <= model.volume[b,h]
+    model.bidSizes_cons1 = pyo.Constraint(model.upBids,model.Hours,rule=bidSizes_rule1)
+
+    def bidSizes_rule2(model,b,h):
+        return model.clearedDown[b,h] <= model.volume[b,h]
+    model.bidSizes_cons2 = pyo.Constraint(model.downBids,model.Hours,rule=bidSizes_rule2)
+
+def bidCost(model):
+    return sum(model.clearedUp[b,h]*model.price[b,h] for b in model.upBids for h in model.Hours) + sum(model.clearedDown[b,h]*model.price[b,h] for b in model.downBids for h in model.Hours)
+
+#Net production and line flows in every node and line, used by the node clearing and re-dispatch models
+def addNetwork(model,Data):
+    model.Nodes = pyo.Set(initialize=Data.System.getNodeList("All"))
+    model.Lines = pyo.Set(initialize = Data.System.getLineList("All"))
+
+    model.net = pyo.Param(model.Nodes,model.Hours,mutable=True,initialize=0)
+    model.capacity = pyo.Param(model.Lines,mutable=True,initialize=0)
+
+    model.flow = pyo.Var(model.Lines,model.Hours)
+    model.prod = pyo.Var(model.Nodes,model.Hours)
+
+    nodeUp = {n:[b for b in Data.Bids.nodeBids[n] if b in model.upBids] for n in model.Nodes}
+    nodeDown = {n:[b for b in Data.Bids.nodeBids[n] if b in model.downBids] for n in model.Nodes}
+
+    #c: Find net production in each node
+    def netProduction_rule(model,n,h):
+        return model.net[n,h] + sum(model.clearedUp[b,h] for b in nodeUp[n]) - sum(model.clearedDown[b,h] for b in nodeDown[n]) == model.prod[n,h]
+    model.netProduction_cons = pyo.Constraint(model.Nodes,model.Hours,rule=netProduction_rule)
+
+    #e: Find line flow
+    def lineFlow_rule(model,l,h):
+        return model.flow[l,h] == sum(Data.System.PTDFs[l][n]*model.prod[n,h] for n in model.Nodes)
+    model.lineFlow_cons = pyo.Constraint(model.Lines,model.Hours,rule=lineFlow_rule)
+
+    #f: Line capacity
+    def lineCap_rule_1(model,l,h):
+        return model.flow[l,h] <= model.capacity[l]
+    model.lineCap_cons_1 = pyo.Constraint(model.Lines,model.Hours,rule=lineCap_rule_1)
+
+    def lineCap_rule_2(model,l,h):
+        return -model.flow[l,h] <= model.capacity[l]
+    model.lineCap_cons_2 = pyo.Constraint(model.Lines,model.Hours,rule=lineCap_rule_2)
+
+#Battery and aggregator constraints, used by the node and zone clearing models
+def addParticipants(model,Data):
+    model.Participants_Battery = pyo.Set(initialize = list(Data.Participants.types["Battery"]))
+    model.Participants_Aggregator = pyo.Set(initialize = list(Data.Participants.types["Aggregator"]))
+    model.charge = pyo.Var(model.Participants_Battery,model.Hours,within=pyo.NonNegativeReals)
+
+    partUp = {i:[b for b in Data.Bids.participantBids[i] if b in model.upBids] for i in list(model.Participants_Battery)+list(model.Participants_Aggregator)}
+    partDown = {i:[b for b in Data.Bids.participantBids[i] if b in model.downBids] for i in list(model.Participants_Battery)+list(model.Participants_Aggregator)}
+
+    #g: Battery storage constraints
+    def batteryStorage_rule(model,i,h):
+        if h%24 == 1:
+            return model.charge[i,h] == Data.Participants[i].Size/2
+        else:
+            return model.charge[i,h] <= Data.Participants[i].Size
+    model.batteryStorage_cons = pyo.Constraint(model.Participants_Battery,model.Hours,rule = batteryStorage_rule)
+
+    #i: State of charge updated
+    def batteryCharge_rule(model,i,h):
+        if h%24 == 1:
+            return pyo.Constraint.Skip
+        else:
+            return model.charge[i,h] == model.charge[i,h-1] - sum( model.clearedUp[b,h]/Data.Participants.batteryEfficiency["Discharge"] for b in partUp[i]) + sum(model.clearedDown[b,h] * Data.Participants.batteryEfficiency["Charge"] for b in partDown[i])
+    model.batteryCharge_cons = pyo.Constraint(model.Participants_Battery,model.Hours,rule = batteryCharge_rule)
+
+    #j: Aggregators must adjust up again after adjusting down.
+    def Aggregator_rule1(model,i,h):
+        if h%24 > 19 or h%24 < 1:
+            return pyo.Constraint.Skip
+        return sum( sum(model.clearedUp[b,h+j] for b in partUp[i]) - sum(model.clearedDown[b,h+j] for b in partDown[i]) for j in range(6)) <= Data.Participants[i].Size*6*0.2
+    model.Aggregator_cons1 = pyo.Constraint(model.Participants_Aggregator,model.Hours, rule = Aggregator_rule1)
+
+    def Aggregator_rule2(model,i):
+        return sum(sum(model.clearedDown[b,h] for b in partDown[i]) - sum(model.clearedUp[b,h] for b in partUp[i]) for h in model.Hours) <= Data.Participants[i].Size * len(model.Hours) * 0.1
+    model.Aggregator_cons2 = pyo.Constraint(model.Participants_Aggregator, rule = Aggregator_rule2)
+
+#%% The three models
+def buildNodal(Data):
+    model = pyo.ConcreteModel()
+    addBids(model,list(Data.Bids.upBids),list(Data.Bids.downBids))
+    addNetwork(model,Data)
+    addParticipants(model,Data)
+
+    #b: The flexibility market must also keep the energy balance
+    flexUp = Data.Bids.getBids("Up","Flex")
+    flexDown = Data.Bids.getBids("Down","Flex")
+    def marketBalance_flex_rule(model,h):
+        return sum(model.clearedUp[b,h] for b in flexUp) - sum(model.clearedDown[b,h] for b in flexDown) == 0
+    model.marketBalance_flex__cons = pyo.Constraint(model.Hours,rule=marketBalance_flex_rule)
+
+    model.obj = pyo.Objective(rule=bidCost,sense=pyo.minimize)
+    model.dual = pyo.Suffix(direction = pyo.Suffix.IMPORT_EXPORT)
+    return model
+
+def buildRedispatch(Data):
+    model = pyo.ConcreteModel()
+    addBids(model,list(Data.Bids.getBids("Up","Re-dispatch")),list(Data.Bids.getBids("Down","Re-dispatch")))
+    addNetwork(model,Data)
+
+    model.obj = pyo.Objective(rule=bidCost,sense=pyo.minimize)
+    model.dual = pyo.Suffix(direction = pyo.Suffix.IMPORT_EXPORT)
+    return model
+
+def buildZonal(Data):
+    model = pyo.ConcreteModel()
+    addBids(model,list(Data.Bids.getBids("Up","Flex")),list(Data.Bids.getBids("Down","Flex")))
+    addParticipants(model,Data)
+
+    model.Nodes = pyo.Set(initialize=Data.System.getNodeList("All"))
+    model.net = pyo.Param(model.Nodes,model.Hours,mutable=True,initialize=0)
+
+    model.Lines = pyo.Set(initialize = Data.System.getLineList("All"))
+    model.capacity = pyo.Param(model.Lines,mutable=True,initialize=0)
+    model.penalty = pyo.Param(mutable=True,initialize=50)
+
+    model.nodeUp = {n:[b for b in Data.Bids.nodeBids[n] if b in model.upBids] for n in model.Nodes}
+    model.nodeDown = {n:[b for b in Data.Bids.nodeBids[n] if b in model.downBids] for n in model.Nodes}
+    model.zoneSource = None                 #Zones, cut lines and zonal PTDFs of each period the zonal part was built for, see setZones
+
+    model.dual = pyo.Suffix(direction = pyo.Suffix.IMPORT_EXPORT)
+    return model
+
+#Replace the zone dependent sets, variables and constraints of the zone clearing model with the zones of the given periods. 
+#The zones and zonal PTDFs of a period are replaced, not changed, when the zones are partitioned again, so the model is kept if it was built from the same objects
+def setZones(model,Data,periods):
+    source = [(Data.Zones.nodes[t],Data.Zones.cutLines[t],Data.ZPTDFs[t]) for t in periods]
+    if model.zoneSource is not None and len(source) == len(model.zoneSource) and all(a is b for old,new in zip(model.zoneSource,source) for a,b in zip(old,new)):
+        return
+    model.zoneSource = source
+    
+    for name in ("obj","lineCap_cons_2","lineCap_cons_1","lineFlow_cons","netProduction_cons","prod","congestion","flow","Lines_2dim","Zones_2dim"):
+        if hasattr(model,name):
+            model.del_component(name)
+
+    zones = {h:Data.Zones.nodes[t] for h,t in enumerate(periods,1)}
+    cutLines = {h:list(dict.fromkeys(Data.Zones.cutLines[t])) for h,t in enumerate(periods,1)}
+
+    model.Zones_2dim = pyo.Set(dimen=2,initialize = [(z,h) for h in model.Hours for z in zones[h]])                               #Z_t
+    model.Lines_2dim = pyo.Set(dimen=2,initialize = [(l,h) for h in model.Hours for l in cutLines[h]])                            #L_t
+
+    model.flow = pyo.Var(model.Lines_2dim)
+    model.congestion = pyo.Var(model.Lines_2dim,within=pyo.NonNegativeReals)
+    model.prod = pyo.Var(model.Zones_2dim)
+
+    model.obj = pyo.Objective(expr=bidCost(model) + sum(model.congestion[l,h] for (l,h) in model.Lines_2dim)*model.penalty,sense=pyo.minimize)
+
+    #c: Find net production in each zone
+    def netProduction_rule(model,z,h):
+        return sum(model.net[n,h] + sum(model.clearedUp[b,h] for b in model.nodeUp[n]) - sum(model.clearedDown[b,h] for b in model.nodeDown[n]) for n in zones[h][z])== model.prod[z,h]
+    model.netProduction_cons = pyo.Constraint(model.Zones_2dim,rule=netProduction_rule)
+
+    #e: Find line flow
+    def lineFlow_rule(model, l, h):
+        return model.flow[l,h] == sum(Data.ZPTDFs[periods[h-1]][l][z]*model.prod[z,h] for z in zones[h])
+    model.lineFlow_cons = pyo.Constraint(model.Lines_2dim, rule=lineFlow_rule)
+
+    #f: Line capacity
+    def lineCap_rule_1(model,l,h):
+        return model.flow[l,h] <= model.capacity[l] + model.congestion[l,h]
+    model.lineCap_cons_1 = pyo.Constraint(model.Lines_2dim,rule=lineCap_rule_1)
+
+    def lineCap_rule_2(model,l,h):
+        return -model.flow[l,h] <= model.capacity[l] + model.congestion[l,h]
+    model.lineCap_cons_2 = pyo.Constraint(model.Lines_2dim,rule=lineCap_rule_2)
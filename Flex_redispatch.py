@@ -8,11 +8,18 @@ Node clearing model
 import pyomo.environ as pyo
 import time
 import copy
-from Flex_supportFunctions import timeString
-
-def Redispatch(Data,Result,day,Context="Ordinary"):
+from Flex_supportFunctions import timeString,metrics
+from Flex_solvers import getSolver
+from Flex_screening import monitorLines,congestedLines,solveScreened
+from Flex_compact import CompactModel
+
+def Redispatch(Data,Result,day,Context="Ordinary",netVolumes=None,screening=False,compact=False):
+    if screening and compact:
+        raise ValueError("Screening is not available for the compact formulation")
     #Tracking running time
     startTime = time.time()
+    name = "Re-dispatch" if Context == "Ordinary" else "Post zonal"
+    span = metrics.start("Build",Model=name,Day=day)
     print("Initilalizing Re-dispatch")
     
     #Create the model object
@@ -23,28 +30,25 @@ def Redispatch(Data,Result,day,Context="Ordinary"):
     model.Nodes = pyo.Set(initialize=Data.System.getNodeList("All"))                                        #N
     model.Lines = pyo.Set(initialize = Data.System.getLineList("All"))                                      #L
 
-    def upBids(model):
-        for b in Data.Bids.upBids:
-            if Data.Bids[b].Participant == "Re-dispatch":
-                yield b
-    model.upBids = pyo.Set(initialize=upBids)
-    
-    def downBids(model):
-        for b in Data.Bids.downBids:
-            if Data.Bids[b].Participant == "Re-dispatch":
-                yield b
-    model.downBids = pyo.Set(initialize=downBids)
+    model.upBids = pyo.Set(initialize = Data.Bids.getBids("Up","Re-dispatch"))
+    model.downBids = pyo.Set(initialize = Data.Bids.getBids("Down","Re-dispatch"))
+
+    #Bid prices and volumes of the day, read from the bid arrays at once
+    price = Data.Bids.periodValues("Price",list(model.upBids)+list(model.downBids),model.Periods)
+    volume = Data.Bids.periodValues("Volume",list(model.upBids)+list(model.downBids),model.Periods)
 
     #%%Model variables
     model.clearedUp = pyo.Var(model.upBids,model.Periods,within=pyo.NonNegativeReals)                                         
     model.clearedDown = pyo.Var(model.downBids,model.Periods,within=pyo.NonNegativeReals)                                             
-    model.flow = pyo.Var(model.Lines,model.Periods)
-    model.prod = pyo.Var(model.Nodes,model.Periods)
+    if not screening and not compact:
+        model.flow = pyo.Var(model.Lines,model.Periods)
+    if not compact:
+        model.prod = pyo.Var(model.Nodes,model.Periods)
 
     
     #%%Objective function
     def ObjFunc(model):
-        return sum(model.clearedUp[b,t]*Data.Bids[b].Price[t] for b in model.upBids for t in model.Periods ) + sum(model.clearedDown[b,t]*Data.Bids[b].Price[t]  for b in model.downBids for t in model.Periods )
+        return sum(model.clearedUp[b,t]*price[b,t] for b in model.upBids for t in model.Periods ) + sum(model.clearedDown[b,t]*price[b,t]  for b in model.downBids for t in model.Periods )
     model.obj = pyo.Objective(rule=ObjFunc,sense=pyo.minimize)
     
     
@@ -56,36 +60,44 @@ def Redispatch(Data,Result,day,Context="Ordinary"):
     model.marketBalance_cons = pyo.Constraint(model.Periods,rule=marketBalance_rule)
     
     
-    #c: Find net production in each node
+    #c: Find net production in each node. The compact formulation has no net production variables, see Flex_compact
     def netProduction_rule(model,n,t):
         if Context == 'Post zonal':
-            return  Data.System.NetVolumes["Zonal"][t][n] + sum(model.clearedUp[b,t] for b in Data.Bids.nodeBids[n] if b in model.upBids) - sum(model.clearedDown[b,t] for b in Data.Bids.nodeBids[n] if b in model.downBids) == model.prod[n,t]
+            return  netVolumes[t][n] + sum(model.clearedUp[b,t] for b in Data.Bids.getBids("Up","Re-dispatch",node=n)) - sum(model.clearedDown[b,t] for b in Data.Bids.getBids("Down","Re-dispatch",node=n)) == model.prod[n,t]
         else:
-            return  Data.System.DA_volumes[t][n]["Net"] + sum(model.clearedUp[b,t] for b in Data.Bids.nodeBids[n] if b in model.upBids) - sum(model.clearedDown[b,t] for b in Data.Bids.nodeBids[n] if b in model.downBids) == model.prod[n,t]
-    model.netProduction_cons = pyo.Constraint(model.Nodes,model.Periods,rule=netProduction_rule)
+            return  Data.System.DA_volumes[t][n]["Net"] + sum(model.clearedUp[b,t] for b in Data.Bids.getBids("Up","Re-dispatch",node=n)) - sum(model.clearedDown[b,t] for b in Data.Bids.getBids("Down","Re-dispatch",node=n)) == model.prod[n,t]
+    if not compact:
+        model.netProduction_cons = pyo.Constraint(model.Nodes,model.Periods,rule=netProduction_rule)
     
     #d: Bid sizes restrict the clearing
     def bidSizes_rule1(model,b,t):
-        return model.clearedUp[b,t] <= Data.Bids[b].Volume[t]
+        return model.clearedUp[b,t] <= volume[b,t]
     model.bidSizes_cons1 = pyo.Constraint(model.upBids,model.Periods,rule=bidSizes_rule1)
     
     def bidSizes_rule2(model,b,t):
-        return model.clearedDown[b,t] <= Data.Bids[b].Volume[t]
+        return model.clearedDown[b,t] <= volume[b,t]
     model.bidSizes_cons2 = pyo.Constraint(model.downBids,model.Periods,rule=bidSizes_rule2)
 
-    #e: Find line flow
-    def lineFlow_rule(model,l, t):
-        return model.flow[l,t] == sum(Data.System.PTDFs[l][n]*model.prod[n,t] for n in model.Nodes)
-    model.lineFlow_cons = pyo.Constraint(model.Lines, model.Periods, rule=lineFlow_rule) 
-    
-    #f: Line capacity
-    def lineCap_rule_1(model,l,t):
-        return model.flow[l,t] <= Data.System.Lines[l].Capacity 
-    model.lineCap_cons_1 = pyo.Constraint(model.Lines,model.Periods,rule=lineCap_rule_1)
-    
-    def lineCap_rule_2(model,l,t):
-        return -model.flow[l,t] <= Data.System.Lines[l].Capacity 
-    model.lineCap_cons_2 = pyo.Constraint(model.Lines,model.Periods,rule=lineCap_rule_2)
+    #e-f: In the compact formulation the line limits are written on the cleared bids (see Flex_compact). With screening, the line flows and capacities are only added for the monitored lines, starting with the lines congested by the net volumes (see Flex_screening)
+    if compact:
+        compactModel = CompactModel(model,Data,netVolumes if Context == 'Post zonal' else None)
+    elif screening:
+        monitorLines(model,Data,congestedLines(Data,model.Periods,netVolumes if Context == 'Post zonal' else None))
+    else:
+        #e: Find line flow
+        def lineFlow_rule(model,l, t):
+            return model.flow[l,t] == sum(Data.System.PTDFs[l][n]*model.prod[n,t] for n in model.Nodes)
+        model.lineFlow_cons = pyo.Constraint(model.Lines, model.Periods, rule=lineFlow_rule) 
+    
+        #f: Line capacity
+        def lineCap_rule_1(model,l,t):
+            return model.flow[l,t] <= Data.System.Lines[l].Capacity 
+        model.lineCap_cons_1 = pyo.Constraint(model.Lines,model.Periods,rule=lineCap_rule_1)
+    
+        def lineCap_rule_2(model,l,t):
+            return -model.flow[l,t] <= Data.System.Lines[l].Capacity 
+        model.lineCap_cons_2 = pyo.Constraint(model.Lines,model.Periods,rule=lineCap_rule_2)
+    metrics.stop(span,Variables=model.nvariables(),Constraints=model.nconstraints())
     
     print("Initilialize finished after {} \n".format(timeString(time.time()-startTime)))
 
@@ -95,41 +107,43 @@ def Redispatch(Data,Result,day,Context="Ordinary"):
     startTime =time.time()
     print("Running Re-dispatch")
     
-    #Deciding the solver
+    #Solving with the selected solver, see Flex_solvers
     model.dual = pyo.Suffix(direction = pyo.Suffix.IMPORT_EXPORT)
-    opt = pyo.SolverFactory("gurobi")
-    result=opt.solve(model,tee=False)
+    if screening:
+        model = solveScreened(model,Data,name)
+    else:
+        result = getSolver().solve(model,name)
+    if compact:
+        model = compactModel
 
         
     print("Model run finished after {} \n".format(timeString(time.time()-startTime)))
     
-    if Context == "Ordinary":
-        Result.read_re(model,Data)
-    elif Context == "Post zonal":
-        Result.read_postZonal(model,Data)
-
+    with metrics.span("Read",Model=name,Day=day):
+        if Context == "Ordinary":
+            Result.read_re(model,Data)
+        elif Context == "Post zonal":
+            Result.read_postZonal(model,Data)
 
 
-#%%Function adapting data object to the zonal solution and doing redispatch, not accounting for redispatch bids accepted in zonal model
-def Redispatch_post(Data,Result,day):
 
+#%%Function finding the net volumes after the zonal clearing, not accounting for redispatch bids accepted in zonal model
+def zonalNetVolumes(Data,Result,day):
     
-    DA_adjusted = {t:{n:Data.System.DA_volumes[t][n]["Net"] for n in Data.System.getNodeList("All")} for t in Data.Periods}
+    periods = list(range((day-1)*24+1,day*24+1))
+    DA_adjusted = {t:{n:Data.System.DA_volumes[t][n]["Net"] for n in Data.System.getNodeList("All")} for t in periods}
     
-    for t in list(range((day-1)*24+1,day*24+1)):
+    for t in periods:
         #Adjusting DA volumes inside of the flexibility area, but do not use the redispatch bids
-        for b in Data.Bids.upBids:
-            if Data.Bids[b].Participant != "Re-dispatch":
-                DA_adjusted[t][Data.Bids[b].Node] += Result.clearedUp["Zonal"][t][b] 
-        for b in Data.Bids.downBids:
-            if Data.Bids[b].Participant != "Re-dispatch":
-                DA_adjusted[t][Data.Bids[b].Node] -= Result.clearedDown["Zonal"][t][b]
-
-    Data.System.NetVolumes["Zonal"] = DA_adjusted
+        for b in Data.Bids.getBids("Up","Flex"):
+            DA_adjusted[t][Data.Bids[b].Node] += Result.clearedUp["Zonal"][t][b] 
+        for b in Data.Bids.getBids("Down","Flex"):
+            DA_adjusted[t][Data.Bids[b].Node] -= Result.clearedDown["Zonal"][t][b]
     
-    Redispatch(Data,Result,day,"Post zonal")
-
-
-
-
+    return DA_adjusted
 
+#%%Function adapting the net volumes to the zonal solution and doing redispatch, not accounting for redispatch bids accepted in zonal model
+#The adjusted net volumes are kept local to the day, so the data object is not changed
+def Redispatch_post(Data,Result,day,screening=False,compact=False):
+    
+    Redispatch(Data,Result,day,"Post zonal",zonalNetVolumes(Data,Result,day),screening,compact)
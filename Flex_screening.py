@@ -0,0 +1,99 @@
+"""
+Created on Mon Mar 20 2023
+
+Anders Ryssdal and Victor Aasvær
+
+Constraint screening of the line capacities in the node clearing and re-dispatch models. A screened model only has the flow and capacity
+constraints of the monitored (line, period) pairs, starting with the lines congested by the net volumes the model starts from, e.g. the DA flow.
+After each solve the flows of all lines are found from the net production with one matrix product, and the limits of the overloaded lines are
+added before the model is solved again. When no line is overloaded the solution is feasible with all limits, so it has the same optimum as the full model
+"""
+import numpy as np
+import pyomo.environ as pyo
+from Flex_supportFunctions import metrics,netArray
+from Flex_solvers import getSolver
+from Flex_System import minPTDF
+
+#Flows up to the capacity plus the tolerance (MW) are not overloaded
+screeningTolerance = 1e-6
+
+
+#%%Finding overloaded lines
+
+#(line, period) pairs with flows (periods x lines, in the order of System.Lines) above the capacity. Lines with infinite capacity are never overloaded
+def overloadedLines(Data,flows,periods):
+    lines = list(Data.System.Lines)
+    capacity = np.array([Data.System.Lines[l].Capacity for l in lines],dtype=float)
+    rows,cols = np.nonzero(np.abs(flows) > capacity + screeningTolerance)
+    return [(lines[c],periods[r]) for r,c in zip(rows,cols)]
+
+#Lines congested by the DA volumes, or by the given {period: {node: volume}} dicts, in the periods of a model
+def congestedLines(Data,periods,netVolumes=None):
+    periods = list(periods)
+    return overloadedLines(Data,Data.System.getFlows(netArray(Data,periods,netVolumes)),periods)
+
+
+#%%Monitored lines of a model
+
+#Flow variables and constraints e-f of the models, indexed by the monitored (line, period) pairs instead of all lines and periods
+def monitorLines(model,Data,pairs):
+    model.Monitored = pyo.Set(dimen=2,ordered=True)
+    model.flow = pyo.Var(model.Monitored)
+    model.lineFlow_cons = pyo.Constraint(model.Monitored)
+    model.lineCap_cons_1 = pyo.Constraint(model.Monitored)
+    model.lineCap_cons_2 = pyo.Constraint(model.Monitored)
+    addLineLimits(model,Data,pairs)
+
+#Only the nodes with a PTDF above minPTDF (see Flex_System) are part of the flow of a line
+def addLineLimits(model,Data,pairs):
+    for l,t in pairs:
+        model.Monitored.add((l,t))
+        PTDFs = Data.System.PTDFs[l]
+        model.lineFlow_cons.add((l,t),model.flow[l,t] == sum(PTDFs[n]*model.prod[n,t] for n in model.Nodes if abs(PTDFs[n]) > minPTDF))
+        model.lineCap_cons_1.add((l,t),model.flow[l,t] <= Data.System.Lines[l].Capacity)
+        model.lineCap_cons_2.add((l,t),-model.flow[l,t] <= Data.System.Lines[l].Capacity)
+
+#Solve a screened model, adding the limits of the overloaded lines until no line is overloaded. Each solve adds at least one pair, so it ends.
+#With Gurobi and HiGHS the model is kept in a persistent solver, so only the added limits are passed on and each solve starts from the last basis.
+#Returns the model as a ScreenedModel, giving the flows of all lines to the read functions in the Result object
+def solveScreened(model,Data,name):
+    periods = list(model.Periods)
+    nodes = list(Data.System.Nodes)
+    backend = getSolver()
+    opt = backend.persistent() if backend.name in ("gurobi","highs") else None
+    with metrics.span("Screening",Model=name) as span:
+        iterations = 0
+        while True:
+            iterations += 1
+            if opt is None:
+                backend.solve(model,name)
+            else:
+                backend.solvePersistent(opt,model,name)
+            values = model.prod.extract_values()
+            flows = Data.System.getFlows(np.array([[values[n,t] for n in nodes] for t in periods],dtype=float))
+            overloaded = [pair for pair in overloadedLines(Data,flows,periods) if pair not in model.Monitored]
+            if not overloaded:
+                break
+            addLineLimits(model,Data,overloaded)
+        span.update(Iterations=iterations,Monitored=len(model.Monitored),Pairs=len(Data.System.Lines)*len(periods))
+    return ScreenedModel(model,flows,periods,list(Data.System.Lines))
+
+#Solved screened model. The flows are the flows of all lines found after the last solve, the other variables and the duals are read from the Pyomo model
+class ScreenedModel:
+    def __init__(self,model,flows,periods,lines):
+        self.model = model
+        self.Periods = periods
+        self.obj = model.obj
+        self.flows = flows
+        self.periods = {t:i for i,t in enumerate(periods)}
+        self.lines = {l:i for i,l in enumerate(lines)}
+
+    def variableValues(self,name,index):
+        if name == "flow":
+            return np.array([self.flows[self.periods[t],self.lines[l]] for l,t in index],dtype=float)
+        values = getattr(self.model,name).extract_values()
+        return np.array([values[i] for i in index],dtype=float)
+
+    def dualValues(self,name,index):
+        constraints = getattr(self.model,name)
+        return np.array([self.model.dual[constraints[i]] for i in index],dtype=float)
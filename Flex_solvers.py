@@ -0,0 +1,209 @@
+"""
+Created on Thu Mar 16 2023
+
+Anders Ryssdal and Victor Aasvær
+
+Solver backends used by the models. A run selects a backend with setSolver(), e.g. Gurobi, HiGHS through its Python bindings (highspy),
+or another LP solver available to Pyomo, such as glpk or cbc. The options for threads, method and tolerances are given once and translated to
+the names used by each solver. Every solve is timed and its status recorded, so backends can be compared with benchmarkSolvers in Flex_metaFunctions
+"""
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import pyomo.environ as pyo
+from scipy.optimize import linprog
+from Flex_supportFunctions import metrics
+
+#The commercial and open-source bindings are optional, a backend can only be used if its package is installed
+try:
+    import gurobipy as gp
+except ImportError:
+    gp = None
+try:
+    import highspy
+except ImportError:
+    highspy = None
+
+
+#%%Names of the methods of each solver
+gurobiMethods = {"auto":-1, "primal":0, "dual":1, "barrier":2}
+highsMethods = {"auto":{"solver":"choose"}, "primal":{"solver":"simplex","simplex_strategy":4}, "dual":{"solver":"simplex","simplex_strategy":1}, "barrier":{"solver":"ipm"}}
+linprogMethods = {"auto":"highs", "primal":"highs-ds", "dual":"highs-ds", "barrier":"highs-ipm"}
+
+
+#%%Backend
+#A solver with its options. The same object solves the Pyomo models, the persistent models and the matrix models, and keeps a log of the solves
+class SolverBackend:
+    def __init__(self,name="gurobi",threads=None,method=None,tolerance=None,options=None):
+        self.name = name                            #"gurobi", "highs" or the name of another solver available to Pyomo
+        self.threads = threads
+        self.method = method                        #"auto", "primal", "dual" or "barrier"
+        self.tolerance = tolerance                  #Feasibility and optimality tolerance
+        self.options = dict(options) if options else {}         #Other options, in the names used by the solver
+        self.solves = []                            #One dict for each solve, with the model, the time, the status and the objective value
+
+        if method is not None and method not in gurobiMethods:
+            raise ValueError("Unknown method {}, use one of {}".format(method,list(gurobiMethods)))
+
+    def __repr__(self):
+        return "SolverBackend({})".format(", ".join("{}={!r}".format(key,val) for key,val in self.settings().items() if val))
+
+    #Settings used to create the same backend in another process
+    def settings(self):
+        return {"name":self.name,"threads":self.threads,"method":self.method,"tolerance":self.tolerance,"options":self.options}
+
+    #Options in the names used by the solver
+    def solverOptions(self):
+        if self.name == "gurobi":
+            options = {"Threads":self.threads, "Method":gurobiMethods.get(self.method), "FeasibilityTol":self.tolerance, "OptimalityTol":self.tolerance}
+        elif self.name == "highs":
+            options = {"threads":self.threads, "primal_feasibility_tolerance":self.tolerance, "dual_feasibility_tolerance":self.tolerance}
+            options.update(highsMethods.get(self.method,{}))
+        else:
+            options = {}
+        options = {key:val for key,val in options.items() if val is not None}
+        options.update(self.options)
+        return options
+
+    #Log of a solve, also added to the span of the solve in the run metrics
+    def record(self,model,seconds,status,objective,span=None):
+        self.solves.append({"Model":model,"Time":seconds,"Status":status,"Objective":objective})
+        if span is not None:
+            span.update({"Status":status,"Objective":objective})
+        if status != "optimal":
+            print("{} finished with status {} using {}".format(model,status,self.name))
+
+    #Table of the solves, one row for each solve
+    def report(self):
+        return pd.DataFrame(self.solves,columns=["Model","Time","Status","Objective"])
+
+    #Number of solves, total time and number of solves that were not optimal, for each model
+    def summary(self):
+        report = self.report()
+        return report.groupby("Model").agg(Solves=("Time","size"),Time=("Time","sum"),NotOptimal=("Status",lambda status: int((status != "optimal").sum())))
+
+    #%%Pyomo models
+    def pyomoSolver(self):
+        opt = pyo.SolverFactory("appsi_highs" if self.name == "highs" else self.name)
+        opt.options.update(self.solverOptions())
+        return opt
+
+    #Solve a Pyomo model, loading the duals into model.dual
+    def solve(self,model,name):
+        opt = self.pyomoSolver()
+        with metrics.span("Solve",Model=name,Solver=self.name) as span:
+            startTime = time.time()
+            result = opt.solve(model,tee=False)
+            self.record(name,time.time()-startTime,str(result.solver.termination_condition),pyo.value(model.obj),span)
+        return result
+
+    #Persistent solver, keeping the model and basis between solves. Only available for Gurobi and HiGHS
+    def persistent(self):
+        if self.name not in ("gurobi","highs"):
+            raise ValueError("There is no persistent interface for {}, use gurobi or highs".format(self.name))
+        opt = pyo.SolverFactory("appsi_" + self.name)
+        opt.options.update(self.solverOptions())
+        return opt
+
+    def solvePersistent(self,opt,model,name):
+        with metrics.span("Solve",Model=name,Solver=self.name) as span:
+            startTime = time.time()
+            result = opt.solve(model)
+            self.record(name,time.time()-startTime,str(result.solver.termination_condition),pyo.value(model.obj),span)
+        return result
+
+    #%%Matrix models
+    #Solve min c*x, s.t. A*x (sense) rhs, lb <= x <= ub, where sense is "<", "=" or ">" for each row.
+    #Returns the primal values, the duals of the rows and the objective value, with the duals as the change of the objective for an increase of the right hand side.
+    #Raises an error if the solve is not optimal, as the Pyomo solvers do, so no values are read from a failed solve
+    def solveMatrix(self,c,A,sense,rhs,lb,ub,name="Matrix"):
+        with metrics.span("Solve",Model=name,Solver=self.name) as span:
+            startTime = time.time()
+            if self.name == "gurobi":
+                x,duals,obj,status = self.solveGurobi(c,A,sense,rhs,lb,ub)
+            elif self.name == "highs" and highspy is not None:
+                x,duals,obj,status = self.solveHighs(c,A,sense,rhs,lb,ub)
+            else:
+                x,duals,obj,status = self.solveLinprog(c,A,sense,rhs,lb,ub)
+            self.record(name,time.time()-startTime,status,obj,span)
+        if status != "optimal":
+            raise RuntimeError("{} finished with status {} using {}, so there is no solution to read".format(name,status,self.name))
+        return x,duals,obj
+
+    def solveGurobi(self,c,A,sense,rhs,lb,ub):
+        if gp is None:
+            raise ImportError("gurobipy is not installed, select another solver with setSolver()")
+        env = gp.Env(params={"OutputFlag":0})
+        m = gp.Model(env=env)
+        for key,val in self.solverOptions().items():
+            m.setParam(key,val)
+        x = m.addMVar(len(c),lb=lb,ub=ub,obj=c)
+        cons = m.addMConstr(A,x,sense,rhs)
+        m.optimize()
+
+        status = "optimal" if m.Status == gp.GRB.OPTIMAL else "status {}".format(m.Status)
+        values,duals,obj = x.X,cons.Pi,m.ObjVal
+        m.dispose()
+        env.dispose()
+        return values,duals,obj,status
+
+    def solveHighs(self,c,A,sense,rhs,lb,ub):
+        h = highspy.Highs()
+        h.setOptionValue("output_flag",False)
+        for key,val in self.solverOptions().items():
+            h.setOptionValue(key,val)
+
+        A = sp.csc_matrix(A)
+        lp = highspy.HighsLp()
+        lp.num_col_ = A.shape[1]
+        lp.num_row_ = A.shape[0]
+        lp.col_cost_ = np.asarray(c,dtype=float)
+        lp.col_lower_ = np.asarray(lb,dtype=float)
+        lp.col_upper_ = np.asarray(ub,dtype=float)
+        lp.row_lower_ = np.where(sense == "<",-np.inf,rhs)
+        lp.row_upper_ = np.where(sense == ">",np.inf,rhs)
+        lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+        lp.a_matrix_.start_ = A.indptr
+        lp.a_matrix_.index_ = A.indices
+        lp.a_matrix_.value_ = A.data
+        h.passModel(lp)
+        h.run()
+
+        status = h.modelStatusToString(h.getModelStatus()).lower()
+        solution = h.getSolution()
+        return np.array(solution.col_value),np.array(solution.row_dual),h.getInfo().objective_function_value,status
+
+    #HiGHS as included in scipy, used for the solvers without a matrix interface
+    def solveLinprog(self,c,A,sense,rhs,lb,ub):
+        A = sp.csr_matrix(A)
+        eq = sense == "="
+        upper = sense == "<"
+        lower = sense == ">"
+        A_ub = sp.vstack([A[upper],-A[lower]],format="csr")
+        b_ub = np.concatenate([rhs[upper],-rhs[lower]])
+        options = {"presolve":True} if self.tolerance is None else {"primal_feasibility_tolerance":self.tolerance,"dual_feasibility_tolerance":self.tolerance}
+        res = linprog(c,A_ub=A_ub if A_ub.shape[0] else None,b_ub=b_ub if A_ub.shape[0] else None,A_eq=A[eq] if eq.any() else None,b_eq=rhs[eq] if eq.any() else None,
+                      bounds=np.column_stack([lb,ub]),method=linprogMethods.get(self.method,"highs"),options=options)
+
+        duals = np.zeros(len(rhs))
+        if res.status == 0:
+            if eq.any():
+                duals[eq] = res.eqlin.marginals
+            ineq = res.ineqlin.marginals if A_ub.shape[0] else np.zeros(0)
+            duals[upper] = ineq[:upper.sum()]
+            duals[lower] = -ineq[upper.sum():]
+        return res.x,duals,res.fun,"optimal" if res.status == 0 else res.message
+
+
+#%%Selected backend, used by all models
+backend = SolverBackend("gurobi")
+
+#Select the backend of the following runs, given as a backend or as a solver name with options
+def setSolver(solver="gurobi",**options):
+    global backend
+    backend = solver if isinstance(solver,SolverBackend) else SolverBackend(solver,**options)
+    return backend
+
+def getSolver():
+    return backend
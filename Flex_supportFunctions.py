@@ -7,40 +7,200 @@ Victor and Anders
 Functions used in flex project
 """
 import numpy as np
-from numpy import matmul
 import pandas as pd
 import math
 import os,sys
+import shutil
 from pathlib import Path
 import json 
+import hashlib
+import time
+from contextlib import contextmanager
+
+#Resource usage of the process, not available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
 
 #%% Load flow calculations
-def LoadFlow(data, Type='DA'):
-    #Create empty array for PTDFs and get dict of PTDFs
-    PTDF = np.empty((len(data.System.Lines), len(data.System.Nodes)))
-    PTDF_dict = data.System.PTDFs
+#Calculate the flow in all lines for the given periods (all periods by default), with one matrix product using the PTDF matrix cached on System,
+#or one solve of the factorised susceptance matrix when the PTDFs are calculated from the line reactances
+def LoadFlow(data, Type='DA', periods=None):
+    if periods is None:
+        periods = data.Periods
+    periods = list(periods)
+    
+    NP,periodIndex = data.System.getNetArray(Type)
+    flows = data.System.getFlows(NP[[periodIndex[t] for t in periods]])
+    
+    return FlowArray(flows,periods,list(data.System.Lines))
+
+#Net volumes of the periods as a (periods x nodes) array in the order of System.Nodes. The DA volumes by default, or the given {period: {node: volume}} dicts
+def netArray(data, periods, netVolumes=None):
+    periods = list(periods)
+    if netVolumes is None:
+        NP,periodIndex = data.System.getNetArray("DA")
+        return NP[[periodIndex[t] for t in periods]]
+    return np.array([[netVolumes[t][n] for n in data.System.Nodes] for t in periods],dtype=float).reshape(len(periods),len(data.System.Nodes))
+
+#Line flows stored as a (periods x lines) array, which can still be indexed like the dict flow[t][l]
+class FlowArray:
+    def __init__(self,array,periods,lines):
+        self.array = array
+        self.periods = {t:i for i,t in enumerate(periods)}
+        self.lines = {l:i for i,l in enumerate(lines)}
+    
+    def __getitem__(self,t):
+        return FlowRow(self.array[self.periods[t]],self.lines)
+    
+    def __iter__(self):
+        return iter(self.periods)
+    
+    def __len__(self):
+        return len(self.periods)
+    
+    def __contains__(self,t):
+        return t in self.periods
+    
+    def keys(self):
+        return self.periods.keys()
+    
+    def items(self):
+        return ((t,self[t]) for t in self.periods)
+    
+    def to_dict(self):
+        return {t:dict(row.items()) for t,row in self.items()}
+
+#The flows of one period, indexed by line
+class FlowRow:
+    def __init__(self,array,lines):
+        self.array = array
+        self.lines = lines
+    
+    def __getitem__(self,l):
+        return float(self.array[self.lines[l]])
     
-    #Define result dict for flow per period
-    flow = {t: {} for t in data.Periods}
+    def __iter__(self):
+        return iter(self.lines)
     
-    #Convert PTDF dict to array
-    for l in data.System.Lines.values():
-        PTDF[l.ID] = np.array(list(PTDF_dict[l.ID].values()))
+    def __len__(self):
+        return len(self.lines)
     
-    NP_dict = data.System.NetVolumes[Type]
+    def __contains__(self,l):
+        return l in self.lines
     
-    #Calculate flow and append to flow dict
-    for t in list(flow.keys()):
-        flow_array = matmul(PTDF, list(NP_dict[t].values()))
-        res = {}
-        for l in data.System.Lines.values():
-            res[l.ID] = flow_array[l.ID]
-        flow[t] = res
-    return flow
+    def keys(self):
+        return self.lines.keys()
+    
+    def values(self):
+        return self.array.tolist()
+    
+    def items(self):
+        return zip(self.lines,self.array.tolist())
+
+#A row where each value is a dict of named fields, e.g. DA_volumes[t][n]["Production"]
+class FieldRow(FlowRow):
+    def __init__(self,array,lines,fields):
+        super().__init__(array,lines)
+        self.fields = fields
+    
+    def __getitem__(self,l):
+        return dict(zip(self.fields,self.array[self.lines[l]].tolist()))
+    
+    def values(self):
+        return [dict(zip(self.fields,value)) for value in self.array.tolist()]
+    
+    def items(self):
+        return zip(self.lines,self.values())
+
+
+#%% Tables stored as binary arrays
+#Table (e.g. flow[t][l]) stored in the .npy files of a binary folder. Nothing is read before the table is used, and the array is then memory-mapped
+#Order gives the columns of each row in the order they were added, and is only stored when some row has other keys or another key order than the table
+class ArrayTable(FlowArray):
+    def __init__(self,arrays,name,periods,keys,order=None,fields=None):
+        self.arrays = arrays
+        self.name = name
+        self.order = order
+        self.fields = fields
+        self.periods = {t:i for i,t in enumerate(periods)}
+        self.lines = {k:i for i,k in enumerate(keys)}
+        self.keyList = list(keys)
+    
+    @property
+    def array(self):
+        return self.arrays[self.name]
+    
+    def __getitem__(self,t):
+        i = self.periods[t]
+        row = self.array[i]
+        lines = self.lines
+        if self.order is not None:
+            columns = self.arrays[self.order][i]
+            columns = columns[columns >= 0]
+            row = row[columns]
+            lines = {self.keyList[j]:k for k,j in enumerate(columns.tolist())}
+        if self.fields:
+            return FieldRow(row,lines,self.fields)
+        return FlowRow(row,lines)
+    
+    #Array of the given rows and keys, for tables where every row has every key
+    def matrix(self,periods,keys):
+        return np.asarray(self.array[np.ix_([self.periods[t] for t in periods],[self.lines[k] for k in keys])])
+
+#The .npy files of a binary folder, memory-mapped the first time they are used. Copy-on-write, so the loaded objects can be changed without changing the files
+class ArrayFolder:
+    def __init__(self,path):
+        self.path = Path(path)
+        self.loaded = {}
+    
+    def __getitem__(self,name):
+        if name not in self.loaded:
+            self.loaded[name] = np.load(self.path / (name + ".npy"),mmap_mode="c")
+        return self.loaded[name]
+
+#Put a table (dict of dicts, or ArrayTable) into arrays as a (rows x keys) array, and return the description used by loadTable
+def storeTable(arrays,name,table,fields=None):
+    periods = list(table)
+    keys = list(dict.fromkeys(k for t in periods for k in table[t]))
+    index = {k:j for j,k in enumerate(keys)}
+    shape = (len(periods),len(keys)) + ((len(fields),) if fields else ())
+    array = np.full(shape,np.nan)
+    order = np.full((len(periods),len(keys)),-1,dtype=int)
+    for i,t in enumerate(periods):
+        row = table[t]
+        columns = [index[k] for k in row]
+        values = list(row.values())
+        if fields:
+            values = [[value[f] for f in fields] for value in values]
+        if columns:
+            array[i,columns] = values
+        order[i,:len(columns)] = columns
+    arrays[name] = array
+    
+    description = {"name":name,"periods":periods,"keys":keys,"order":None,"fields":fields}
+    if (order != np.arange(len(keys))).any():
+        arrays[name + "_order"] = order
+        description["order"] = name + "_order"
+    return description
+
+#Table stored by storeTable
+def loadTable(arrays,description):
+    return ArrayTable(arrays,description["name"],description["periods"],description["keys"],description["order"],description["fields"])
+
+#Plain dicts instead of the tables of an object loaded from binary arrays, so it can be saved as JSON
+def plainTables(value):
+    if isinstance(value,FlowArray):
+        return value.to_dict()
+    elif isinstance(value,dict):
+        return {key:val.to_dict() if isinstance(val,FlowArray) else val for key,val in value.items()}
+    return value
 
 
 #%% Save and load objects that use json. They should only take in our custom objects, and have possibility of pushing to git
-def Save(obj,filename,folder=False,push=False):
+#With binary=True the object is saved with to_arrays() as a folder with one .npy file per table and a meta.json file, which Load memory-maps lazily
+def Save(obj,filename,folder=False,push=False,binary=False):
     #Construct the file path
     if not folder:       
         folder = []
@@ -52,23 +212,37 @@ def Save(obj,filename,folder=False,push=False):
     else:
         path = Path(".") / folder / filename
     
-    #Save object as JSON
+    if binary:
+        arrays = {}
+        meta = obj.to_arrays(arrays)
+        if path.is_file():
+            os.remove(path)
+        elif path.is_dir():
+            shutil.rmtree(path)
+        os.makedirs(path,exist_ok=True)
+        for name,array in arrays.items():
+            np.save(path / (name + ".npy"),array)
+        with open(path / "meta.json","w") as file:
+            json.dump(meta,file)
+        if push:
+            gitUpload(path)
+        return
     
-    Dict = obj.to_dict() 
+    #Save object as JSON. Each component is serialised once, and the text is either written as one file or as one file per component
+    parts = {key:json.dumps(val) for key,val in obj.to_dict().items()}
+    if path.is_dir():
+        shutil.rmtree(path)
     #Check if file size is too large. If it is, save dictionary components seperately
-    if len(json.dumps(Dict)) > 95000000:
+    if sum(len(part) for part in parts.values()) > 95000000:
         if path.is_file():
             os.remove(path)
-            os.makedirs(path,exist_ok=True)
-        elif not os.path.exists(path):
-            os.makedirs(path,exist_ok=True)
-        for key,val in Dict.items():
-            subPath = path / key
-            with open(subPath,"w") as file:
-                json.dump(val,file)
+        os.makedirs(path,exist_ok=True)
+        for key,part in parts.items():
+            with open(path / str(key),"w") as file:
+                file.write(part)
     else:
         with open(path,"w") as file:
-            json.dump(Dict,file)
+            file.write("{" + ", ".join(json.dumps(str(key)) + ": " + part for key,part in parts.items()) + "}")
     
     if push:
         gitUpload(path)
@@ -85,6 +259,12 @@ def Load(Type,filename,folder=False):
             path = path / s
         path = path / filename
     
+    #Binary folder, where only meta.json is read now
+    if os.path.isfile(path / "meta.json"):
+        with open(path / "meta.json", "r") as file:
+            meta = json.load(file)
+        return Type.from_arrays(meta,ArrayFolder(path))
+    
     # Read the file as JSON
     if not os.path.isdir(path):
         with open(path, "r") as file:
@@ -98,20 +278,146 @@ def Load(Type,filename,folder=False):
             
     return Type.from_dict(Dict)
 
+#Hash of the content of an object, from the same tables and meta data as Save(binary=True) writes. An object loaded from a binary folder has the
+#same fingerprint as the object that was saved, so it can be used to check that a resumed run uses the same data
+def fingerprint(obj):
+    arrays = {}
+    meta = obj.to_arrays(arrays)
+    h = hashlib.sha256(json.dumps(meta,sort_keys=True).encode())
+    for name in sorted(arrays):
+        array = np.ascontiguousarray(arrays[name])
+        h.update("{}{}{}".format(name,array.dtype,array.shape).encode())
+        h.update(array.tobytes())
+    return h.hexdigest()[:20]
+
+
+#%% Progress of a long run, stored as json so an interrupted run can be resumed. Each finished step (e.g. a day or a scenario) is written
+#to the file when it is completed, after its results are saved. A manifest is only reused by a run with the same settings
+class RunManifest:
+    def __init__(self,path,settings=None):
+        self.path = Path(path)
+        self.settings = json.loads(json.dumps(settings if settings is not None else {}))
+        self.completed = {}                 #Step as key (as a string), storing a dict with a summary of the step
+        
+        if self.path.is_file():
+            with open(self.path,"r") as file:
+                Dict = json.load(file)
+            if Dict["settings"] != self.settings:
+                changed = sorted(set(Dict["settings"]) | set(self.settings), key=str)
+                changed = [key for key in changed if Dict["settings"].get(key) != self.settings.get(key)]
+                raise ValueError("The run in {} was started with other {}: {}. Use another run ID to start a new run".format(
+                    self.path,", ".join(changed),{key:Dict["settings"].get(key) for key in changed}))
+            self.completed = Dict["completed"]
+    
+    def isDone(self,step):
+        return str(step) in self.completed
+    
+    def complete(self,step,summary=None):
+        self.completed[str(step)] = summary if summary is not None else {}
+        self.save()
+    
+    #The file is replaced in one operation, so an interruption while writing does not leave a broken manifest
+    def save(self):
+        os.makedirs(self.path.parent,exist_ok=True)
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        with open(temporary,"w") as file:
+            json.dump({"settings":self.settings,"completed":self.completed},file)
+        os.replace(temporary,self.path)
+
 
 #%%Class made to mute the print commands from the timer object when they are not wanted. If this was not used, the command window would print "model has started running" for every iteration of the baseModel
 #This method of hiding print calls was gathered from the internet and is not our own creation
 
 
+#All instances write to the same handle to os.devnull, which is opened the first time it is needed and kept open
 class HiddenPrints:
+    devnull = None
+    
     def __enter__(self):
+        if HiddenPrints.devnull is None:
+            HiddenPrints.devnull = open(os.devnull, 'w')
         self._original_stdout = sys.stdout
-        sys.stdout = open(os.devnull, 'w')
+        sys.stdout = HiddenPrints.devnull
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        sys.stdout.close()
         sys.stdout = self._original_stdout
 
+
+#%% Run metrics. Named spans, e.g. the build, solve and read of a model, are timed and stored with their tags, the memory high-water mark of the process
+#and any values added by the caller, such as the size of a model. A span started inside another span inherits its tags, so all spans of a sensitivity,
+#a scenario or a day can be selected from the table. The record of a run is saved as json next to its results, and loaded again with Metrics.load
+class Metrics:
+    def __init__(self,spans=None):
+        self.reset(spans)
+    
+    #Start a new record, or continue the given spans of an earlier record
+    def reset(self,spans=None):
+        self.spans = list(spans) if spans else []
+        self.open = []                          #Tags of the spans that are not stopped, innermost last
+    
+    def start(self,name,**tags):
+        tags = dict(self.open[-1],**tags) if self.open else tags
+        self.open.append(tags)
+        return {"Span":name,**tags,"Start":time.time(),"Depth":len(self.open)-1,"Clock":time.perf_counter()}
+    
+    #Stop a span, adding the given values. Spans started inside it and not stopped, e.g. because of an exception, are closed as well
+    def stop(self,span,**values):
+        span["Time"] = time.perf_counter() - span.pop("Clock")
+        span["Memory"] = peakMemory()
+        span.update(values)
+        del self.open[span["Depth"]:]
+        self.spans.append(span)
+        return span
+    
+    #Span around a block. The yielded dict is the span, so values found in the block can be added to it
+    @contextmanager
+    def span(self,name,**tags):
+        span = self.start(name,**tags)
+        try:
+            yield span
+        finally:
+            self.stop(span)
+    
+    #Spans recorded in another process, given the tags and depth of the open spans of this one
+    def extend(self,spans):
+        tags = self.open[-1] if self.open else {}
+        self.spans += [{**tags,**span,"Depth":span["Depth"]+len(self.open)} for span in spans]
+    
+    #One row for each span, in the order they were stopped
+    def table(self):
+        table = pd.DataFrame(self.spans)
+        if len(table):
+            table["Start"] = pd.to_datetime(table["Start"],unit="s")
+        return table
+    
+    #Number of spans, total time and memory high-water mark grouped by the given columns
+    def summary(self,by=("Span","Model")):
+        table = self.table()
+        by = [column for column in by if column in table.columns]
+        if not len(table) or not by:
+            return table
+        return table.groupby(by,dropna=False).agg(Count=("Time","size"),Time=("Time","sum"),Memory=("Memory","max"))
+    
+    def save(self,path):
+        os.makedirs(os.path.dirname(path) or ".",exist_ok=True)
+        with open(path,"w") as file:
+            json.dump(self.spans,file,default=str)
+    
+    @classmethod
+    def load(cls,path):
+        with open(path,"r") as file:
+            return cls(json.load(file))
+
+#Highest memory use of the process so far in MB, or None where it can not be read
+def peakMemory():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/1024**2 if sys.platform == "darwin" else peak/1024
+
+#Record used by all parts of the model system. runAll and runStreaming start a new record for each run
+metrics = Metrics()
+
 def timeString(seconds):
     hours = math.floor(seconds/3600)
     minutes = math.floor((seconds-hours*3600)/60)
@@ -130,8 +436,8 @@ def timeString(seconds):
 def DA_path(Range):
     i = 1
     paths = []
-    for root, dirs, files in os.walk(os.getcwd()+"\\NordPool datasets",topdown=False):
-            for name in files:
+    for root, dirs, files in os.walk(os.path.join(os.getcwd(),"NordPool datasets"),topdown=False):
+            for name in sorted(files):
                 if i in Range:
                     paths.append(os.path.join(root, name))
                 i += 1
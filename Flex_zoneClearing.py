@@ -7,11 +7,13 @@ Zone clearing model
 """
 import pyomo.environ as pyo
 import time
-from Flex_supportFunctions import timeString
+from Flex_supportFunctions import timeString,metrics
+from Flex_solvers import getSolver
 
 def ZoneClearing(Data,Result,day,penalty = 50):
     #Tracking running time
     startTime = time.time()
+    span = metrics.start("Build",Model="Zonal",Day=day)
     print("Initilalizing zone clearing")
     
     #Create the model object
@@ -22,17 +24,12 @@ def ZoneClearing(Data,Result,day,penalty = 50):
     model.Participants_Battery = pyo.Set(initialize = list(Data.Participants.types["Battery"]))         #I^(Batt)
     model.Participants_Aggregator = pyo.Set(initialize = list(Data.Participants.types["Aggregator"]))   #I^(Aggr)  
     
-    def upBids(model):
-        for b in Data.Bids.upBids:
-            if Data.Bids[b].Participant != "Re-dispatch":
-                yield b
-    model.upBids = pyo.Set(initialize=upBids)
-    
-    def downBids(model):
-        for b in Data.Bids.downBids:
-            if Data.Bids[b].Participant != "Re-dispatch":
-                yield b
-    model.downBids = pyo.Set(initialize=downBids)
+    model.upBids = pyo.Set(initialize = Data.Bids.getBids("Up","Flex"))
+    model.downBids = pyo.Set(initialize = Data.Bids.getBids("Down","Flex"))
+
+    #Bid prices and volumes of the day, read from the bid arrays at once
+    price = Data.Bids.periodValues("Price",list(model.upBids)+list(model.downBids),model.Periods)
+    volume = Data.Bids.periodValues("Volume",list(model.upBids)+list(model.downBids),model.Periods)
                                           
     #The zone sets are defined as two-dimensional sets
     def zoneSets(model):
@@ -59,7 +56,7 @@ def ZoneClearing(Data,Result,day,penalty = 50):
     
     #%%Objective functions
     def ObjFunc(model):
-        return sum(model.clearedUp[b,t]*Data.Bids[b].Price[t] for b in model.upBids for t in model.Periods ) + sum(model.clearedDown[b,t]*Data.Bids[b].Price[t]  for b in model.downBids for t in model.Periods) + sum(model.congestion[l,t] for t in model.Periods for l in Data.Zones.cutLines[t])*penalty
+        return sum(model.clearedUp[b,t]*price[b,t] for b in model.upBids for t in model.Periods ) + sum(model.clearedDown[b,t]*price[b,t]  for b in model.downBids for t in model.Periods) + sum(model.congestion[l,t] for t in model.Periods for l in Data.Zones.cutLines[t])*penalty
     model.obj = pyo.Objective(rule=ObjFunc,sense=pyo.minimize)
     
     
@@ -72,16 +69,16 @@ def ZoneClearing(Data,Result,day,penalty = 50):
     
     #c: Find net production in each zone
     def netProduction_rule(model,z,t):
-        return sum(Data.System.DA_volumes[t][n]["Net"] + sum(model.clearedUp[b,t] for b in Data.Bids.nodeBids[n] if b in model.upBids) - sum(model.clearedDown[b,t] for b in Data.Bids.nodeBids[n] if b in model.downBids) for n in Data.Zones.nodes[t][z])== model.prod[z,t]
+        return sum(Data.System.DA_volumes[t][n]["Net"] + sum(model.clearedUp[b,t] for b in Data.Bids.getBids("Up","Flex",node=n)) - sum(model.clearedDown[b,t] for b in Data.Bids.getBids("Down","Flex",node=n)) for n in Data.Zones.nodes[t][z])== model.prod[z,t]
     model.netProduction_cons = pyo.Constraint(model.Zones_2dim,rule=netProduction_rule)
 
     #d: Bid sizes restrict the clearing
     def bidSizes_rule1(model,b,t):
-        return model.clearedUp[b,t] <= Data.Bids[b].Volume[t]
+        return model.clearedUp[b,t] <= volume[b,t]
     model.bidSizes_cons1 = pyo.Constraint(model.upBids,model.Periods,rule=bidSizes_rule1)
     
     def bidSizes_rule2(model,b,t):
-        return model.clearedDown[b,t] <= Data.Bids[b].Volume[t]
+        return model.clearedDown[b,t] <= volume[b,t]
     model.bidSizes_cons2 = pyo.Constraint(model.downBids,model.Periods,rule=bidSizes_rule2)
 
     #e: Find line flow
@@ -112,20 +109,21 @@ def ZoneClearing(Data,Result,day,penalty = 50):
         if t%24 == 1:
             return pyo.Constraint.Skip
         else:
-            return model.charge[i,t] == model.charge[i,t-1] - sum( model.clearedUp[b,t]/Data.Participants.batteryEfficiency["Discharge"] for b in Data.Bids.participantBids[i] if Data.Bids[b].Direction == "Up") + sum(model.clearedDown[b,t] * Data.Participants.batteryEfficiency["Charge"] for b in Data.Bids.participantBids[i] if Data.Bids[b].Direction == "Down") 
+            return model.charge[i,t] == model.charge[i,t-1] - sum( model.clearedUp[b,t]/Data.Participants.batteryEfficiency["Discharge"] for b in Data.Bids.getBids("Up",participant=i)) + sum(model.clearedDown[b,t] * Data.Participants.batteryEfficiency["Charge"] for b in Data.Bids.getBids("Down",participant=i)) 
     model.batteryCharge_cons = pyo.Constraint(model.Participants_Battery,model.Periods,rule = batteryCharge_rule)
     
     #j: Aggregators must adjust up again after adjusting down. 
     def Aggregator_rule1(model,i,t):
         if t%24 > 19 or t%24 < 1:
             return pyo.Constraint.Skip
-        return sum( sum(model.clearedUp[b,t+j] for b in Data.Bids.participantBids[i] if Data.Bids[b].Direction == "Up") - sum(model.clearedDown[b,t+j] for b in Data.Bids.participantBids[i] if Data.Bids[b].Direction == "Down") for j in range(6)) <= Data.Participants[i].Size*6*0.2 
+        return sum( sum(model.clearedUp[b,t+j] for b in Data.Bids.getBids("Up",participant=i)) - sum(model.clearedDown[b,t+j] for b in Data.Bids.getBids("Down",participant=i)) for j in range(6)) <= Data.Participants[i].Size*6*0.2 
     model.Aggregator_cons1 = pyo.Constraint(model.Participants_Aggregator,model.Periods, rule = Aggregator_rule1)
     
     def Aggregator_rule2(model,i):
-        return sum(sum(model.clearedDown[b,t] for b in Data.Bids.participantBids[i] if Data.Bids[b].Direction == "Down") - sum(model.clearedUp[b,t] for b in Data.Bids.participantBids[i] if Data.Bids[b].Direction == "Up") for t in model.Periods) <= Data.Participants[i].Size * len(model.Periods) * 0.1
+        return sum(sum(model.clearedDown[b,t] for b in Data.Bids.getBids("Down",participant=i)) - sum(model.clearedUp[b,t] for b in Data.Bids.getBids("Up",participant=i)) for t in model.Periods) <= Data.Participants[i].Size * len(model.Periods) * 0.1
     model.Aggregator_cons2 = pyo.Constraint(model.Participants_Aggregator, rule = Aggregator_rule2)
     
+    metrics.stop(span,Variables=model.nvariables(),Constraints=model.nconstraints())
     
     print("Initilialize finished after {} \n".format(timeString(time.time()-startTime)))
     
@@ -135,11 +133,11 @@ def ZoneClearing(Data,Result,day,penalty = 50):
     
     #Solving
     model.dual = pyo.Suffix(direction = pyo.Suffix.IMPORT_EXPORT)
-    opt = pyo.SolverFactory("gurobi")
-    result=opt.solve(model,tee=False)
+    result = getSolver().solve(model,"Zonal")
     
 
     print("Model run finished after {} \n".format(timeString(time.time()-startTime)))
     
-    Result.read_zonal(model,Data)
+    with metrics.span("Read",Model="Zonal",Day=day):
+        Result.read_zonal(model,Data)
     return model
@@ -11,7 +11,8 @@ from Flex_metaFunctions import *
 #%% Load the results used in the paper
 runID= "Final"                                              #The runID used for the results presented in the paper
 
-results,data = loadResults(runID)                           #Load the result objects into the "results" dictionary. The data object used in the runs is also loaded
+results = openResults(runID)                                #Catalog of the stored results, used like a dictionary. A result is loaded when it is first used
+data = results.data                                         #The data object used in the runs, loaded on first use
 
 
 
@@ -20,13 +21,5 @@ results,data = loadResults(runID)                           #Load the result obj
 runID = "New"
 
 results_new,data_new = runAll(runID)                        #Both base cases and sensitivities are run in runAll()
-
-
-#%% Save the new results and data object
-Save(data_new,"Data_{}".format(runID),folder=["Results"])
-for key,val in results_new.items():
-    if isinstance(val,dict):
-        for key2,val2 in val.items():
-            Save(val2,f"{key2}_{runID}",folder={"Results",key})
-    else:
-        Save(val,f"_{runID}",folder={"Results",key})
\ No newline at end of file
+                                                            #The data object and the results are saved to "Results" as soon as they are made,
+                                                            #so if the run stops, running this cell again continues where it stopped
\ No newline at end of file